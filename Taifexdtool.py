@@ -8,35 +8,185 @@ Taifexdtool.py - 期交所資料處理主腳本
 透過 `config.json` 檔案進行設定，並記錄其操作過程。
 同時也會產生已處理檔案的摘要報告。
 """
+import io
 import json
 import os
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import queue
 import csv
 import sqlite3
-import pytz # 用於時區處理
+from collections import Counter, deque
+from contextlib import nullcontext
 from datetime import datetime
+from zoneinfo import ZoneInfo # 標準函式庫的時區資料（取代 pytz）
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from json.encoder import encode_basestring # C 實作的 JSON 字串轉義（不轉換非 ASCII 字元）
+
+try:
+    import orjson # 選用依賴：以 Rust 實作的快速 JSON 序列化
+except ImportError:
+    orjson = None
+
+# 模組層級的日誌記錄器；各函數共用，不需每次呼叫都重新查詢（main 會為其設定處理器）。
+logger = logging.getLogger(__name__)
+
+# main 啟動的日誌 QueueListener（見 stop_log_listener）；同一行程中再次呼叫 main 時會先停止舊的再建立新的。
+_log_listener = None
 
 # 定義台北時區
-TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+TAIPEI_TZ = ZoneInfo('Asia/Taipei')
+
+# 每次開啟資料庫連線時套用的 PRAGMA 設定（見 connect_db）
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",      # 寫入預寫日誌，讀取不會阻塞寫入
+    "synchronous=NORMAL",    # WAL 模式下僅於檢查點時 fsync
+    "temp_store=MEMORY",     # 暫存表與索引放在記憶體
+    "cache_size=-65536",     # 頁面快取 64 MiB（負值單位為 KiB）
+    "mmap_size=268435456",   # 256 MiB 記憶體映射 I/O
+    "wal_autocheckpoint=0",  # 載入期間不在提交時自動檢查點，改由 checkpoint_wal 在結束時執行一次
+)
+
+# 單一 SQL 陳述式可綁定的參數數量上限。SQLite 3.32 之前的預設值為 999，
+# 較新版本為 32766；無法向連線查詢實際上限時（Python 3.11 之前），採用此保守值。
+SQLITE_MAX_VARIABLES = 999
+
+# 視為網址（而非本地檔案路徑）的來源前綴；str.startswith 可直接接受元組，一次比對完成。
+URL_PREFIXES = ('http://', 'https://')
+
+# 每個多列 INSERT 陳述式最多包含的列數。實測約 1000 列時每次呼叫的額外負擔已充分攤提，
+# 再大反而因為組裝參數列表而變慢。
+MULTI_ROW_BATCH_ROWS = 1000
+
+# 執行期間產生的 INSERT 陳述式快取。同一資料表、同一欄數的形狀固定，
+# 每個檔案不必重新組裝 SQL 字串；相同的字串也能命中 sqlite3 的已編譯陳述式快取。
+# 鍵為 (insert_prefix, row_width, batch_size)，或已登錄類型的 (data_type, 欄位定義)。
+_INSERT_SQL_CACHE = {}
+
+# 整個執行期間共用一個交易，累積插入超過此列數時才在檔案之間提交一次，
+# 以減少 fsync 次數，同時限制當機時需重做的工作量。可由設定 'commit_interval_rows' 覆寫。
+COMMIT_INTERVAL_ROWS = 50000
+
+# 逐批讀取本地 CSV、以及逐段切分記憶體中 CSV 字串的區塊大小
+# （字元數，約略值；見 iter_csv_file_rows 與 iter_text_chunks）。
+CSV_READ_CHUNK_CHARS = 1 << 20
+
+# data_json 使用的緊湊 JSON 分隔符（與 orjson 的輸出相同，不含多餘空白）。
+JSON_SEPARATORS = (',', ':')
+
+# 純 ASCII 內容中，除換行字元外會被 str.strip 去除的空白字元（見 iter_csv_text）。
+ASCII_CELL_PADDING = " \t\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# generic_data 的次要索引：(名稱, 建立陳述式)。
+# 不在 init_db 建立，而是在大量載入完成後才建立（見 create_indexes），
+# 避免插入時逐列維護索引的 B-tree。
+GENERIC_DATA_INDEXES = (
+    ("idx_generic_data_source_row",
+     "CREATE INDEX IF NOT EXISTS idx_generic_data_source_row ON generic_data (file_source, row_number)"),
+)
+
+# 已登錄資料類型的欄位定義：data_type -> ((CSV 標頭名稱, 資料表欄位名稱, SQLite 型別), ...)。
+# 預設為空，所有來源以 JSON 存入 generic_data；由設定 'data_type_schemas' 登錄（見 register_data_type_schemas）。
+# 標頭包含某類型的全部欄位時，資料列依欄位直接寫入與類型同名的資料表，不經過 JSON，也可針對個別欄位建立索引。
+DATA_TYPE_SCHEMAS = {}
+
+# 欄位定義可使用的 SQLite 型別（決定欄位的型別親和性）。
+TYPED_COLUMN_TYPES = ("TEXT", "INTEGER", "REAL", "NUMERIC", "BLOB")
+
+# 已登錄類型的資料表由程式建立的欄位；欄位定義不可使用這些名稱（SQLite 的識別碼不分大小寫）。
+TYPED_TABLE_BASE_COLUMNS = ("id", "file_source", "row_number", "timestamp")
+
+# init_db 建立的資料表；資料類型不可與其同名。
+BUILTIN_TABLES = ("generic_data", "generic_headers")
 
 class TaipeiFormatter(logging.Formatter):
     """
     自訂日誌格式化器，使用台北時區並包含毫秒。
+
+    同一秒內的日誌記錄共用已格式化的日期時間字串（以小數秒為界切開的各段），
+    每筆記錄只需補上小數秒；跨秒時才重新轉換時區並呼叫 strftime。
+    同一個格式化器可能由多個處理器（各持有自己的鎖）同時使用，因此鍵與字串片段
+    存放在同一個元組中，以單一次屬性指派整組替換；讀取端只會看到完整的舊值或新值，
+    不會拿到某一秒的鍵配上另一秒的片段，不需另外加鎖。
     """
+    _cache = (None, None) # ((整數秒, datefmt), 以小數秒為界切開、已格式化的字串片段)
+
     def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, tz=pytz.utc) # 從時間戳轉換並設為UTC
-        return dt.astimezone(TAIPEI_TZ) # 轉換為台北時區
+        return datetime.fromtimestamp(timestamp, tz=TAIPEI_TZ) # 直接從時間戳轉換為台北時間
 
     def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created) # 使用轉換後的台北時間
+        if datefmt and "%%" in datefmt: # 含跳脫的 %，無法安全地以 %f 切分格式字串
+            return self.converter(record.created).strftime(datefmt)
+
+        # 與 datetime.fromtimestamp 相同：微秒以四捨六入五成雙取整，進位到下一秒時一併調整。
+        seconds = int(record.created)
+        microseconds = round((record.created - seconds) * 1e6)
+        if microseconds >= 1000000:
+            seconds += 1
+            microseconds -= 1000000
+
+        key = (seconds, datefmt)
+        cached_key, parts = self._cache # 只讀取一次，其他執行緒之後替換快取也不影響本次結果
+        if key != cached_key:
+            dt = self.converter(seconds) # 使用轉換後的台北時間
+            if datefmt:
+                parts = [dt.strftime(part) for part in datefmt.split("%f")]
+            else:
+                iso = dt.isoformat() # ISO格式，小數秒插在第 19 個字元之後
+                parts = [iso[:19] + ".", iso[19:]]
+            self._cache = (key, parts)
+
         if datefmt:
-            s = dt.strftime(datefmt)
+            fraction = f"{microseconds:06d}"
         else:
-            try:
-                s = dt.isoformat(timespec="milliseconds") # ISO格式 含毫秒
-            except TypeError: # 老版本Python可能不支持timespec
-                s = dt.isoformat()
-        return s
+            fraction = f"{microseconds // 1000:03d}" # ISO格式 含毫秒
+        return fraction.join(parts)
+
+def make_row_serializer(header, row_format="object"):
+    """
+    為固定的標頭建立資料列的 JSON 序列化函數。
+
+    `row_format` 為 "array" 時，資料列只序列化為依欄位順序排列的 JSON 陣列，
+    標頭由呼叫端另外儲存一次（見 `insert_serialized_data`），不必在每一列重複欄位名稱。
+
+    同一個檔案的每一列都使用相同的鍵，因此鍵只需在此預先轉義一次；
+    之後每列只需轉義儲存格數值並串接字串，不必建立中間字典，輸出與
+    `json.dumps(dict(zip(header, row)), ensure_ascii=False, separators=(',', ':'))` 完全相同：
+    分隔符後不加空白，非 ASCII 字元也不轉為 Unicode 跳脫序列，每列的 data_json 因此更短。
+    若已安裝 `orjson`，則直接以它序列化字典（速度與預先編譯的樣板相當，輸出格式相同）。標頭含有重複欄位名稱時改走字典路徑，以維持
+    「後出現的欄位覆蓋先前欄位」的語意。
+
+    參數:
+        header (list): 標頭欄位名稱列表。
+        row_format (str, optional): "object"（預設，鍵值對應的 JSON 物件）或 "array"（JSON 陣列）。
+
+    返回:
+        callable: 接受一列字串數值並返回 JSON 字串的函數。
+                  儲存格數值應為字串（CSV 解析的結果一律為字串）。其他型別依序列化路徑而異：
+                  預先轉義鍵的樣板路徑遇到任何非字串數值都會引發 TypeError；
+                  orjson 與字典路徑則照常輸出數字、None 等 JSON 可表示的值，
+                  只有無法序列化為 JSON 的物件才引發 TypeError。
+    """
+    if row_format == "array":
+        if orjson is not None:
+            return lambda row_values: orjson.dumps(row_values).decode("utf-8")
+        return lambda row_values: "[" + ",".join(map(encode_basestring, row_values)) + "]"
+
+    keys = tuple(header)
+    if orjson is not None:
+        return lambda row_values: orjson.dumps(dict(zip(keys, row_values))).decode("utf-8")
+    if len(set(keys)) != len(keys):
+        return lambda row_values: json.dumps(dict(zip(keys, row_values)), ensure_ascii=False, separators=JSON_SEPARATORS)
+
+    key_prefixes = [encode_basestring(key) + ":" for key in keys]
+    def serialize(row_values):
+        return "{" + ",".join([prefix + encode_basestring(value)
+                                for prefix, value in zip(key_prefixes, row_values)]) + "}"
+    return serialize
 
 def load_config(config_path="config.json"):
     """
@@ -57,13 +207,18 @@ def load_config(config_path="config.json"):
         "database_path": "taifex_data.sqlite",  # SQLite 資料庫的預設路徑
         "log_file": "taifexdtool.log",
         "log_level": "INFO",
-        "download_urls": []
+        "download_urls": [],
+        "commit_interval_rows": COMMIT_INTERVAL_ROWS,  # 跨檔案共用交易時，每累積多少列提交一次
+        "parse_workers": 1,  # 大於 1 時以多個行程並行解析來源
+        "row_format": "object",  # "array" 時資料列存為 JSON 陣列，標頭每個來源只存一次
+        "data_type_schemas": {}  # 資料類型 -> [[CSV 標頭名稱, 資料表欄位名稱, SQLite 型別], ...]
     }
     try:
-        if os.path.exists(config_path):
+        # 直接嘗試開啟，而非先 os.path.exists 再開啟：少一次系統呼叫，也避免檢查與開啟之間的競爭情況。
+        try:
             with open(config_path, 'r', encoding='utf-8') as f: # 指定UTF-8讀取
                 return json.load(f)
-        else:
+        except FileNotFoundError:
             with open(config_path, 'w', encoding='utf-8') as f: # 指定UTF-8寫入
                 json.dump(default_config, f, indent=2, ensure_ascii=False)
             # 當設定檔是新建立時，印出更詳細的說明訊息
@@ -72,7 +227,11 @@ def load_config(config_path="config.json"):
                   f"  - 'database_path': 資料庫檔案的路徑 (預設: {default_config['database_path']})\n"
                   f"  - 'log_file': 日誌檔案的名稱 (預設: {default_config['log_file']})\n"
                   f"  - 'log_level': 日誌記錄級別 (例如 INFO, DEBUG, WARNING, ERROR, CRITICAL; 預設: {default_config['log_level']})\n"
-                  f"  - 'download_urls': 要處理的檔案來源 URL 或本地路徑列表 (預設: 空列表 [])")
+                  f"  - 'download_urls': 要處理的檔案來源 URL 或本地路徑列表 (預設: 空列表 [])\n"
+                  f"  - 'commit_interval_rows': 每累積多少插入列提交一次交易 (預設: {default_config['commit_interval_rows']})\n"
+                  f"  - 'parse_workers': 並行解析 CSV 的工作行程數，1 表示逐一串流處理 (預設: {default_config['parse_workers']})\n"
+                  f"  - 'row_format': 資料列的儲存格式，\"object\" 或較精簡的 \"array\" (預設: {default_config['row_format']})\n"
+                  f"  - 'data_type_schemas': 以欄位式資料表儲存的資料類型及其欄位定義 (預設: 空，全部存為 JSON)")
             return default_config
     except (json.JSONDecodeError, FileNotFoundError) as e:
         # 日誌系統設定完成後應使用 logging，若發生嚴重問題則暫時使用 print
@@ -96,65 +255,160 @@ def parse_csv_data(csv_content_string, delimiter=','):
                                       包含清理過的字串數值的資料列。若找不到資料列
                                       或發生錯誤，則返回空列表。
     """
-    logger = logging.getLogger(__name__)
-    if not csv_content_string or not csv_content_string.strip():
+    if not csv_content_string or csv_content_string.isspace(): # isspace 不會像 strip() 一樣複製整份內容
         logger.error("無法解析 CSV：輸入字串為空或僅包含空白。")
         return {"header": [], "rows": []}
 
-    lines = csv_content_string.strip().splitlines()
-    if not lines:
-        logger.error("無法解析 CSV：去除空白後找不到任何行。")
-        return {"header": [], "rows": []}
-    
     try:
-        # 嘗試尋找第一個非空行作為標頭
-        header_index = -1
-        for i, line in enumerate(lines):
-            if line.strip(): # 檢查該行是否不僅是空白
-                header_index = i
-                break
-        
-        if header_index == -1: # 所有行都是空的或空白
+        # 第一個非空白行為標頭，其餘非空白行為資料（見 iter_csv_text）。
+        csv_rows = iter_csv_text(csv_content_string, delimiter)
+        header = next(csv_rows, None)
+        if header is None: # 所有行都是空的或空白
             logger.error("無法解析 CSV：所有行都是空的或空白。")
             return {"header": [], "rows": []}
+        data_rows = list(csv_rows)
 
-        # 使用 csv.reader 進行穩健的 CSV 解析
-        # 標頭行本身
-        header_line_content = lines[header_index]
-        # csv.reader 預期一個可迭代的行序列，所以將單個標頭行作為列表傳遞
-        header_reader = csv.reader([header_line_content], delimiter=delimiter)
-        # 清理標頭儲存格
-        header = [cell.strip() for cell in next(header_reader)]
-
-        data_rows = []
-        # 將後續行作為資料處理
-        if len(lines) > header_index + 1:
-            data_line_iterable = lines[header_index+1:]
-            # 在解析前，從資料列中過濾掉完全空白的行
-            non_empty_data_lines = [line for line in data_line_iterable if line.strip()]
-            if non_empty_data_lines:
-                data_reader = csv.reader(non_empty_data_lines, delimiter=delimiter)
-                for row in data_reader:
-                    # 確保所有儲存格都被處理，即使它們在解析後是空字串
-                    cleaned_row = [cell.strip() if isinstance(cell, str) else cell for cell in row]
-                    # 只有當清理後的行並非完全空白時才添加
-                    if any(cleaned_row): # 檢查 cleaned_row 中是否有任何非空字串
-                         data_rows.append(cleaned_row)
-            
-        logger.info(f"成功解析 CSV 資料。標頭: {header}。資料列數: {len(data_rows)}")
+        logger.info("成功解析 CSV 資料。標頭: %s。資料列數: %d", header, len(data_rows))
         return {"header": header, "rows": data_rows}
 
     except csv.Error as e:
-        logger.error(f"解析 CSV 資料時發生錯誤: {e}")
+        logger.error("解析 CSV 資料時發生錯誤: %s", e)
         return {"header": [], "rows": []}
     except Exception as e: # 捕捉任何其他未預期的錯誤
-        logger.error(f"CSV 解析過程中發生未預期錯誤: {e}")
+        logger.error("CSV 解析過程中發生未預期錯誤: %s", e)
         return {"header": [], "rows": []}
 
+def parse_csv_file(file_path, delimiter=','):
+    """
+    以串流方式逐列解析本地 CSV 檔案，產生標頭列和資料列。
+
+    與 `parse_csv_data` 不同，此函數直接在檔案物件上執行 `csv.reader`，
+    不需先將整個檔案讀成字串再 `splitlines()`，因此記憶體用量只與單列大小相關。
+    第一個產生的值為清理過的標頭列（略過開頭的空白行），
+    之後依序產生清理過且非完全空白的資料列。
+    欄位數與標頭不符的列也會照常產生，由 `serialize_rows` 記錄並略過（仍佔用資料列編號）。
+
+    參數:
+        file_path (str): 本地 CSV 檔案的路徑。
+        delimiter (str, optional): CSV 中使用的分隔符。預設為 ','。
+
+    返回:
+        generator: 依序產生字串列表的產生器（第一個為標頭列）。
+                   若檔案沒有任何非空白行，則不產生任何值。
+                   開啟或解析檔案時的 OSError、UnicodeDecodeError 及 csv.Error 會傳遞給呼叫端。
+    """
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        yield from iter_csv_file_rows(f, delimiter)
+
+def iter_csv_file_rows(f, delimiter=','):
+    """
+    以固定大小的區塊逐批讀取已開啟的 CSV 檔案，產生清理過且非完全空白的列。
+
+    每個區塊以一次 `read` 取得，再以 `readline` 補齊被切斷的最後一行，
+    不必像 `readlines` 先為每一行建立字串再串接。
+    每個區塊都在行尾結束；只要目前為止讀到的區塊都不含 `"`，區塊結尾就不可能落在引號欄位之內，
+    便交給 `iter_csv_text` 以 `str.split` 快速切分（每個區塊只需一次 C 層的引號搜尋）。
+    一旦某個區塊含有引號，該區塊及檔案其餘部分改由單一 `csv.reader` 處理，引號內含換行也能正確解析。
+
+    參數:
+        f (io.TextIOBase): 以 `newline=''` 開啟的文字檔案物件。
+        delimiter (str, optional): CSV 中使用的分隔符。預設為 ','。
+
+    返回:
+        generator: 依序產生字串列表的產生器（第一個即為標頭列）。
+    """
+    while True:
+        chunk = f.read(CSV_READ_CHUNK_CHARS)
+        if not chunk:
+            return
+        if not chunk.endswith('\n'):
+            chunk += f.readline() # 已到檔尾時為空字串
+        if '"' in chunk:
+            # newline='' 的 StringIO 與檔案物件相同，只在 \r、\n、\r\n 處斷行
+            yield from iter_csv_rows(chain(io.StringIO(chunk, newline=''), f), delimiter)
+            return
+        yield from iter_csv_text(chunk, delimiter)
+
+def iter_csv_rows(lines, delimiter=','):
+    """
+    以單一 `csv.reader` 逐列讀取，產生清理過（去除前後空白）且非完全空白的列。
+
+    `iter_csv_text` 與 `iter_csv_file_rows` 在內容含引號時使用此函數；第一個產生的列即為標頭列。
+
+    參數:
+        lines (iterable): 檔案物件、`io.StringIO` 或其他逐行產生字串的可迭代物件。
+        delimiter (str, optional): CSV 中使用的分隔符。預設為 ','。
+
+    返回:
+        generator: 依序產生字串列表的產生器。
+    """
+    # csv.reader 產生的儲存格一定是 str，因此不需逐格檢查型別，可直接交給 str.strip。
+    for row in csv.reader(lines, delimiter=delimiter):
+        cleaned_row = list(map(str.strip, row)) # 由 C 層的 map 逐格呼叫 strip，比串列推導式少一層 Python 迴圈
+        if any(cleaned_row): # 略過完全空白的行
+            yield cleaned_row
+
+def iter_csv_text(csv_content_string, delimiter=','):
+    """
+    逐列解析已在記憶體中的 CSV 字串，產生清理過且非完全空白的列，結果與 `iter_csv_rows` 相同。
+
+    期交所的 CSV 通常不含引號；若內容中沒有 `"`，欄位不可能跨行或包含分隔符，
+    便直接以 `str.split` 切行、切欄，略過 csv 模組的狀態機。
+    否則（或內容含有單獨的 `\\r`，csv 模組會將其視為錯誤）以單一 `csv.reader` 讀取，
+    引號內含換行的欄位也能正確解析。
+
+    內容為純 ASCII 且除換行外不含任何空白字元時，儲存格不可能有需去除的前後空白，
+    連逐格的 `str.strip` 也一併省略。
+
+    快速路徑以行尾對齊的區塊（見 `iter_text_chunks`）逐段切行，不會一次建立整份內容的行列表，
+    額外記憶體只與區塊大小相關。
+
+    參數:
+        csv_content_string (str): CSV 檔案的字串內容。
+        delimiter (str, optional): CSV 中使用的分隔符。預設為 ','。
+
+    返回:
+        generator: 依序產生字串列表的產生器（第一個即為標頭列）。
+    """
+    if '"' in csv_content_string or csv_content_string.count('\r') != csv_content_string.count('\r\n'):
+        yield from iter_csv_rows(io.StringIO(csv_content_string, newline=''), delimiter)
+        return
+    # isascii() 是 O(1)；純 ASCII 時 str.strip 會去除的字元只有下列幾個，各以一次 C 層搜尋檢查。
+    if csv_content_string.isascii() and not any(c in csv_content_string for c in ASCII_CELL_PADDING):
+        for chunk in iter_text_chunks(csv_content_string):
+            for line in chunk.splitlines():
+                if line.strip(delimiter): # 只由分隔符組成的行即為完全空白的列
+                    yield line.split(delimiter)
+        return
+    for chunk in iter_text_chunks(csv_content_string):
+        for line in chunk.split('\n'): # \r\n 行尾的 \r 會隨最後一格的 strip 一併去除
+            cleaned_row = list(map(str.strip, line.split(delimiter)))
+            if any(cleaned_row): # 略過完全空白的行
+                yield cleaned_row
+
+def iter_text_chunks(text):
+    """
+    將字串切成約 `CSV_READ_CHUNK_CHARS` 個字元、且都在 `\\n` 之後結束的片段。
+
+    參數:
+        text (str): 要切分的字串。
+
+    返回:
+        generator: 依序產生片段；串接起來即為原字串。
+    """
+    start, length = 0, len(text)
+    while start < length:
+        end = text.find('\n', start + CSV_READ_CHUNK_CHARS)
+        end = length if end == -1 else end + 1
+        yield text[start:end]
+        start = end
+
 def recognize_data_type(file_path, header, first_data_row):
     """
-    預留函數，用於識別 CSV 檔案的資料類型。
+    識別 CSV 檔案的資料類型。
 
+    標頭包含某個已登錄類型（見 `DATA_TYPE_SCHEMAS`）的全部欄位時，返回該類型
+    （依登錄順序取第一個符合者）；否則返回 "generic_csv"。
     此函數旨在擴展邏輯，以便根據檔案路徑、
     標頭內容和第一行資料來區分不同的 CSV 結構
     （例如，特定的期交所報告格式）。
@@ -166,17 +420,19 @@ def recognize_data_type(file_path, header, first_data_row):
 
     返回:
         str: 一個表示已識別資料類型的字串（例如 "generic_csv"）。
-             目前返回預留值。
+             返回已登錄的類型時，資料會寫入該類型專屬的欄位式資料表。
     """
-    logger = logging.getLogger(__name__)
-    logger.info(f"嘗試識別檔案 '{file_path}' 的資料類型。")
-    logger.debug(f"用於類型識別的標頭: {header}")
-    logger.debug(f"用於類型識別的第一行資料: {first_data_row}")
+    logger.info("嘗試識別檔案 '%s' 的資料類型。", file_path)
+    logger.debug("用於類型識別的標頭: %s", header) # %-格式延遲到實際輸出時才格式化
+    logger.debug("用於類型識別的第一行資料: %s", first_data_row)
     
-    # 預留邏輯：未來將檢查標頭和資料列內容
-    # 以確定特定的期交所 CSV 結構。
-    data_type = "generic_csv" 
-    logger.info(f"檔案 '{file_path}' 的資料類型被識別為: '{data_type}'")
+    header_names = set(header)
+    for data_type, schema in DATA_TYPE_SCHEMAS.items():
+        if all(csv_name in header_names for csv_name, _, _ in schema):
+            break
+    else:
+        data_type = "generic_csv"
+    logger.info("檔案 '%s' 的資料類型被識別為: '%s'", file_path, data_type)
     return data_type
 
 def transform_data(data_type, parsed_data):
@@ -188,20 +444,19 @@ def transform_data(data_type, parsed_data):
 
     參數:
         data_type (str): 由 `recognize_data_type` 決定的資料類型。
-        parsed_data (dict): 包含 `parse_csv_data` 結果中 "header" 和 "rows" 的字典。
+        parsed_data (dict): 包含 "header" 和 "rows" 的字典；"rows" 可能是列表或逐列產生的迭代器。
 
     返回:
         dict: （可能）轉換後的資料，結構與 `parsed_data` 相同。
               目前按原樣返回資料（傳遞）。
     """
-    logger = logging.getLogger(__name__)
-    logger.info(f"嘗試轉換類型為 '{data_type}' 的資料。")
-    logger.debug(f"用於轉換的資料 (前兩列): 標頭: {parsed_data.get('header')}, 資料列: {parsed_data.get('rows', [])[:2]}")
+    logger.info("嘗試轉換類型為 '%s' 的資料。", data_type)
+    logger.debug("用於轉換的資料標頭: %s（資料列以串流方式傳遞）", parsed_data.get('header'))
 
     # 預留邏輯：未來的實作將根據 data_type 修改 parsed_data。
     # 目前按原樣返回資料。
     transformed_data = parsed_data 
-    logger.info(f"類型 '{data_type}' 的資料轉換完成（目前為直接傳遞）。")
+    logger.info("類型 '%s' 的資料轉換完成（目前為直接傳遞）。", data_type)
     return transformed_data
 
 def generate_summary_report(processed_files_summary):
@@ -217,24 +472,25 @@ def generate_summary_report(processed_files_summary):
                                         預期鍵包括 'source', 'status',
                                         'rows_parsed', 'rows_inserted', 'error_message'。
     """
-    logger = logging.getLogger(__name__)
     logger.info("--- 處理摘要報告 ---")
     
     total_files = len(processed_files_summary)
-    successful_files = 0
-    failed_files = 0
+    status_counts = Counter(summary['status'] for summary in processed_files_summary)
+    successful_files = status_counts["成功"]
+    failed_files = total_files - successful_files # 「已略過」等非成功狀態皆計入失敗
+    separator = "-" * 30
     
+    # 每個檔案只呼叫一次日誌（多行訊息），並使用 %-格式延遲格式化，
+    # 避免大量檔案時逐行取得處理器鎖與格式化停用層級的訊息。
     for summary in processed_files_summary:
-        logger.info(f"來源: {summary['source']}")
-        logger.info(f"  狀態: {summary['status']}")
         if summary['status'] == "成功": # Changed "Success" to "成功"
-            successful_files += 1
-            logger.info(f"  已解析列數: {summary.get('rows_parsed', 'N/A')}")
-            logger.info(f"  已插入列數: {summary.get('rows_inserted', 'N/A')}")
+            logger.info("來源: %s\n  狀態: %s\n  已解析列數: %s\n  已插入列數: %s\n%s",
+                        summary['source'], summary['status'],
+                        summary.get('rows_parsed', 'N/A'), summary.get('rows_inserted', 'N/A'), separator)
         else:
-            failed_files += 1
-            logger.error(f"  錯誤: {summary.get('error_message', '無特定錯誤訊息。')}")
-        logger.info("-" * 30)
+            logger.error("來源: %s\n  狀態: %s\n  錯誤: %s\n%s",
+                         summary['source'], summary['status'],
+                         summary.get('error_message', '無特定錯誤訊息。'), separator)
         
     logger.info("--- 整體摘要 ---")
     logger.info(f"總處理檔案數: {total_files}")
@@ -242,22 +498,153 @@ def generate_summary_report(processed_files_summary):
     logger.info(f"失敗檔案數: {failed_files}")
     logger.info("--- 報告結束 ---")
 
-def init_db(db_path):
+def register_data_type_schemas(schemas):
     """
-    初始化 SQLite 資料庫。
+    以設定 'data_type_schemas' 的內容取代已登錄的資料類型欄位定義（見 `DATA_TYPE_SCHEMAS`）。
 
-    連接到由 `db_path` 指定的 SQLite 資料庫。如果資料庫不存在，
-    將會被建立。然後確保必要的資料表（例如 `generic_data`）
-    如果尚不存在，則會被建立。
+    設定格式為 `{"資料類型": [["CSV 標頭名稱", "資料表欄位名稱", "SQLite 型別"], ...], ...}`。
+    資料類型同時作為資料表名稱，不可與內建資料表同名；型別需為 `TYPED_COLUMN_TYPES` 之一。
+    定義無效的類型會記錄錯誤並略過，該類型的來源仍以 JSON 存入 generic_data。
+
+    參數:
+        schemas (dict): 資料類型 -> 欄位定義列表。
+    """
+    DATA_TYPE_SCHEMAS.clear()
+    for data_type, columns in (schemas or {}).items():
+        try:
+            schema = tuple((str(csv_name), str(column), str(sql_type).upper()) for csv_name, column, sql_type in columns)
+        except (TypeError, ValueError) as e:
+            logger.error("資料類型 '%s' 的欄位定義格式錯誤，已略過: %s", data_type, e)
+            continue
+        column_names = [column.lower() for _, column, _ in schema]
+        if (not data_type or data_type.lower() in BUILTIN_TABLES or data_type.lower().startswith("sqlite_")
+                or not schema or len(set(column_names)) != len(column_names)
+                or any(column in TYPED_TABLE_BASE_COLUMNS for column in column_names)
+                or any(sql_type not in TYPED_COLUMN_TYPES for _, _, sql_type in schema)):
+            logger.error("資料類型 '%s' 的欄位定義無效（資料表名稱保留、欄位名稱重複或保留、或型別不支援），已略過。", data_type)
+            continue
+        DATA_TYPE_SCHEMAS[data_type] = schema
+    if DATA_TYPE_SCHEMAS:
+        logger.info("已登錄以欄位式資料表儲存的資料類型: %s", list(DATA_TYPE_SCHEMAS))
+
+def quote_identifier(name):
+    """
+    將名稱轉為 SQLite 的引號識別碼（雙引號包住，內部的雙引號重複一次）。
+
+    參數:
+        name (str): 資料表或欄位名稱。
+
+    返回:
+        str: 可直接放入 SQL 陳述式的識別碼。
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+def create_typed_table(conn, data_type, schema):
+    """
+    若尚不存在，則為已登錄的資料類型建立欄位式資料表（資料表名稱即為 data_type）。
+
+    欄位值以字串綁定，由 SQLite 依欄位型別親和性（type affinity）轉換為數值。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線。
+        data_type (str): 資料類型名稱，同時作為資料表名稱。
+        schema (tuple): `(CSV 標頭名稱, 資料表欄位名稱, SQLite 型別)` 的元組。
+    """
+    column_defs = "".join(f",\n                {quote_identifier(column)} {sql_type}" for _, column, sql_type in schema)
+    conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {quote_identifier(data_type)} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_source TEXT NOT NULL,
+                row_number INTEGER NOT NULL{column_defs},
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+def connect_db(db_path):
+    """
+    開啟 SQLite 資料庫連線並套用寫入導向的 PRAGMA 調校。
+
+    使用 WAL 日誌模式搭配 `synchronous=NORMAL`，每次提交不必再等待完整的 fsync；
+    其餘設定則擴大頁面快取、讓暫存資料留在記憶體並啟用記憶體映射 I/O。
+    `journal_mode` 會保存在資料庫檔案中，其餘 PRAGMA 則只對此連線有效，
+    因此每次連線都需重新套用。自動檢查點已關閉，WAL 檔在載入期間會持續成長，
+    直到呼叫 `checkpoint_wal` 或最後一個連線關閉（SQLite 關閉時會自行檢查點）為止。
+
+    連線以 `isolation_level=None` 開啟，`sqlite3` 模組不會在 DML 前隱式開始交易；
+    交易一律由程式以 `BEGIN IMMEDIATE` 明確開始，並以 `commit()` 結束。
 
     參數:
         db_path (str): SQLite 資料庫的檔案路徑。
+
+    返回:
+        sqlite3.Connection: 已套用 PRAGMA 設定的資料庫連線。
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+def insert_multi_row(cursor, insert_prefix, rows, row_width):
+    """
+    以多列 `VALUES (...), (...), ...` 陳述式批次插入資料列。
+
+    `executemany` 仍會為每一列各執行一次陳述式；將多列合併成單一陳述式
+    可減少 SQLite 的執行步驟與 Python/C 之間的往返次數。每個陳述式包含的列數
+    最多為 `MULTI_ROW_BATCH_ROWS`，並受連線的參數數量上限限制；應在同一個交易中呼叫。
+
+    所有批次刻意共用呼叫端傳入的同一個游標：`Connection.execute` / `executemany`
+    每次呼叫都會另外建立一個新游標，反而較慢。連線未設定 `row_factory`，寫入時沒有額外的資料列轉換。
+
+    參數:
+        cursor (sqlite3.Cursor): 用於執行陳述式的游標。
+        insert_prefix (str): 以 "VALUES " 結尾的 INSERT 陳述式前段，
+                             例如 "INSERT INTO t (a, b) VALUES "。
+        rows (iterable of tuple): 要插入的參數列，每列長度皆為 `row_width`。
+                                  可為產生器；每次只會取出一個批次的資料列。
+        row_width (int): 每列的參數個數。
+
+    返回:
+        int: 已插入的列數。
     """
-    logger = logging.getLogger(__name__)
-    logger.info(f"正在初始化資料庫於: {db_path}")
-    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        max_variables = cursor.connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError: # Python 3.11 之前沒有 getlimit
+        max_variables = SQLITE_MAX_VARIABLES
+    batch_size = max(1, min(MULTI_ROW_BATCH_ROWS, max_variables // row_width))
+    placeholders = "(" + ", ".join("?" * row_width) + ")"
+    cache_key = (insert_prefix, row_width, batch_size)
+    full_batch_sql = _INSERT_SQL_CACHE.get(cache_key)
+    if full_batch_sql is None:
+        full_batch_sql = _INSERT_SQL_CACHE[cache_key] = insert_prefix + ", ".join([placeholders] * batch_size)
+    rows = iter(rows)
+    inserted = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        if len(batch) == batch_size:
+            sql = full_batch_sql # 完整批次共用同一個陳述式字串，可命中陳述式快取
+        else:
+            sql = insert_prefix + ", ".join([placeholders] * len(batch))
+        cursor.execute(sql, list(chain.from_iterable(batch)))
+        inserted += len(batch)
+    return inserted
+
+def init_db(conn):
+    """
+    初始化 SQLite 資料庫。
+
+    使用已開啟的資料庫連線（見 `connect_db`），確保必要的資料表
+    （例如 `generic_data`）如果尚不存在，則會被建立。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線。
+
+    返回:
+        bool: 初始化成功時為 True，發生 SQLite 錯誤時為 False。
+    """
+    logger.info("正在初始化資料庫。")
+    try:
         cursor = conn.cursor()
         
         # 建立 generic_data 資料表
@@ -272,27 +659,133 @@ def init_db(db_path):
             )
         """)
         # 注意：增加了一個時間戳欄位，記錄資料插入的時間。
-        
+
+        # 以 "array" 格式儲存時，每個來源的標頭只在此存一次；
+        # 讀取時以 dict(zip(json.loads(header_json), json.loads(data_json))) 還原為物件。
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS generic_headers (
+                file_source TEXT PRIMARY KEY,
+                header_json TEXT NOT NULL
+            )
+        """)
+
         conn.commit()
         logger.info("資料庫初始化成功。資料表 'generic_data' 已就緒。")
+        return True
     except sqlite3.Error as e:
-        logger.error(f"資料庫初始化期間發生 SQLite 錯誤: {e}")
-    finally:
-        if conn:
-            conn.close()
+        logger.error("資料庫初始化期間發生 SQLite 錯誤: %s", e)
+        return False
+
+def should_drop_indexes(conn, incoming_bytes):
+    """
+    判斷本次載入前是否值得移除 generic_data 的次要索引（見 `drop_indexes`）。
+
+    重建索引與 ANALYZE 的成本與整個資料表的大小成正比；只有在資料表為空，
+    或本次要載入的資料量（來源檔案大小總和）不小於現有資料庫大小時，
+    先移除、載入後重建才比在插入時逐列維護索引划算。
+    兩項檢查都只讀取第一列與頁面計數，不需掃描整個資料表。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線。
+        incoming_bytes (int): 本次要載入的來源檔案大小總和（位元組）。
+
+    返回:
+        bool: 應移除索引時為 True。
+    """
+    try:
+        if conn.execute("SELECT 1 FROM generic_data LIMIT 1").fetchone() is None:
+            return True
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.warning("檢查 generic_data 大小時發生 SQLite 錯誤（保留索引）: %s", e)
+        return False
+    return incoming_bytes >= page_count * page_size
+
+def drop_indexes(conn):
+    """
+    在大量載入前移除 generic_data 的次要索引。
+
+    索引已存在時，每次插入都必須同時更新索引；資料表為空或本次載入量相對較大時
+    （見 `should_drop_indexes`），先移除、載入完成後再以 `create_indexes` 一次重建，成本較低。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線。
+    """
+    try:
+        for index_name, _ in GENERIC_DATA_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"移除索引時發生 SQLite 錯誤（將在插入時維護索引）: {e}")
+
+def create_indexes(conn):
+    """
+    在大量載入完成後建立 generic_data 的次要索引，並更新查詢規劃器的統計資料。
+
+    只有實際建立了索引時才執行需掃描全表的 ANALYZE；索引原本就存在（載入前未移除）時
+    改用 `PRAGMA optimize`，只在統計資料明顯過時時才重新分析。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線。
+
+    返回:
+        bool: 成功時為 True，發生 SQLite 錯誤時為 False。
+    """
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        missing = [create_sql for index_name, create_sql in GENERIC_DATA_INDEXES if index_name not in existing]
+        for create_sql in missing:
+            conn.execute(create_sql)
+        conn.execute("ANALYZE" if missing else "PRAGMA optimize")
+        conn.commit()
+        if missing:
+            logger.info("已建立 generic_data 的索引並更新統計資料。")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"建立索引期間發生 SQLite 錯誤: {e}")
+        return False
+
+def checkpoint_wal(conn):
+    """
+    將 WAL 中的所有頁面寫回資料庫檔案，並把 WAL 檔截斷為零長度。
 
-def insert_data(db_path, file_source, transformed_data):
+    `connect_db` 關閉了自動檢查點，避免插入期間的提交觸發檢查點而造成延遲尖峰；
+    載入完成後由 `main` 呼叫此函數一次。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟且沒有進行中交易的 SQLite 資料庫連線。
+
+    返回:
+        bool: 檢查點完整完成時為 True；被其他連線阻擋或發生 SQLite 錯誤時為 False。
+    """
+    try:
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    except sqlite3.Error as e:
+        logger.warning("執行 WAL 檢查點時發生 SQLite 錯誤: %s", e)
+        return False
+    if busy:
+        logger.warning("WAL 檢查點未能完成（資料庫正被其他連線使用）。")
+        return False
+    logger.info("已完成 WAL 檢查點。")
+    return True
+
+def insert_data(conn, file_source, transformed_data, row_format="object"):
     """
     將轉換後的資料插入 SQLite 資料庫。
 
     `transformed_data` 中的每一列都會被轉換成 JSON 字串（將標頭對應到該列的值），
     並儲存在 `generic_data` 資料表中。
 
+    此函數不會提交交易（見 `insert_serialized_data`），由呼叫端決定何時 `commit`。
+
     參數:
-        db_path (str): SQLite 資料庫的檔案路徑。
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線（由呼叫端負責關閉）。
         file_source (str): 資料來源的識別碼（例如，檔案名稱）。
         transformed_data (dict): 一個包含 "header"（字串列表）和
-                                 "rows"（字串列表的列表）的字典。
+                                 "rows"（字串列表的列表，或逐列產生資料列的迭代器）的字典。
+                                 迭代器會在插入時以串流方式逐批消耗，不會整份載入記憶體。
+        row_format (str, optional): 資料列的儲存格式，見 `make_row_serializer`。
 
     返回:
         tuple: 一個元組 `(success_boolean, count_of_rows_inserted)`。
@@ -300,10 +793,9 @@ def insert_data(db_path, file_source, transformed_data):
                則 `success_boolean` 為 True，否則為 False。
                `count_of_rows_inserted` 是實際插入的列數。
     """
-    logger = logging.getLogger(__name__)
     # 首先檢查輸入結構是否有效
     if not transformed_data or not isinstance(transformed_data, dict):
-        logger.error(f"來源 '{file_source}' 的 'transformed_data' 輸入無效。應為字典。")
+        logger.error("來源 '%s' 的 'transformed_data' 輸入無效。應為字典。", file_source)
         return False, 0 # 輸入結構嚴重錯誤
 
     header = transformed_data.get("header")
@@ -311,71 +803,190 @@ def insert_data(db_path, file_source, transformed_data):
 
     # 如果標頭遺失或不是列表，則表示資料結構有問題。
     if not header or not isinstance(header, list):
-        logger.warning(f"無法為 '{file_source}' 插入資料：標頭遺失或不是列表。")
+        logger.warning("無法為 '%s' 插入資料：標頭遺失或不是列表。", file_source)
         return False, 0 
     
-    # 如果 rows 鍵遺失或其值不是列表，則表示有問題。
-    if rows is None or not isinstance(rows, list): # 明確檢查 None 或類型錯誤
-        logger.warning(f"無法為 '{file_source}' 插入資料：資料列遺失或不是列表。")
+    # 如果 rows 鍵遺失或其值不是列表／迭代器，則表示有問題。
+    if rows is None or isinstance(rows, (str, bytes, dict)) or not hasattr(rows, "__iter__"):
+        logger.warning("無法為 '%s' 插入資料：資料列遺失或不是列表。", file_source)
         return False, 0 
         
     # 如果標頭存在，且 rows 是空列表，則不是錯誤；插入 0 列。
-    if not rows: 
-        logger.info(f"來源 '{file_source}' 無資料列可插入（標頭存在，但資料列列表為空）。")
+    if isinstance(rows, list) and not rows: 
+        logger.info("來源 '%s' 無資料列可插入（標頭存在，但資料列列表為空）。", file_source)
         return True, 0 # 成功「插入」零列。
 
-    conn = None
+    stats = new_row_stats(header, row_format)
+    serialized_rows = serialize_rows(file_source, header, rows, stats, row_format)
+    return insert_serialized_data(conn, file_source, serialized_rows, stats)
+
+def new_row_stats(header, row_format, data_type=None):
+    """
+    建立在序列化與插入之間傳遞的單一來源資訊字典。
+
+    參數:
+        header (list): 標頭列的字串列表。
+        row_format (str): 資料列的儲存格式，見 `make_row_serializer`。
+        data_type (str, optional): 由 `recognize_data_type` 決定的資料類型。
+
+    返回:
+        dict: 含 'rows_seen'（由 `serialize_rows` 或 `typed_rows` 填入）。
+              資料類型已登錄於 `DATA_TYPE_SCHEMAS` 時另含 'data_type'，資料寫入該類型的資料表；
+              否則於 "array" 格式時另含 'header'，由 `insert_serialized_data` 寫入 generic_headers。
+    """
+    stats = {"rows_seen": 0}
+    if data_type in DATA_TYPE_SCHEMAS:
+        stats["data_type"] = data_type # 標頭對應到資料表欄位，不需另外儲存
+    elif row_format == "array":
+        stats["header"] = header
+    return stats
+
+def serialize_rows(file_source, header, rows, stats, row_format="object"):
+    """
+    逐列驗證資料列並序列化為 JSON，產生可直接插入 generic_data 的參數列。
+
+    以產生器實作，可直接餵給批次插入；資料列只被走訪一次，
+    也不會另外保存一份序列化後的副本。長度與標頭不符或無法序列化的資料列會被記錄並略過。
+
+    參數:
+        file_source (str): 資料來源的識別碼（例如，檔案名稱）。
+        header (list): 標頭列的字串列表。
+        rows (iterable): 資料列（字串列表）的列表或迭代器。
+        stats (dict): 走訪結束（或中斷）時，'rows_seen' 會設為已走訪的資料列數。
+        row_format (str, optional): 資料列的儲存格式，見 `make_row_serializer`。
+
+    返回:
+        generator: 依序產生 `(file_source, row_number, data_json)` 元組。
+    """
+    serialize_row = make_row_serializer(header, row_format) # 每個檔案只需預先編譯一次
+    column_count = len(header)
+    idx = -1
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        header = transformed_data["header"]
-        rows_inserted_count = 0
-        
-        for idx, row_values in enumerate(transformed_data["rows"]):
-            if len(header) != len(row_values):
-                logger.warning(f"略過來源 '{file_source}' 的第 {idx} 列：標頭長度 ({len(header)}) 與資料列長度 ({len(row_values)}) 不符。資料列內容: {row_values}")
+        for idx, row_values in enumerate(rows):
+            if len(row_values) != column_count:
+                logger.warning("略過來源 '%s' 的第 %d 列：標頭長度 (%d) 與資料列長度 (%d) 不符。資料列內容: %s", file_source, idx, len(header), len(row_values), row_values)
                 continue
 
-            row_dict = dict(zip(header, row_values))
             try:
-                data_json_string = json.dumps(row_dict, ensure_ascii=False) # ensure_ascii=False for Chinese chars
+                data_json_string = serialize_row(row_values)
             except TypeError as te:
-                logger.error(f"無法將來源 '{file_source}' 的第 {idx} 列序列化為 JSON：{te}。資料列內容: {row_dict}")
+                logger.error("無法將來源 '%s' 的第 %d 列序列化為 JSON：%s。資料列內容: %s", file_source, idx, te, row_values)
                 continue # 略過此列
 
-            cursor.execute("""
-                INSERT INTO generic_data (file_source, row_number, data_json) 
-                VALUES (?, ?, ?)
-            """, (file_source, idx, data_json_string))
-            rows_inserted_count +=1
-            
-        conn.commit()
+            yield (file_source, idx, data_json_string)
+    finally:
+        # 列數由最後的列編號得出，不需在每一列更新計數器。
+        stats["rows_seen"] = idx + 1
+
+def typed_rows(file_source, header, rows, schema, stats):
+    """
+    依 `DATA_TYPE_SCHEMAS` 中的欄位定義，將資料列轉為欄位對齊的插入參數列（不經過 JSON）。
+
+    只取欄位定義中列出的欄位，其餘 CSV 欄位不儲存；空白儲存格存為 NULL。
+    長度與標頭不符的資料列會被記錄並略過（與 `serialize_rows` 相同）。
+
+    參數:
+        file_source (str): 資料來源的識別碼（例如，檔案名稱）。
+        header (list): 標頭列的字串列表，需包含欄位定義中的所有 CSV 標頭名稱。
+        rows (iterable): 資料列（字串列表）的列表或迭代器。
+        schema (tuple): `(CSV 標頭名稱, 資料表欄位名稱, SQLite 型別)` 的元組。
+        stats (dict): 走訪結束（或中斷）時，'rows_seen' 會設為已走訪的資料列數。
+
+    返回:
+        generator: 依序產生 `(file_source, row_number, 欄位值...)` 元組。
+    """
+    column_indexes = [header.index(csv_name) for csv_name, _, _ in schema]
+    column_count = len(header)
+    idx = -1
+    try:
+        for idx, row_values in enumerate(rows):
+            if len(row_values) != column_count:
+                logger.warning("略過來源 '%s' 的第 %d 列：標頭長度 (%d) 與資料列長度 (%d) 不符。資料列內容: %s", file_source, idx, len(header), len(row_values), row_values)
+                continue
+            yield (file_source, idx, *[row_values[i] or None for i in column_indexes])
+    finally:
+        stats["rows_seen"] = idx + 1
+
+def insert_serialized_data(conn, file_source, serialized_rows, stats):
+    """
+    將已序列化的資料列（見 `serialize_rows`）插入 generic_data 資料表；
+    已登錄的資料類型（stats 含 'data_type'）則將 `typed_rows` 的欄位值插入該類型的資料表，需要時先建立資料表。
+
+    此函數不會提交交易：插入包在一個 SAVEPOINT 中，失敗時只回復本檔案的變更，
+    由呼叫端（`main`）決定何時 `commit`，讓多個檔案共用同一個交易。
+
+    參數:
+        conn (sqlite3.Connection): 已開啟的 SQLite 資料庫連線（由呼叫端負責關閉）。
+        file_source (str): 資料來源的識別碼（例如，檔案名稱）。
+        serialized_rows (iterable): `(file_source, row_number, data_json)` 元組的列表或產生器；
+                                    已登錄類型則為 `typed_rows` 產生的欄位值元組。
+        stats (dict): 見 `new_row_stats`。'rows_seen'（走訪過的原始資料列數）在插入完成後讀取；
+                      含 'header' 時，標頭會在同一個 SAVEPOINT 中寫入 generic_headers。
+
+    返回:
+        tuple: 與 `insert_data` 相同的 `(success_boolean, count_of_rows_inserted)`。
+    """
+    try:
+        cursor = conn.cursor()
+
+        # 資料列以多列 VALUES 陳述式插入；SAVEPOINT 讓此檔案可單獨回復，
+        # 而不影響同一個交易中先前已插入的其他檔案。
+        if not conn.in_transaction:
+            # 否則釋放最外層的 SAVEPOINT 會直接提交。IMMEDIATE 在開始時就取得寫入鎖，
+            # 避免之後由讀取鎖升級為寫入鎖時因其他寫入者而失敗。
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("SAVEPOINT insert_data")
+        try:
+            data_type = stats.get("data_type")
+            if data_type is None:
+                insert_prefix = "INSERT INTO generic_data (file_source, row_number, data_json) VALUES "
+                row_width = 3
+                if "header" in stats:
+                    conn.execute("INSERT OR REPLACE INTO generic_headers (file_source, header_json) VALUES (?, ?)",
+                                 (file_source, json.dumps(stats["header"], ensure_ascii=False, separators=JSON_SEPARATORS)))
+            else:
+                schema = DATA_TYPE_SCHEMAS[data_type]
+                create_typed_table(conn, data_type, schema)
+                cache_key = (data_type, schema)
+                insert_prefix = _INSERT_SQL_CACHE.get(cache_key)
+                if insert_prefix is None:
+                    columns = "".join(", " + quote_identifier(column) for _, column, _ in schema)
+                    insert_prefix = _INSERT_SQL_CACHE[cache_key] = (
+                        f"INSERT INTO {quote_identifier(data_type)} (file_source, row_number{columns}) VALUES ")
+                row_width = 2 + len(schema)
+            rows_inserted_count = insert_multi_row(cursor, insert_prefix, serialized_rows, row_width)
+        except BaseException:
+            # 中途停止走訪的產生器要在關閉時才會執行 finally，更新 stats['rows_seen']。
+            if hasattr(serialized_rows, "close"):
+                serialized_rows.close()
+            # 回復失敗（例如 SQLite 已自動回復整個交易，SAVEPOINT 不存在）只記錄下來，
+            # 讓原本的例外繼續傳遞，而不是被回復時的錯誤取代。
+            try:
+                conn.execute("ROLLBACK TO SAVEPOINT insert_data")
+                conn.execute("RELEASE SAVEPOINT insert_data")
+            except sqlite3.Error as rollback_error:
+                logger.error("回復來源 '%s' 的 SAVEPOINT 時發生 SQLite 錯誤: %s", file_source, rollback_error)
+            raise
+        conn.execute("RELEASE SAVEPOINT insert_data")
+        rows_seen = stats["rows_seen"]
         if rows_inserted_count > 0:
-            logger.info(f"已成功從 '{file_source}' 向 '{db_path}' 插入 {rows_inserted_count} 列資料。")
-        elif not transformed_data["rows"]: # 一開始就沒有資料列
-             logger.info(f"transformed_data 中沒有來源 '{file_source}' 的資料列，因此無內容可插入。")
+            logger.info("已成功從 '%s' 插入 %d 列資料。", file_source, rows_inserted_count)
+        elif not rows_seen: # 一開始就沒有資料列
+             logger.info("transformed_data 中沒有來源 '%s' 的資料列，因此無內容可插入。", file_source)
         else: # 有資料列，但全部被略過
-            logger.warning(f"未成功為 '{file_source}' 插入任何資料列（所有資料列可能因錯誤而被略過）。")
-        
+            logger.warning("未成功為 '%s' 插入任何資料列（所有資料列可能因錯誤而被略過）。", file_source)
+
     except sqlite3.Error as e:
-        logger.error(f"為 '{file_source}' 插入資料期間發生 SQLite 錯誤: {e}")
-        if conn:
-            conn.rollback()
+        logger.error("為 '%s' 插入資料期間發生 SQLite 錯誤: %s", file_source, e)
         return False, 0
     except Exception as ex: # 捕捉其他潛在錯誤，例如 zip 或迴圈問題
-        logger.error(f"為 '{file_source}' 插入資料期間發生未預期錯誤: {ex}")
-        if conn:
-            conn.rollback()
+        logger.error("為 '%s' 插入資料期間發生未預期錯誤: %s", file_source, ex)
         return False, 0
-    finally:
-        if conn:
-            conn.close()
-            
+
     if rows_inserted_count > 0:
         return True, rows_inserted_count
-    elif not transformed_data["rows"]: # 無資料列可插入
-        return True, 0 
+    elif not rows_seen: # 無資料列可插入
+        return True, 0
     else: # 有資料列，但無一插入（例如，全部被略過）
         return False, 0
 
@@ -390,31 +1001,241 @@ def download_data(url_or_path):
       - 如果檔案存在，則讀取並返回其文字內容。
       - 如果檔案不存在或發生 IOError，則記錄錯誤並返回 `None`。
 
+    注意：此函數會將整個檔案讀成字串。`main` 處理本地 CSV 時改用 `parse_csv_file`
+    在檔案物件上串流解析，記憶體用量只與單列大小相關；大型檔案請避免使用此函數。
+
     參數:
         url_or_path (str): 要從中獲取資料的 URL 或本地檔案路徑。
 
     返回:
         str 或 None: 如果成功，則為檔案內容的字串，否則為 None。
     """
-    logger = logging.getLogger(__name__) # 獲取日誌記錄器實例
-
-    if url_or_path.startswith('http://') or url_or_path.startswith('https://'):
+    if url_or_path.startswith(URL_PREFIXES):
         # 實際網路下載邏輯的預留位置
-        logger.info(f"尚未實作從 URL '{url_or_path}' 的實際下載功能。")
+        logger.info("尚未實作從 URL '%s' 的實際下載功能。", url_or_path)
         return None
     else: # 本地檔案路徑
-        if os.path.exists(url_or_path):
-            try:
-                with open(url_or_path, 'r', encoding='utf-8') as f: # 指定UTF-8讀取
-                    content = f.read()
-                logger.info(f"已成功從本地檔案「下載」（讀取）資料: {url_or_path}")
-                return content
-            except IOError as e:
-                logger.error(f"讀取本地檔案 '{url_or_path}' 時發生 IOError: {e}")
-                return None
-        else:
-            logger.error(f"找不到本地檔案: {url_or_path}")
+        # 直接嘗試開啟，而非先 os.path.exists 再開啟：少一次系統呼叫，
+        # 也避免檔案在檢查與開啟之間被移除的競爭情況。
+        try:
+            with open(url_or_path, 'r', encoding='utf-8') as f: # 指定UTF-8讀取
+                content = f.read()
+            logger.info("已成功從本地檔案「下載」（讀取）資料: %s", url_or_path)
+            return content
+        except FileNotFoundError:
+            logger.error("找不到本地檔案: %s", url_or_path)
             return None
+        except IOError as e:
+            logger.error("讀取本地檔案 '%s' 時發生 IOError: %s", url_or_path, e)
+            return None
+
+def new_file_summary(source):
+    """
+    建立單一來源的處理摘要字典，預設狀態為失敗。
+
+    參數:
+        source (str): 資料來源的 URL 或本地檔案路徑。
+
+    返回:
+        dict: 包含 'source'、'status'、'downloaded_content_size'、'rows_parsed'、
+              'rows_inserted' 和 'error_message' 的摘要字典。
+    """
+    return {
+        'source': source,
+        'status': '失敗', # Changed from 'Failed'
+        'downloaded_content_size': 0,
+        'rows_parsed': 0,
+        'rows_inserted': 0,
+        'error_message': '處理未開始或過早中斷。'
+    }
+
+def prepare_source(source, current_file_summary):
+    """
+    執行單一來源在插入資料庫之前的步驟：下載/讀取、解析、識別資料類型與轉換。
+
+    資料列不會在此被讀完：返回的 "rows" 是逐列產生的迭代器，由序列化與插入流程
+    一次走訪完畢（解析列數也在該處計算，見 `serialize_rows` 的 stats）。
+    來源無法處理、被略過或沒有資料列時，會更新摘要中的狀態與錯誤訊息並返回 None。
+
+    參數:
+        source (str): 資料來源的 URL 或本地檔案路徑。
+        current_file_summary (dict): 由 `new_file_summary` 建立的摘要，會就地更新。
+
+    返回:
+        tuple 或 None: `(data_type, transformed_data)`，其中 transformed_data 含 "header" 和 "rows"；
+                       在無資料需插入時為 None。
+    """
+    logger.info(f"--- 開始處理來源: {source} ---")
+
+    # 1. 下載資料（URL）或取得本地檔案大小；本地檔案稍後以串流方式直接解析，不整份讀入記憶體。
+    is_url = source.startswith(URL_PREFIXES)
+    if is_url:
+        data_content = download_data(source)
+        content_size = None if data_content is None else len(data_content)
+    else:
+        try:
+            content_size = os.path.getsize(source)
+        except OSError as e:
+            logger.error(f"找不到本地檔案: {source} ({e})")
+            content_size = None
+    if content_size is None:
+        # download_data 會記錄具體原因（檔案未找到、URL 未實作）。
+        # 為摘要擷取一般錯誤。
+        if is_url:
+            current_file_summary['error_message'] = f"下載失敗：URL 下載未實作或無法連線。"
+        else: # 本地檔案
+            current_file_summary['error_message'] = f"下載失敗：找不到檔案 '{source}' 或無法讀取。"
+        logger.warning(f"'{source}' 下載失敗。{current_file_summary['error_message']}")
+        logger.info(f"--- 處理來源結束: {source} (下載失敗) ---")
+        return None
+
+    current_file_summary['downloaded_content_size'] = content_size
+    logger.info(f"已成功下載/讀取 '{source}'。大小: {content_size} 位元組。")
+
+    # 2. 僅在是 CSV 檔案時處理
+    if not source.endswith(".csv"):
+        current_file_summary['status'] = '已略過' # Changed 'Skipped'
+        current_file_summary['error_message'] = "來源不是 CSV 檔案。"
+        logger.info(f"略過非 CSV 來源的 CSV 處理: {source}")
+        logger.info(f"--- 處理來源結束: {source} (已略過非CSV檔案) ---")
+        return None
+
+    # 3. 解析 CSV 資料
+    # 本地檔案以產生器逐列解析；資料列一路串流到資料庫插入，不會先整份載入成列表。
+    logger.info(f"嘗試從 '{source}' 解析 CSV 資料...")
+    try:
+        if is_url:
+            # 下載內容已在記憶體中，但仍逐列解析，不另外建立完整的資料列列表。
+            csv_rows = iter_csv_text(data_content)
+        else:
+            csv_rows = parse_csv_file(source)
+        header = next(csv_rows, [])
+        first_data_row = next(csv_rows, None)
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        logger.error(f"解析 CSV 檔案 '{source}' 時發生錯誤: {e}")
+        header, first_data_row = [], None
+    if not header:
+        current_file_summary['error_message'] = "解析失敗：找不到標頭或 CSV 無效/為空。"
+        logger.warning(f"'{source}' 解析失敗。{current_file_summary['error_message']}")
+        logger.info(f"--- 處理來源結束: {source} (解析失敗) ---")
+        return None
+
+    logger.info(f"已成功從 '{source}' 讀取 CSV 標頭: {header}。")
+
+    # 如果解析後無資料列（例如，僅有標頭的 CSV），則此階段視為「成功」。
+    if first_data_row is None:
+        current_file_summary['status'] = '成功' # Changed 'Success' - 已處理檔案，無資料可插入。
+        current_file_summary['error_message'] = None # 此情況下無錯誤。
+        logger.info(f"來自 '{source}' 的 CSV 有標頭但無資料列可進一步處理或插入。")
+        logger.info(f"--- 處理來源結束: {source} (僅有標頭的CSV) ---")
+        return None
+
+    # 4. 識別資料類型（使用第一行資料）
+    data_type = recognize_data_type(source, header, first_data_row)
+
+    # 將已讀取的第一列接回串流前端；解析→轉換→序列化→插入在同一次走訪中完成，不建立中間列表。
+    parsed_data = {"header": header, "rows": chain([first_data_row], csv_rows)}
+
+    # 5. 轉換資料
+    transformed_data = transform_data(data_type, parsed_data)
+    if not transformed_data: # 目前的直接傳遞邏輯下，理想情況不應發生
+        current_file_summary['error_message'] = "轉換步驟失敗或未返回任何資料。"
+        logger.warning(f"'{source}' 轉換失敗。{current_file_summary['error_message']}")
+        logger.info(f"--- 處理來源結束: {source} (轉換失敗) ---")
+        return None
+
+    return data_type, transformed_data
+
+def serialize_source(source, row_format="object"):
+    """
+    準備單一來源，並返回逐列序列化後、可直接插入的資料列。
+
+    參數:
+        source (str): 資料來源的 URL 或本地檔案路徑。
+        row_format (str, optional): 資料列的儲存格式，見 `make_row_serializer`。
+
+    返回:
+        tuple: `(current_file_summary, serialized_rows, stats)`。
+               `serialized_rows` 是產生器：一般類型產生 `(file_source, row_number, data_json)`，
+               登錄於 `DATA_TYPE_SCHEMAS` 的類型則產生 `(file_source, row_number, 欄位值...)`；
+               在無資料需插入時為 None。`stats` 見 `new_row_stats`。
+    """
+    current_file_summary = new_file_summary(source)
+    prepared = prepare_source(source, current_file_summary)
+    if prepared is None:
+        return current_file_summary, None, None
+    data_type, transformed_data = prepared
+    header = transformed_data["header"]
+    stats = new_row_stats(header, row_format, data_type)
+    if "data_type" in stats:
+        serialized_rows = typed_rows(source, header, transformed_data["rows"], DATA_TYPE_SCHEMAS[data_type], stats)
+    else:
+        serialized_rows = serialize_rows(source, header, transformed_data["rows"], stats, row_format)
+    return current_file_summary, serialized_rows, stats
+
+def parse_and_serialize(source, row_format="object"):
+    """
+    在工作行程中執行的 `serialize_source` 版本：整個檔案在此解析並序列化完畢，
+    返回可跨行程傳遞（pickle）的列表，主行程只需負責寫入資料庫。
+
+    參數:
+        source (str): 資料來源的 URL 或本地檔案路徑。
+        row_format (str, optional): 資料列的儲存格式，見 `make_row_serializer`。
+
+    返回:
+        tuple: 與 `serialize_source` 相同，但 `serialized_rows` 為列表。
+    """
+    current_file_summary, serialized_rows, stats = serialize_source(source, row_format)
+    if serialized_rows is None:
+        return current_file_summary, None, None
+    try:
+        return current_file_summary, list(serialized_rows), stats
+    except Exception as e: # 解析或序列化途中失敗（例如 CSV 格式錯誤）
+        logger.error(f"解析或序列化 '{source}' 時發生錯誤: {e}")
+        current_file_summary['error_message'] = f"解析失敗：{e}"
+        return current_file_summary, None, None
+
+def map_prefetched(executor, fn, items, prefetch):
+    """
+    依輸入順序產生 `executor` 執行 `fn(item)` 的結果，但同時最多只有 `prefetch` 個工作已提交。
+
+    與 `executor.map` 不同，不會一開始就提交所有工作：呼叫端處理（例如插入資料庫）第 N 個結果時，
+    後續最多 `prefetch - 1` 個來源在工作行程中解析，已完成但尚未取用的結果數量也因此有上限，
+    不會在寫入較慢時把所有檔案的序列化資料列都堆在記憶體中。
+
+    參數:
+        executor (concurrent.futures.Executor): 執行工作的執行器。
+        fn (callable): 對每個項目執行的函數。
+        items (iterable): 輸入項目。
+        prefetch (int): 同時提交的工作數上限（至少為 1）。
+
+    返回:
+        generator: 依序產生 `fn(item)` 的結果。
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def stop_log_listener():
+    """
+    停止 main 啟動的日誌 QueueListener：寫出佇列中剩餘的記錄，並關閉其處理器（日誌檔案等）。
+
+    尚未啟動或已停止時不做任何事。模組載入時即註冊為 atexit 函數（只註冊一次），
+    main 在安裝新的 listener 之前也會呼叫，重複執行 main（例如在 Jupyter 中）不會留下開啟的日誌檔案。
+    """
+    global _log_listener
+    if _log_listener is None:
+        return
+    listener, _log_listener = _log_listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+atexit.register(stop_log_listener)
 
 def main():
     """
@@ -428,14 +1249,17 @@ def main():
        對於每個來源：
        a. 下載/讀取資料。
        b. 解析 CSV 資料（如果適用）。
-       c. 識別資料類型（預留功能）。
+       c. 識別資料類型（依設定中登錄的欄位定義）。
        d. 轉換資料（預留功能）。
        e. 將資料插入資料庫。
     5. 產生所有處理活動的摘要報告。
     """
+    global _log_listener
+
     # 載入應用程式設定
     config = load_config()
     db_path = config.get("database_path", "taifex_data.sqlite") # 從設定獲取 db_path
+    commit_interval_rows = config.get("commit_interval_rows", COMMIT_INTERVAL_ROWS)
     processing_summary_list = [] # 初始化列表以儲存每個已處理檔案的摘要
 
     # --- 設定日誌 ---
@@ -450,6 +1274,9 @@ def main():
     formatter = TaipeiFormatter(fmt=log_format, datefmt=date_format)
 
 
+    # 停止上一次 main 啟動的 listener，並關閉其日誌檔案
+    stop_log_listener()
+
     # 清除已有的 handlers，避免在重跑時重複添加
     # 這對於腳本執行可能不是必要的，但在像Jupyter這樣的環境中可能有用
     root_logger = logging.getLogger()
@@ -462,6 +1289,7 @@ def main():
     if app_logger.handlers:
         for handler in app_logger.handlers[:]:
             app_logger.removeHandler(handler)
+            handler.close()
 
 
     # 設定基礎日誌 (basicConfig 會影響 root logger)
@@ -475,35 +1303,51 @@ def main():
     # 檔案處理器
     file_handler = logging.FileHandler(log_file, mode="a", encoding="utf-8")
     file_handler.setFormatter(formatter)
-    logger_to_configure.addHandler(file_handler)
 
     # 控制台處理器
     console_handler = logging.StreamHandler() # 預設為 sys.stderr，可改為 sys.stdout
     console_handler.setFormatter(formatter)
-    logger_to_configure.addHandler(console_handler)
+
+    # 實際的檔案/控制台寫入交給背景執行緒（QueueListener），記錄日誌的呼叫端只需把記錄放入佇列。
+    # 使用多個解析工作行程時改用 multiprocessing.Queue，讓 fork 出的工作行程繼承的 QueueHandler 也能送回主行程。
+    if config.get("parse_workers", 1) > 1:
+        log_queue = multiprocessing.Queue(-1)
+    else:
+        log_queue = queue.Queue(-1)
+    logger_to_configure.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _log_listener.start() # 程式結束時由 stop_log_listener（atexit）寫出佇列中剩餘的記錄
 
     # 防止日誌事件傳播到根日誌記錄器，如果根日誌記錄器有不想要的處理器
     logger_to_configure.propagate = False
 
 
-    logger = logging.getLogger(__name__) # 為本模組獲取日誌記錄器
-
     logger.info(f"設定已載入: {config}")
+    register_data_type_schemas(config.get("data_type_schemas"))
 
     # --- 初始化資料庫 ---
-    init_db(db_path) # 確保在開始處理前資料庫已就緒。
+    # 整個執行期間共用同一個連線，避免每個來源都重新連線並失去已預熱的頁面快取。
+    try:
+        conn = connect_db(db_path)
+    except sqlite3.Error as e:
+        logger.error(f"無法開啟資料庫 '{db_path}': {e}。程式結束。")
+        return
+    init_db(conn) # 確保在開始處理前資料庫已就緒。
 
     # --- 決定要處理的來源 ---
+    # 僅有標頭的 empty_file.csv 是自我測試用的檔案，只有在設定環境變數 TAIFEX_SELFTEST 時
+    # 才會加入預設來源並於執行前後建立/移除，一般執行不會在工作目錄中寫入任何測試檔案。
+    self_test = bool(os.environ.get("TAIFEX_SELFTEST"))
+    empty_csv_test_file = "empty_file.csv"
     download_sources = config.get("download_urls", [])
     if not download_sources: # 如果設定中為空，則使用預設測試檔案。
         logger.info("'download_urls' 在設定中為空。使用預設測試檔案進行示範。")
-        download_sources = ["sample_data.csv", "http://example.com/nonexistent.csv", "non_existent_file.txt", "empty_file.csv"]
+        download_sources = ["sample_data.csv", "http://example.com/nonexistent.csv", "non_existent_file.txt"]
+        if self_test:
+            download_sources.append(empty_csv_test_file)
 
-    # 建立一個空的 CSV 檔案以測試僅有標頭的 CSV 情況。
-    # 注意：這是在此腳本內進行示範/測試用的。
-    # 在生產環境中，測試檔案通常會是專用測試套件的一部分。
-    empty_csv_test_file = "empty_file.csv"
-    if empty_csv_test_file in download_sources: # 僅當它在要處理的列表中時才建立
+    # 建立一個空的 CSV 檔案以測試僅有標頭的 CSV 情況（僅限自我測試）。
+    if self_test and empty_csv_test_file in download_sources:
         try:
             with open(empty_csv_test_file, "w", encoding='utf-8') as f:
                 f.write("欄位A,欄位B\n") # 僅有標頭的最小 CSV
@@ -512,106 +1356,95 @@ def main():
             logger.error(f"無法建立 '{empty_csv_test_file}' 進行測試: {e}")
             # 腳本將繼續執行；如果建立失敗，download_data 將處理檔案未找到的情況。
 
-    # --- 主要處理迴圈，針對每個來源 ---
+    # 索引只在資料表為空或本次載入量相對較大時，才先移除、於載入後重建（見 should_drop_indexes）；
+    # 否則保留索引，由插入逐列維護，避免每次執行都重建整個資料表的索引。
+    incoming_bytes = 0
     for source in download_sources:
-        # 初始化目前來源的摘要。預設為失敗。
-        current_file_summary = {
-            'source': source,
-            'status': '失敗', # Changed from 'Failed'
-            'downloaded_content_size': 0,
-            'rows_parsed': 0,
-            'rows_inserted': 0,
-            'error_message': '處理未開始或過早中斷。'
-        }
-        logger.info(f"--- 開始處理來源: {source} ---")
-        
-        # 1. 下載資料
-        data_content = download_data(source)
-        if data_content is None:
-            # download_data 會記錄具體原因（檔案未找到、URL 未實作）。
-            # 為摘要擷取一般錯誤。
-            if source.startswith('http'):
-                current_file_summary['error_message'] = f"下載失敗：URL 下載未實作或無法連線。"
-            else: # 本地檔案
-                current_file_summary['error_message'] = f"下載失敗：找不到檔案 '{source}' 或無法讀取。"
-            logger.warning(f"'{source}' 下載失敗。{current_file_summary['error_message']}")
-            processing_summary_list.append(current_file_summary)
-            logger.info(f"--- 處理來源結束: {source} (下載失敗) ---")
-            continue # 移至下一個來源
-
-        current_file_summary['downloaded_content_size'] = len(data_content)
-        logger.info(f"已成功下載/讀取 '{source}'。大小: {len(data_content)} 位元組。")
-
-        # 2. 僅在是 CSV 檔案時處理
-        if not source.endswith(".csv"):
-            current_file_summary['status'] = '已略過' # Changed 'Skipped'
-            current_file_summary['error_message'] = "來源不是 CSV 檔案。"
-            logger.info(f"略過非 CSV 來源的 CSV 處理: {source}")
-            processing_summary_list.append(current_file_summary)
-            logger.info(f"--- 處理來源結束: {source} (已略過非CSV檔案) ---")
-            continue
+        if not source.startswith(URL_PREFIXES):
+            try:
+                incoming_bytes += os.path.getsize(source)
+            except OSError:
+                pass # 找不到的檔案稍後由 prepare_source 記錄
+    if should_drop_indexes(conn, incoming_bytes):
+        drop_indexes(conn)
 
-        # 3. 解析 CSV 資料
-        logger.info(f"嘗試從 '{source}' 解析 CSV 資料...")
-        parsed_data = parse_csv_data(data_content)
-        if not parsed_data or not parsed_data.get("header"): # parse_csv_data 在錯誤或空檔案時返回 {"header": [], "rows": []}
-            current_file_summary['error_message'] = "解析失敗：找不到標頭或 CSV 無效/為空。"
-            logger.warning(f"'{source}' 解析失敗。{current_file_summary['error_message']}")
-            processing_summary_list.append(current_file_summary)
-            logger.info(f"--- 處理來源結束: {source} (解析失敗) ---")
-            continue
-        
-        current_file_summary['rows_parsed'] = len(parsed_data.get("rows", []))
-        logger.info(f"已成功從 '{source}' 解析 CSV。標頭: {parsed_data['header']}。資料列數: {current_file_summary['rows_parsed']}。")
-
-        # 如果解析後無資料列（例如，僅有標頭的 CSV），則此階段視為「成功」。
-        if not parsed_data.get("rows"):
-            current_file_summary['status'] = '成功' # Changed 'Success' - 已處理檔案，無資料可插入。
-            current_file_summary['error_message'] = None # 此情況下無錯誤。
-            logger.info(f"來自 '{source}' 的 CSV 有標頭但無資料列可進一步處理或插入。")
-            processing_summary_list.append(current_file_summary)
-            logger.info(f"--- 處理來源結束: {source} (僅有標頭的CSV) ---")
-            continue
+    # --- 主要處理迴圈，針對每個來源 ---
+    # 所有來源共用一個交易（由 insert_serialized_data 在需要時開始），累積超過 commit_interval_rows 列才提交。
+    # parse_workers > 1 時，解析與 JSON 序列化在多個工作行程中並行執行，主行程是唯一的資料庫寫入者；
+    # 否則逐一處理，資料列直接從檔案串流到資料庫。
+    parse_workers = config.get("parse_workers", 1)
+    row_format = config.get("row_format", "object")
+    if row_format not in ("object", "array"):
+        logger.warning("未知的 row_format '%s'，改用預設的 \"object\"。", row_format)
+        row_format = "object"
+    use_workers = parse_workers > 1 and len(download_sources) > 1
+    try:
+        # 工作行程以主行程驗證過的欄位定義初始化，不再重複驗證與記錄錯誤。
+        # 離開 with 區塊時（包括處理途中發生例外）會等待並關閉所有工作行程。
+        with (ProcessPoolExecutor(max_workers=parse_workers, initializer=DATA_TYPE_SCHEMAS.update,
+                                  initargs=(dict(DATA_TYPE_SCHEMAS),)) if use_workers else nullcontext()) as executor:
+            if executor is not None:
+                # 多提交一個工作，讓主行程寫入時每個工作行程仍有來源可解析。
+                prepared_sources = map_prefetched(executor, partial(parse_and_serialize, row_format=row_format),
+                                                  download_sources, parse_workers + 1)
+                logger.info(f"使用 {parse_workers} 個工作行程並行解析來源。")
+            else:
+                prepared_sources = (serialize_source(source, row_format) for source in download_sources)
+
+            rows_since_commit = 0
+            for current_file_summary, serialized_rows, stats in prepared_sources:
+                source = current_file_summary['source']
+                if serialized_rows is None: # 下載失敗、略過或無資料列等情況，摘要已由 prepare_source 填寫
+                    processing_summary_list.append(current_file_summary)
+                    continue
+
+                # 6. 將資料插入資料庫
+                logger.info(f"嘗試將來自 '{source}' 的資料插入資料庫 '{db_path}'...")
+                insert_success, num_inserted = insert_serialized_data(conn, source, serialized_rows, stats)
+                rows_parsed = current_file_summary['rows_parsed'] = stats['rows_seen']
+                current_file_summary['rows_inserted'] = num_inserted
+                logger.info(f"已從 '{source}' 解析 {rows_parsed} 列資料。")
+                if insert_success:
+                    current_file_summary['status'] = '成功' # Changed 'Success'
+                    current_file_summary['error_message'] = None
+                    logger.info(f"'{source}' 的資料庫插入完成。已插入 {num_inserted} 列。")
+                else:
+                    # insert_serialized_data 會記錄特定的 SQLite 錯誤。
+                    current_file_summary['error_message'] = f"資料庫插入失敗。錯誤前已插入 {num_inserted} 列，若全部失敗則為 0。請檢查日誌。"
+                    logger.error(f"'{source}' 資料庫插入失敗。{current_file_summary['error_message']}")
+                    # 狀態保持 '失敗'
+
+                processing_summary_list.append(current_file_summary)
+                logger.info(f"--- 處理來源結束: {source} ---")
+
+                rows_since_commit += num_inserted
+                if rows_since_commit >= commit_interval_rows:
+                    conn.commit()
+                    logger.debug("已提交交易（累積 %d 列）。", rows_since_commit)
+                    rows_since_commit = 0
 
-        # 4. 識別資料類型（使用第一行資料）
-        first_data_row = parsed_data["rows"][0]
-        data_type = recognize_data_type(source, parsed_data["header"], first_data_row)
-        # 這是一個預留功能，因此尚無特定錯誤處理。
-
-        # 5. 轉換資料
-        transformed_data = transform_data(data_type, parsed_data)
-        if not transformed_data: # 目前的直接傳遞邏輯下，理想情況不應發生
-            current_file_summary['error_message'] = "轉換步驟失敗或未返回任何資料。"
-            logger.warning(f"'{source}' 轉換失敗。{current_file_summary['error_message']}")
-            processing_summary_list.append(current_file_summary)
-            logger.info(f"--- 處理來源結束: {source} (轉換失敗) ---")
-            continue
-        
-        # 6. 將資料插入資料庫
-        logger.info(f"嘗試將來自 '{source}' 的資料插入資料庫 '{db_path}'...")
-        insert_success, num_inserted = insert_data(db_path, source, transformed_data)
-        current_file_summary['rows_inserted'] = num_inserted
-        if insert_success:
-            current_file_summary['status'] = '成功' # Changed 'Success'
-            current_file_summary['error_message'] = None
-            logger.info(f"'{source}' 的資料庫插入完成。已插入 {num_inserted} 列。")
-        else:
-            # insert_data 會記錄特定的 SQLite 錯誤。
-            current_file_summary['error_message'] = f"資料庫插入失敗。錯誤前已插入 {num_inserted} 列，若全部失敗則為 0。請檢查日誌。"
-            logger.error(f"'{source}' 資料庫插入失敗。{current_file_summary['error_message']}")
-            # 狀態保持 '失敗'
-        
-        processing_summary_list.append(current_file_summary)
-        logger.info(f"--- 處理來源結束: {source} ---")
+        try:
+            conn.commit() # 提交最後一批尚未提交的資料列
+        except sqlite3.Error as e:
+            logger.error(f"提交交易時發生 SQLite 錯誤: {e}")
+        create_indexes(conn)
+    finally:
+        # 處理途中發生例外時，捨棄尚未提交的資料列；無論成功與否都檢查點並關閉連線。
+        if conn.in_transaction:
+            conn.rollback()
+        checkpoint_wal(conn)
+        conn.close()
 
     # --- 產生最終摘要報告 ---
     generate_summary_report(processing_summary_list)
 
     # 清理測試用的 empty_file.csv（如果已建立）
-    if empty_csv_test_file in download_sources and os.path.exists(empty_csv_test_file):
+    if self_test and empty_csv_test_file in download_sources:
         try:
             os.remove(empty_csv_test_file)
             logger.info(f"已清理測試檔案: '{empty_csv_test_file}'。")
+        except FileNotFoundError:
+            pass # 建立失敗時檔案本就不存在
         except OSError as e:
             logger.error(f"移除測試檔案 '{empty_csv_test_file}' 時發生錯誤: {e}")
 
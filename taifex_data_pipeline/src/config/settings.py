@@ -53,7 +53,20 @@ SUPPORTED_MIME_TYPES = {
     "application/x-empty": "text", # 空檔案的可能MIME類型
     "inode/x-empty": "text" # 空檔案的可能MIME類型
 }
+# 上述分類中需要解壓縮的壓縮檔分類 以及可直接剖析的文字分類
+ARCHIVE_CATEGORIES = frozenset({"zip", "rar", "7z", "gz", "tar", "bz2"})
+TEXT_CATEGORIES = frozenset({"text", "csv"})
 
 # 檔案處理相關設定
 # 預設檔案編碼
 DEFAULT_ENCODING = "utf-8"
+# 檔案開頭不是合法 UTF-8 且無 BOM 時改用的編碼 (期交所下載的 CSV 多為 Big5/cp950)
+FALLBACK_ENCODING = "cp950"
+# 單一 gzip 檔案達到此大小 (位元組) 且系統有 pugz 或 pigz 時 改用其多執行緒解壓
+PARALLEL_GZIP_MIN_BYTES = 100 * 1024 * 1024
+
+# 寫入資料庫時每次交給 executemany 的列數 (同一檔案仍在單一交易內)
+INSERT_BATCH_ROWS = 10000
+
+# 同一個上傳檔案解壓出多個CSV時 並行剖析的行程數 (設為 1 則在主行程依序串流剖析)
+PARSE_WORKERS = os.cpu_count() or 1
@@ -0,0 +1,21 @@
+# src/config/templates.py
+# -*- coding: utf-8 -*-
+# 資料格式範本：依 CSV 表頭識別資料類型
+
+# 已登錄的資料格式範本 資料類型 -> 識別所需的表頭欄位
+# 表頭包含某範本的全部欄位時識別為該類型 (依登錄順序取第一個) 其資料以表頭為欄位存入與類型同名的資料表
+# (見 database.ensure_table_for) 不經 JSON 序列化 未符合任何範本的檔案為 generic_csv 以 JSON 存入 generic_data
+# 預設為空 例如 {"futures_daily": ("交易日期", "契約", "收盤價")}
+# 同一類型的檔案表頭需完全相同 表頭不同的檔案會改存 generic_data
+DATA_TYPE_TEMPLATES = {}
+
+# 未符合任何範本時的資料類型
+GENERIC_DATA_TYPE = "generic_csv"
+
+def match_data_type(header):
+    # 返回表頭符合的第一個範本的資料類型 都不符合時返回 GENERIC_DATA_TYPE
+    header_fields = set(header)
+    for data_type, required_fields in DATA_TYPE_TEMPLATES.items():
+        if all(field in header_fields for field in required_fields):
+            return data_type
+    return GENERIC_DATA_TYPE
@@ -4,14 +4,19 @@
 
 import os
 import shutil # 用於清理臨時目錄
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
 try:
-    from .utils.logger import get_logger
+    from .utils.logger import get_logger, start_worker_log_listener, setup_worker_logger
     from .utils import reporter
     from .pipeline import file_handler
     from .pipeline import parser
     from .pipeline import database
     from .config import settings
+    from .config import templates
 except ImportError:
     # Fallback for direct execution or testing
     import sys
@@ -19,15 +24,53 @@ except ImportError:
     project_root_for_direct_run = os.path.dirname(os.path.dirname(current_script_path)) # Moves up to taifex_data_pipeline
     if project_root_for_direct_run not in sys.path:
         sys.path.insert(0, project_root_for_direct_run)
-    from src.utils.logger import get_logger # type: ignore
+    from src.utils.logger import get_logger, start_worker_log_listener, setup_worker_logger # type: ignore
     from src.utils import reporter # type: ignore
     from src.pipeline import file_handler # type: ignore
     from src.pipeline import parser # type: ignore
     from src.pipeline import database # type: ignore
     from src.config import settings # type: ignore
+    from src.config import templates # type: ignore
 
 logger = get_logger()
 
+def _parse_worker(file_path):
+    # 在子行程中剖析單一 CSV 檔案 返回可 pickle 的 (表頭, 資料列列表)
+    parsed_data = parser.parse_csv_file(file_path) # 使用預設編碼和分隔符
+    return parsed_data["header"], parsed_data["rows"]
+
+def _iter_parsed_files(file_paths):
+    # 依 file_paths 的順序產生每個檔案的 (表頭, 資料列)
+    # 只有一個檔案或 settings.PARSE_WORKERS 為 1 時 在本行程以串流方式剖析 資料列為迭代器
+    # 否則交由行程池並行剖析 最多 workers + 1 個檔案同時在處理中 避免結果堆積在記憶體
+    # 資料庫寫入仍只在呼叫端 (主行程) 進行 SQLite 同一時間只允許一個寫入者
+    workers = min(settings.PARSE_WORKERS, len(file_paths))
+    if workers <= 1:
+        for file_path in file_paths:
+            yield parser.parse_csv_stream(file_path) # 使用預設編碼和分隔符
+        return
+
+    # 不使用 fork: 主行程此時已有日誌 QueueListener 執行緒與快取的 SQLite 連線 fork 會把連線
+    # 以及其他執行緒當下持有的鎖複製到子行程 改以 forkserver (無則 spawn) 從乾淨的行程啟動
+    # 子行程的日誌經由跨行程佇列送回主行程寫出 (見 setup_worker_logger)
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    mp_context = multiprocessing.get_context(start_method)
+    log_queue, log_listener = start_worker_log_listener(mp_context)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=setup_worker_logger,
+                                 initargs=(log_queue, logger.getEffectiveLevel())) as executor:
+            remaining_paths = iter(file_paths)
+            pending = deque(executor.submit(_parse_worker, file_path)
+                            for file_path in islice(remaining_paths, workers + 1))
+            while pending:
+                header, rows = pending.popleft().result()
+                next_path = next(remaining_paths, None)
+                if next_path is not None:
+                    pending.append(executor.submit(_parse_worker, next_path))
+                yield header, rows
+    finally:
+        log_listener.stop() # 子行程都已結束 寫出佇列中剩餘的記錄
+
 def process_single_file(uploaded_file_path, db_path, temp_base_dir):
     # 處理單一上傳檔案的完整流程
     # Args:
@@ -38,9 +81,10 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
     #     bool: True 表示整體處理成功，False 表示處理過程中出現任何關鍵錯誤
 
     original_filename = os.path.basename(uploaded_file_path)
-    file_size = None
-    if os.path.exists(uploaded_file_path):
+    try:
         file_size = os.path.getsize(uploaded_file_path)
+    except OSError: # 檔案不存在或無法存取 由後續的檔案處理步驟回報
+        file_size = None
 
     # 步驟0: 初始化資料庫 (如果尚未進行)
     # 在實際應用中，init_db 可能在應用啟動時執行一次即可
@@ -57,8 +101,8 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
     # 清理/建立本次檔案處理專用的臨時目錄
     # 使用原始檔名（不含副檔名）作為子目錄，避免衝突
     current_file_temp_processing_dir = os.path.join(temp_base_dir, os.path.splitext(original_filename)[0] + "_proc")
-    if os.path.exists(current_file_temp_processing_dir):
-        shutil.rmtree(current_file_temp_processing_dir)
+    # ignore_errors 讓 rmtree 在目錄不存在時直接返回 不必先檢查
+    shutil.rmtree(current_file_temp_processing_dir, ignore_errors=True)
     os.makedirs(current_file_temp_processing_dir, exist_ok=True)
     logger.info(f"為檔案 [{original_filename}] 建立的處理中臨時目錄: [{current_file_temp_processing_dir}]")
 
@@ -70,26 +114,26 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
     step_1_details = {}
     if file_size is not None: step_1_details["原始檔案大小"] = f"{file_size / (1024*1024):.2f} MB" if file_size > 0 else f"{file_size} Bytes"
     step_1_details["偵測到的檔案類型 (MIME)"] = detected_mime
+    mime_category = settings.SUPPORTED_MIME_TYPES.get(detected_mime) # 不支援的類型為 None
 
     if detected_mime and not detected_mime.startswith("error/"): # 表示MIME偵測本身是成功的
         if extracted_files:
-            file_category = settings.SUPPORTED_MIME_TYPES.get(detected_mime, "未知壓縮類型")
-            if file_category in ["zip", "rar", "7z", "gz", "tar", "bz2"]:
+            if mime_category in settings.ARCHIVE_CATEGORIES:
                 msg = f"成功: 已將檔案識別為 {detected_mime} 並解壓縮. 發現 {len(extracted_files)} 個檔案."
                 step_1_details["解壓縮後檔案"] = [os.path.basename(f) for f in extracted_files]
             else: # text, csv
                 msg = f"成功: 已將檔案識別為 {detected_mime}. 檔案已準備就緒."
             reporter.generate_step_report(step_num, total_steps, step_name_1, True, msg, step_1_details)
-        elif detected_mime in settings.SUPPORTED_MIME_TYPES and settings.SUPPORTED_MIME_TYPES[detected_mime] not in ["text", "csv"]:
-             # 是支援的壓縮檔 但解壓後為空
-             msg = f"警告: 檔案識別為 {detected_mime} 但解壓縮後未發現任何檔案."
-             reporter.generate_step_report(step_num, total_steps, step_name_1, False, msg, step_1_details)
-             overall_success = False # 標記為部分失敗
-        elif detected_mime in settings.SUPPORTED_MIME_TYPES and settings.SUPPORTED_MIME_TYPES[detected_mime] in ["text", "csv"] and not extracted_files:
+        elif mime_category in settings.TEXT_CATEGORIES:
              # 是文本CSV 但複製失敗 (理論上 file_handler 內部會處理並返回空列表)
              msg = f"錯誤: 檔案識別為 {detected_mime} 但處理 (複製) 失敗."
              reporter.generate_step_report(step_num, total_steps, step_name_1, False, msg, step_1_details)
              overall_success = False
+        elif mime_category is not None:
+             # 是支援的壓縮檔 但解壓後為空
+             msg = f"警告: 檔案識別為 {detected_mime} 但解壓縮後未發現任何檔案."
+             reporter.generate_step_report(step_num, total_steps, step_name_1, False, msg, step_1_details)
+             overall_success = False # 標記為部分失敗
         else: # 不支援的MIME類型
             msg = f"資訊: 檔案類型 {detected_mime} 非直接支援的壓縮或文本格式 無法自動解析."
             reporter.generate_step_report(step_num, total_steps, step_name_1, True, msg, step_1_details)
@@ -101,34 +145,36 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
 
     # 步驟 2, 3, 4: 解析與儲存 (僅當上一步驟成功且有檔案時)
     if overall_success and extracted_files:
-        for idx, file_to_parse_path in enumerate(extracted_files):
+        # 假設所有解壓出來的或直接提供的檔案 若要解析 都是CSV
+        # 未來可以加入更複雜的判斷 或根據副檔名篩選
+        # 此處簡化為：如果原始檔案是壓縮檔 解壓出的檔案都嘗試解析
+        # 如果原始檔案是CSV/TXT 則 extracted_files 只有它自己
+        csv_flags = [os.path.basename(path).lower().endswith(".csv") or "text" in file_handler.get_file_mime_type(path)
+                     for path in extracted_files]
+        # 先送出所有CSV檔案的剖析工作 主行程依序取回結果並寫入資料庫
+        parsed_files = _iter_parsed_files([path for path, is_csv in zip(extracted_files, csv_flags) if is_csv])
+
+        for idx, (file_to_parse_path, is_likely_csv) in enumerate(zip(extracted_files, csv_flags)):
             file_to_parse_name = os.path.basename(file_to_parse_path)
             logger.info(f"準備處理由 [{original_filename}] 產生的檔案: [{file_to_parse_name}]")
 
-            # 假設所有解壓出來的或直接提供的檔案 若要解析 都是CSV
-            # 未來可以加入更複雜的判斷 或根據副檔名篩選
-            # 此處簡化為：如果原始檔案是壓縮檔 解壓出的檔案都嘗試解析
-            # 如果原始檔案是CSV/TXT 則 extracted_files 只有它自己
-            # Corrected line: used file_handler.get_file_mime_type
-            is_likely_csv = file_to_parse_name.lower().endswith(".csv") or "text" in file_handler.get_file_mime_type(file_to_parse_path)
-
             if not is_likely_csv:
                 logger.info(f"檔案 [{file_to_parse_name}] 非CSV格式 跳過解析與儲存步驟")
                 processed_data_summary.append({"source_filename": file_to_parse_name, "status": "跳過", "message": "非CSV格式或無法解析的文本檔案"})
                 continue
 
-            # 步驟 2: 格式分析與範本匹配 (目前簡化)
+            # 步驟 2: 格式分析與範本匹配
             step_num_parse = 2 + idx * 2 # 每個檔案有解析和儲存兩個子步驟
             step_name_2 = f"格式分析與範本匹配 ({file_to_parse_name})"
-            parsed_data = parser.parse_csv_file(file_to_parse_path) # 使用預設編碼和分隔符
-            data_type_recognized = "generic_csv" # 初期固定範本
+            # 串流剖析時只先讀出表頭 資料列以迭代器在儲存步驟中邊讀邊寫入 不先載入整份檔案
+            header, row_iter = next(parsed_files)
+            data_type_recognized = templates.match_data_type(header) # 未符合任何範本時為 generic_csv
 
             step_2_details = {"檔案名稱": file_to_parse_name}
-            if parsed_data["header"]:
-                # Corrected f-string:
-                msg_parse = f"成功: 已成功識別資料格式為 {data_type_recognized} 解析到 {len(parsed_data['rows'])} 行資料"
+            if header:
+                msg_parse = f"成功: 已成功識別資料格式為 {data_type_recognized} 表頭共 {len(header)} 個欄位"
                 step_2_details["匹配範本"] = data_type_recognized
-                step_2_details["解析行數"] = len(parsed_data["rows"])
+                step_2_details["表頭欄位數"] = len(header)
                 reporter.generate_step_report(step_num_parse, total_steps, step_name_2, True, msg_parse, step_2_details)
             else:
                 msg_parse = "失敗: 無法解析CSV內容或未找到表頭"
@@ -141,9 +187,10 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
             step_num_store = step_num_parse + 1
             step_name_3 = f"資料儲存 ({file_to_parse_name})"
             # data_type_recognized 來自上一步
-            db_success, rows_inserted = database.insert_structured_data(db_path, file_to_parse_name, data_type_recognized, parsed_data["header"], parsed_data["rows"])
+            db_success, rows_inserted = database.insert_structured_data(db_path, file_to_parse_name, data_type_recognized, header, row_iter)
 
-            step_3_details = {"目標資料庫表": "generic_data"}
+            # 範本類型的表頭無法作為欄位時 database 會改存 generic_data 並記錄警告
+            step_3_details = {"目標資料庫表": "generic_data" if data_type_recognized == templates.GENERIC_DATA_TYPE else data_type_recognized}
             if db_success:
                 msg_store = f"成功: {rows_inserted} 行資料已儲存到資料庫"
                 step_3_details["儲存行數"] = rows_inserted
@@ -155,6 +202,7 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
                 reporter.generate_step_report(step_num_store, total_steps, step_name_3, False, msg_store, step_3_details)
                 overall_success = False # 標記整體失敗
                 processed_data_summary.append({"source_filename": file_to_parse_name, "status": "失敗", "message": msg_store, "details": step_3_details})
+        parsed_files.close() # 所有檔案都已取回結果 關閉行程池
     elif not overall_success:
         logger.warning(f"由於檔案識別/提取失敗 檔案 [{original_filename}] 的後續解析和儲存步驟已跳過")
         processed_data_summary.append({"source_filename": original_filename, "status": "失敗", "message": "檔案識別或提取失敗 導致無法處理"})
@@ -169,9 +217,10 @@ def process_single_file(uploaded_file_path, db_path, temp_base_dir):
     # 清理為此特定檔案建立的臨時處理目錄 (current_file_temp_processing_dir)
     # 注意: temp_base_dir (例如 temp_uploads) 通常在 Colab Notebook 的更高層級進行管理和清理
     try:
-        if os.path.exists(current_file_temp_processing_dir):
-            shutil.rmtree(current_file_temp_processing_dir)
-            logger.info(f"已清理臨時處理目錄: [{current_file_temp_processing_dir}]")
+        shutil.rmtree(current_file_temp_processing_dir)
+        logger.info(f"已清理臨時處理目錄: [{current_file_temp_processing_dir}]")
+    except FileNotFoundError:
+        pass
     except Exception as e_cleanup:
         logger.error(f"清理臨時目錄 [{current_file_temp_processing_dir}] 時發生錯誤: {e_cleanup}", exc_info=True)
 
@@ -2,13 +2,24 @@
 # -*- coding: utf-8 -*-
 # 資料庫管理器 負責資料庫初始化與資料儲存
 
+import csv
 import sqlite3
 import json
 import os
+import atexit
+import threading
+from itertools import chain, islice
+from json.encoder import encode_basestring
+
+try:
+    import orjson # 選用依賴 以 Rust 實作的快速 JSON 序列化
+except ImportError:
+    orjson = None
 
 try:
     from ..utils.logger import get_logger
     from ..config import settings
+    from ..config.templates import GENERIC_DATA_TYPE
 except ImportError:
     import sys
     current_script_path = os.path.abspath(__file__)
@@ -17,27 +28,81 @@ except ImportError:
         sys.path.insert(0, project_root_for_direct_run)
     from src.utils.logger import get_logger # type: ignore
     from src.config import settings # type: ignore
+    from src.config.templates import GENERIC_DATA_TYPE # type: ignore
 
 logger = get_logger()
 
+# 每次連線都會套用的 PRAGMA (見 connect_db)
+# journal_mode 會保存在資料庫檔案中 其餘設定只對當前連線有效
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",     # 預寫日誌 提交時不必重寫整份回滾日誌
+    "synchronous=NORMAL",   # WAL 模式下只在檢查點時 fsync
+    "temp_store=MEMORY",    # 暫存表與索引放在記憶體
+    "cache_size=-65536",    # 頁面快取 64 MB (負值單位為 KiB)
+    "mmap_size=268435456",  # 以 256 MB 記憶體映射讀取資料庫檔案
+)
+
+# generic_data 的插入語句 只建立一次 供 executemany 重複使用
+INSERT_GENERIC_DATA_SQL = '''
+    INSERT INTO generic_data (file_source, data_type, row_number, row_content_json)
+    VALUES (?, ?, ?, ?)
+'''
+
+# 欄位式資料表中由程式維護的欄位 CSV 表頭與之同名時改存 generic_data
+RESERVED_COLUMNS = ("id", "file_source", "row_number", "imported_at")
+
+# (data_type, 表頭) -> (CREATE TABLE 語句, INSERT 語句) 同一類型的檔案只需組出一次 SQL
+_typed_sql_cache = {}
+
+# 依 db_path 快取的連線 跨檔案重複使用 讓頁面快取在檔案之間保持熱度
+_conn_cache = {}
+# 保護 _conn_cache 並串行化共用連線上的交易 (可重入 交易內仍可呼叫 _get_conn)
+_conn_lock = threading.RLock()
+
+def connect_db(db_path):
+    # 開啟資料庫連線並套用 SQLITE_PRAGMAS 的寫入調校
+    # 耐久性取捨: synchronous=NORMAL 搭配 WAL 時 資料庫不會因當機或斷電而損毀
+    # 但作業系統當機或斷電前最後幾筆已提交的交易可能遺失 (應用程式本身崩潰則不受影響)
+    # 匯入的資料可由原始檔案重新匯入 因此以此換取大量插入時較少的 fsync 與日誌寫入
+    # isolation_level=None: 模組不再於 INSERT 前自動 BEGIN 交易一律由 insert_structured_data 明確開始與提交
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+def _get_conn(db_path):
+    # 取得 db_path 的快取連線 第一次使用時才開啟並套用 PRAGMA
+    with _conn_lock:
+        conn = _conn_cache.get(db_path)
+        if conn is None:
+            conn = _conn_cache[db_path] = connect_db(db_path)
+        return conn
+
+def close_all():
+    # 關閉並清空所有快取連線 (程式結束時自動呼叫 測試時也可手動呼叫)
+    with _conn_lock:
+        for conn in _conn_cache.values():
+            conn.close()
+        _conn_cache.clear()
+
+atexit.register(close_all)
+
 def init_db(db_path):
     # 初始化資料庫 若不存在則建立相關表格
     logger.info(f"開始初始化資料庫於路徑 {db_path}")
-    conn = None
     try:
         db_dir = os.path.dirname(db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
             logger.info(f"已建立資料庫目錄 {db_dir}")
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        conn = _get_conn(db_path)
         # 建立一個通用的資料表 generic_data
         # file_source 原始檔案名或標識符
         # data_type 資料類型 例如 futures_daily options_daily
         # row_content_json 將每一列的數據轉為 JSON 字串儲存
         # imported_at 資料導入時間戳
-        create_table_sql = ''''
+        create_table_sql = '''
             CREATE TABLE IF NOT EXISTS generic_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 file_source TEXT NOT NULL,
@@ -47,8 +112,9 @@ def init_db(db_path):
                 imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         '''
-        cursor.execute(create_table_sql)
-        conn.commit()
+        with _conn_lock:
+            conn.execute(create_table_sql)
+            conn.commit()
         logger.info(f"資料庫 [{db_path}] 初始化成功 表格 generic_data 已準備就緒")
         return True
     except sqlite3.Error as e:
@@ -57,65 +123,139 @@ def init_db(db_path):
     except Exception as e:
         logger.error(f"初始化資料庫 [{db_path}] 時發生未預期錯誤 {e}", exc_info=True)
         return False
-    finally:
-        if conn:
-            conn.close()
+
+def _quote_identifier(name):
+    # 以雙引號包住 SQLite 識別字 內部的雙引號加倍跳脫
+    return '"' + name.replace('"', '""') + '"'
+
+def _typed_table_sql(data_type, header):
+    # 返回 (CREATE TABLE 語句, INSERT 語句) 依 (data_type, 表頭) 快取
+    key = (data_type, tuple(header))
+    sql = _typed_sql_cache.get(key)
+    if sql is None:
+        table = _quote_identifier(data_type)
+        columns = [_quote_identifier(name) for name in header]
+        create_sql = (f"CREATE TABLE IF NOT EXISTS {table} ("
+                      "id INTEGER PRIMARY KEY AUTOINCREMENT, file_source TEXT NOT NULL, row_number INTEGER NOT NULL, "
+                      + "".join(f"{column} TEXT, " for column in columns)
+                      + "imported_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        insert_sql = (f"INSERT INTO {table} (file_source, row_number, {', '.join(columns)}) "
+                      f"VALUES (?, ?{', ?' * len(columns)})")
+        sql = _typed_sql_cache[key] = (create_sql, insert_sql)
+    return sql
+
+def ensure_table_for(conn, data_type, header):
+    # 為範本識別出的資料類型 (見 config.templates) 建立以表頭為欄位的資料表 (若尚不存在) 返回其 INSERT 語句
+    # 下列情況返回 None 由呼叫端改存 generic_data:
+    # 未識別的類型 表頭含空白/重複/保留欄位名稱 或同名資料表已存在但欄位與表頭不同
+    if not data_type or data_type == GENERIC_DATA_TYPE or data_type.lower() == "generic_data" or data_type.lower().startswith("sqlite_"):
+        return None
+    folded = [name.lower() for name in header] # SQLite 識別字不分大小寫
+    if not all(header) or len(set(folded)) != len(folded) or any(name in RESERVED_COLUMNS for name in folded):
+        logger.warning(f"來源表頭含空白 重複或保留欄位名稱 無法建立資料表 [{data_type}] 改存入 generic_data")
+        return None
+    create_sql, insert_sql = _typed_table_sql(data_type, header)
+    conn.execute(create_sql)
+    existing_columns = [info[1] for info in conn.execute(f"PRAGMA table_info({_quote_identifier(data_type)})")]
+    if existing_columns[3:-1] != list(header):
+        logger.warning(f"資料表 [{data_type}] 的欄位與來源表頭不同 改存入 generic_data")
+        return None
+    return insert_sql
 
 def insert_structured_data(db_path, file_source, data_type, header, rows):
     # 將結構化資料插入資料庫
-    logger.info(f"準備將來源 [{file_source}] 型態 [{data_type}] 資料插入資料庫 [{db_path}]")
+    # rows 可為列表或迭代器 (例如 parser.iter_rows) 逐批消耗 插入行數為各批 cursor.rowcount 的總和
+    logger.info("準備將來源 [%s] 型態 [%s] 資料插入資料庫 [%s]", file_source, data_type, db_path)
     if not header:
         logger.warning(f"來源 [{file_source}] 表頭為空 無法插入")
         return False, 0
-    if not rows:
+    # rows 可能是迭代器 (真值恆為 True) 先取出第一列判斷是否為空 再接回串流前端
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
         logger.info(f"來源 [{file_source}] 無資料行可插入")
         return True, 0
+    rows = chain([first_row], rows)
 
-    conn = None
     inserted_count = 0
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        for i, row_values in enumerate(rows):
-            if len(header) != len(row_values):
-                logger.warning(f"來源 [{file_source}] 第 {i+1} 行欄位數 ({len(row_values)}) 與表頭 ({len(header)}) 不符 跳過此行")
-                continue
-
-            row_dict = dict(zip(header, row_values))
-            try:
-                row_json = json.dumps(row_dict, ensure_ascii=False)
-            except TypeError as te:
-                logger.error(f"來源 [{file_source}] 第 {i+1} 行序列化JSON失敗 {te} 資料 {row_dict}", exc_info=True)
-                continue
-
-            try:
-                insert_sql = ''''
-                    INSERT INTO generic_data (file_source, data_type, row_number, row_content_json)
-                    VALUES (?, ?, ?, ?)
-                '''
-                cursor.execute(insert_sql, (file_source, data_type, i + 1, row_json))
-                inserted_count += 1
-            except sqlite3.Error as db_err:
-                logger.error(f"插入來源 [{file_source}] 第 {i+1} 行至資料庫SQLite錯誤 {db_err} 資料 {row_json}", exc_info=True)
-
-        conn.commit()
-        if inserted_count > 0 :
-            logger.info(f"成功從來源 [{file_source}] ({data_type}) 插入 {inserted_count} 行資料到 [{db_path}]")
-        elif not rows:
-            logger.info(f"來源 [{file_source}] ({data_type}) 中沒有資料行可插入")
-        else:
-            logger.warning(f"來源 [{file_source}] ({data_type}) 未成功插入任何資料列")
-
-        return True, inserted_count
-    except sqlite3.Error as e:
-        logger.error(f"資料庫操作失敗 ({db_path}) 來源 [{file_source}] {e}", exc_info=True)
-        if conn: conn.rollback()
-        return False, inserted_count
-    except Exception as e:
-        logger.error(f"插入資料到資料庫 [{db_path}] 時發生未預期錯誤 ({file_source}) {e}", exc_info=True)
-        if conn: conn.rollback()
-        return False, inserted_count
-    finally:
-        if conn:
-            conn.close()
+    conn = None
+    with _conn_lock:
+        try:
+            conn = _get_conn(db_path)
+            cursor = conn.cursor()
+
+            # 整個檔案在單一交易內以 executemany 批次插入 避免逐行 execute 的語句開銷
+            # 範本識別出的資料類型直接依欄位寫入同名資料表 不經 JSON 序列化 其餘存入 generic_data
+            conn.execute("BEGIN")
+            insert_sql = ensure_table_for(conn, data_type, header)
+            if insert_sql is None:
+                insert_sql = INSERT_GENERIC_DATA_SQL
+                params = _generic_data_params(file_source, data_type, header, rows)
+            else:
+                params = _typed_row_params(file_source, header, rows)
+            # 參數以 settings.INSERT_BATCH_ROWS 列為一批交給 executemany 記憶體只與批次大小相關
+            while True:
+                batch = list(islice(params, settings.INSERT_BATCH_ROWS))
+                if not batch:
+                    break
+                cursor.executemany(insert_sql, batch)
+                inserted_count += cursor.rowcount
+            conn.commit()
+            if inserted_count > 0 :
+                logger.info(f"成功從來源 [{file_source}] ({data_type}) 插入 {inserted_count} 行資料到 [{db_path}]")
+            else:
+                logger.warning(f"來源 [{file_source}] ({data_type}) 未成功插入任何資料列")
+
+            return True, inserted_count
+        except sqlite3.Error as e:
+            logger.error(f"資料庫操作失敗 ({db_path}) 來源 [{file_source}] {e}", exc_info=True)
+            if conn: conn.rollback()
+            return False, 0 # 整個檔案已回滾
+        except (UnicodeDecodeError, csv.Error) as e:
+            # 來源檔案本身的編碼或格式問題 (例如 parser.iter_rows 讀到一半才出錯) 不是程式錯誤 不必附上堆疊
+            logger.error(f"來源 [{file_source}] 讀取資料列時發生編碼或格式錯誤 {e}")
+            if conn: conn.rollback()
+            return False, 0 # 整個檔案已回滾
+        except Exception as e:
+            logger.error(f"插入資料到資料庫 [{db_path}] 時發生未預期錯誤 ({file_source}) {e}", exc_info=True)
+            if conn: conn.rollback()
+            return False, 0 # 整個檔案已回滾
+
+def _make_row_serializer(header):
+    # 為固定表頭建立資料列的 JSON 序列化函數 輸出與
+    # json.dumps(dict(zip(header, row)), ensure_ascii=False, separators=(',', ':')) 相同
+    # 已安裝 orjson 時直接使用 否則預先轉義每個鍵 每列只需轉義儲存格數值再串接 不必建立中間字典
+    # orjson 輸出 bytes 須解碼為 str 否則 SQLite 會將其存為 BLOB 而非 TEXT
+    keys = tuple(header)
+    if orjson is not None:
+        return lambda row_values: orjson.dumps(dict(zip(keys, row_values))).decode("utf-8")
+    if len(set(keys)) != len(keys): # 重複欄位名稱時保留 dict 「後者覆蓋前者」的語意
+        return lambda row_values: json.dumps(dict(zip(keys, row_values)), ensure_ascii=False, separators=(",", ":"))
+    key_prefixes = [encode_basestring(key) + ":" for key in keys]
+    return lambda row_values: "{" + ",".join([prefix + encode_basestring(value)
+                                              for prefix, value in zip(key_prefixes, row_values)]) + "}"
+
+def _generic_data_params(file_source, data_type, header, rows):
+    # 產生 generic_data 的插入參數 欄位數不符或無法序列化的資料行記錄後跳過 不影響整批插入
+    hlen = len(header)
+    serialize = _make_row_serializer(header)
+    for i, row_values in enumerate(rows):
+        if len(row_values) != hlen:
+            # 逐列路徑使用 %-格式 級別未啟用時不必組字串
+            logger.warning("來源 [%s] 第 %d 行欄位數 (%d) 與表頭 (%d) 不符 跳過此行", file_source, i + 1, len(row_values), hlen)
+            continue
+        try:
+            row_json = serialize(row_values)
+        except TypeError as te: # orjson.JSONEncodeError 亦為 TypeError 的子類別
+            logger.error("來源 [%s] 第 %d 行序列化JSON失敗 %s 資料 %s", file_source, i + 1, te, row_values)
+            continue
+        yield (file_source, data_type, i + 1, row_json)
+
+def _typed_row_params(file_source, header, rows):
+    # 產生欄位式資料表的插入參數 (file_source, row_number, 欄位值...) 欄位數不符的資料行記錄後跳過
+    hlen = len(header)
+    for i, row_values in enumerate(rows):
+        if len(row_values) != hlen:
+            logger.warning("來源 [%s] 第 %d 行欄位數 (%d) 與表頭 (%d) 不符 跳過此行", file_source, i + 1, len(row_values), hlen)
+            continue
+        yield (file_source, i + 1, *row_values)
@@ -4,8 +4,18 @@
 
 import os
 import shutil
+import subprocess
+import bz2
+import gzip
+import tarfile
+import zipfile
 import magic # python-magic 函式庫
-import patoolib # patool 函式庫 用於解壓縮多種格式
+import patoolib # patool 函式庫 用於解壓縮 rar/7z 等標準函式庫不支援的格式
+
+try:
+    from isal import igzip # 選用依賴 以 Intel ISA-L 的 SIMD 實作解壓 gzip 介面與 gzip 模組相同
+except ImportError:
+    igzip = None
 
 try:
     from ..utils.logger import get_logger
@@ -21,70 +31,173 @@ except ImportError:
 
 logger = get_logger()
 
+# 檔頭魔術數字 -> MIME 類型 (與 libmagic 對同類檔案回報的類型一致)
+# 只判斷二進位簽章 zip (docx/xlsx 等 Office 文件同樣以 PK 開頭) 與所有文字檔
+# (CSV 與 HTML/JSON 等需略過的文字格式) 一律交由 libmagic 區分
+MAGIC_SIGNATURES = (
+    (b"\x1f\x8b", "application/gzip"),
+    (b"BZh", "application/x-bzip2"),
+    (b"Rar!\x1a\x07", "application/x-rar"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+)
+# 判斷檔頭需要讀取的位元組數 (tar 的 "ustar" 標記位於第 257 個位元組)
+MIME_SNIFF_BYTES = 512
+
+# libmagic 只在檔頭無法判斷時才使用 第一次使用時建立 之後重複使用 不必每次重新載入特徵資料庫
+_magic = None
+
+def _sniff_mime_type(head):
+    # 依檔頭的二進位簽章判斷 MIME 類型 無法確定時返回 None
+    if not head:
+        return "inode/x-empty"
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[257:262] == b"ustar":
+        return "application/x-tar"
+    return None
+
 def get_file_mime_type(file_path):
-    # 使用 python-magic 函式庫來獲取檔案的 MIME 類型
+    # 先以檔頭魔術數字判斷檔案的 MIME 類型 無法判斷時才使用 python-magic 函式庫
     # Args:
     #     file_path (str): 要檢查的檔案路徑
     # Returns:
     #     str or None: 檔案的 MIME 類型字串
     #                  如果檔案不存在 不可讀或發生偵測錯誤則返回 None
-    if not os.path.exists(file_path):
+    global _magic
+    try:
+        with open(file_path, "rb") as f: # 直接開啟 不存在或無權限時由例外判斷 不必事先 stat
+            head = f.read(MIME_SNIFF_BYTES)
+        mime_type = _sniff_mime_type(head)
+        if mime_type is None:
+            if _magic is None:
+                _magic = magic.Magic(mime=True)
+            mime_type = _magic.from_file(file_path)
+        # 每個解壓出的檔案都會呼叫一次 以 DEBUG 記錄 上傳檔案的類型由 handle_uploaded_file 以 INFO 記錄
+        logger.debug("檔案 [%s] 的 MIME 類型偵測為: %s", file_path, mime_type)
+        return mime_type
+    except FileNotFoundError:
         logger.error(f"檔案 [{file_path}] 不存在 無法偵測 MIME 類型")
         return None
-    if not os.access(file_path, os.R_OK):
+    except PermissionError:
         logger.error(f"檔案 [{file_path}] 無法讀取 (權限不足) 無法偵測 MIME 類型")
         return None
-    try:
-        mime_type = magic.from_file(file_path, mime=True)
-        logger.info(f"檔案 [{os.path.basename(file_path)}] 的 MIME 類型偵測為: {mime_type}")
-        return mime_type
     except magic.MagicException as e:
-        logger.error(f"使用 python-magic 偵測檔案 [{os.path.basename(file_path)}] MIME 類型時發生 MagicException: {e}", exc_info=True)
+        logger.error(f"使用 python-magic 偵測檔案 [{os.path.basename(file_path)}] MIME 類型時發生 MagicException: {e}")
         return None
     except Exception as e:
         logger.error(f"偵測檔案 [{os.path.basename(file_path)}] MIME 類型時發生未預期錯誤: {e}", exc_info=True)
         return None
 
-def extract_archive(archive_path, output_directory):
-    # 使用 patoolib 解壓縮指定的壓縮檔案到指定的目錄
+# 單一檔案壓縮格式對應的開啟函數 (非 tar 封裝時直接解壓為一個檔案)
+SINGLE_FILE_OPENERS = {"gz": igzip.open if igzip is not None else gzip.open, "bz2": bz2.open}
+
+def _parallel_gunzip_command(archive_path):
+    # 若系統有多執行緒的 gzip 解壓工具 返回將解壓結果輸出到 stdout 的命令 否則返回 None
+    threads = str(os.cpu_count() or 1)
+    if shutil.which("pugz"):
+        return ["pugz", "-t", threads, archive_path]
+    if shutil.which("pigz"):
+        return ["pigz", "-d", "-c", "-p", threads, archive_path]
+    return None
+
+def _decompress_single_file(archive_path, output_path, file_category):
+    # 將單一檔案壓縮 (gz/bz2) 解壓到 output_path
+    # 超過 settings.PARALLEL_GZIP_MIN_BYTES 的 gzip 檔優先交給 pugz/pigz 並行解壓
+    # 小檔案啟動子行程的成本較高 仍在本行程以串流方式解壓
+    if file_category == "gz" and os.path.getsize(archive_path) >= settings.PARALLEL_GZIP_MIN_BYTES:
+        command = _parallel_gunzip_command(archive_path)
+        if command is not None:
+            try:
+                with open(output_path, "wb") as dst:
+                    subprocess.run(command, stdout=dst, stderr=subprocess.PIPE, check=True)
+                return
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"{command[0]} 解壓 [{os.path.basename(archive_path)}] 失敗 改用內建解壓: {e}")
+    with SINGLE_FILE_OPENERS[file_category](archive_path, "rb") as src, open(output_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def _extract_in_process(archive_path, output_directory, file_category):
+    # 以標準函式庫在本行程內解壓縮 zip/tar/gz/bz2 不需另外啟動 unzip/tar 子行程
+    # Returns:
+    #     bool: True 表示已處理 False 表示此格式需交由 patoolib
+    if file_category == "zip":
+        with zipfile.ZipFile(archive_path) as archive: # extractall 會移除成員路徑中的 .. 與絕對路徑
+            archive.extractall(output_directory)
+        return True
+    if file_category == "tar" or (file_category in SINGLE_FILE_OPENERS and tarfile.is_tarfile(archive_path)):
+        with tarfile.open(archive_path, "r:*") as archive: # 自動判斷 tar/tar.gz/tar.bz2
+            if hasattr(tarfile, "data_filter"): # 拒絕目錄外路徑 連結與裝置檔
+                archive.extractall(output_directory, filter="data")
+            else:
+                archive.extractall(output_directory)
+        return True
+    if file_category in SINGLE_FILE_OPENERS:
+        # 單一檔案壓縮 輸出檔名為去掉壓縮副檔名的原始檔名 (與 gunzip/bunzip2 相同)
+        base_archive_name = os.path.basename(archive_path)
+        output_name, ext = os.path.splitext(base_archive_name)
+        if ext.lower() not in (".gz", ".gzip", ".bz2", ".bz") or not output_name:
+            output_name = base_archive_name
+        _decompress_single_file(archive_path, os.path.join(output_directory, output_name), file_category)
+        return True
+    return False
+
+def _iter_files(directory):
+    # 以 os.scandir 遞迴列出 directory 下的非隱藏檔案路徑 順序與 os.walk (由上而下) 相同
+    # DirEntry 已帶有目錄掃描時取得的類型資訊與完整路徑 不需對每個檔案另外 stat 或 abspath
+    # 與 os.walk 相同 不會進入指向目錄的符號連結
+    pending_dirs = [directory]
+    while pending_dirs:
+        subdirs = []
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif not entry.name.startswith("."): # 忽略隱藏檔案
+                    yield entry.path
+        pending_dirs.extend(reversed(subdirs)) # 反向放入 依原順序逐一處理子目錄
+
+def extract_archive(archive_path, output_directory, file_category=None):
+    # 解壓縮指定的壓縮檔案到指定的目錄
+    # zip/tar/gz/bz2 以標準函式庫在本行程內解壓 其他格式 (rar 7z) 或未指定分類時使用 patoolib
     # Args:
     #     archive_path (str): 壓縮檔案的路徑
     #     output_directory (str): 解壓縮檔案存放的目標目錄 此目錄如果不存在會被創建
+    #     file_category (str, optional): settings.SUPPORTED_MIME_TYPES 中的分類 例如 "zip" "gz"
     # Returns:
     #     list[str]: 解壓縮後所有檔案的絕對路徑列表 (遞歸獲取) 如果解壓縮失敗則返回空列表
     extracted_files_list = []
     try:
         base_archive_name = os.path.basename(archive_path)
         logger.info(f"開始解壓縮檔案 [{base_archive_name}] 到目錄 [{output_directory}]")
-        if os.path.exists(output_directory):
-            shutil.rmtree(output_directory)
+        shutil.rmtree(output_directory, ignore_errors=True) # 目錄不存在時直接返回
         os.makedirs(output_directory, exist_ok=True)
-        patoolib.extract_archive(archive_path, outdir=output_directory, verbosity=-1)
+        if not _extract_in_process(archive_path, output_directory, file_category):
+            patoolib.extract_archive(archive_path, outdir=output_directory, verbosity=-1)
         logger.info(f"檔案 [{base_archive_name}] 解壓縮命令執行完畢")
-        for root, _, files in os.walk(output_directory):
-            for file_name in files:
-                if not file_name.startswith("."): # 忽略隱藏檔案
-                    full_path = os.path.join(root, file_name)
-                    extracted_files_list.append(os.path.abspath(full_path))
+        extracted_files_list = list(_iter_files(os.path.abspath(output_directory)))
         if not extracted_files_list:
             logger.warning(f"解壓縮檔案 [{base_archive_name}] 後 在目錄 [{output_directory}] 未找到任何檔案")
         else:
             logger.debug(f"解壓縮後在 [{output_directory}] 找到 {len(extracted_files_list)} 個檔案")
         return extracted_files_list
     except patoolib.util.PatoolError as e:
-        logger.error(f"patoolib 解壓縮檔案 [{os.path.basename(archive_path)}] 失敗: {e}", exc_info=True)
-        if os.path.exists(output_directory): shutil.rmtree(output_directory, ignore_errors=True)
+        logger.error(f"patoolib 解壓縮檔案 [{os.path.basename(archive_path)}] 失敗: {e}") # 多為檔案損毀 錯誤訊息已足夠
+        shutil.rmtree(output_directory, ignore_errors=True)
         return []
     except Exception as e:
         logger.error(f"解壓縮檔案 [{os.path.basename(archive_path)}] 時發生未預期錯誤: {e}", exc_info=True)
-        if os.path.exists(output_directory): shutil.rmtree(output_directory, ignore_errors=True)
+        shutil.rmtree(output_directory, ignore_errors=True)
         return []
 
-def handle_uploaded_file(source_file_path, temp_processing_dir_base):
+def handle_uploaded_file(source_file_path, temp_processing_dir_base, copy_text_files=False):
     # 處理上傳的檔案 識別其MIME類型 並根據類型處理
     # Args:
     #     source_file_path (str): 上傳的原始檔案路徑
     #     temp_processing_dir_base (str): 存放處理後檔案的基礎臨時目錄
+    #     copy_text_files (bool): 文字/CSV 檔預設直接返回原始路徑 (後續只會讀取)
+    #                             呼叫端需要一份獨立副本時設為 True 複製到 temp_processing_dir_base
     # Returns:
     #     tuple[str, list[str]]: (偵測到的MIME類型字串 處理後的檔案絕對路徑列表)
     #                            MIME類型: "error/file-not-accessible" "error/mime-detection-failed" 或實際MIME type
@@ -103,14 +216,17 @@ def handle_uploaded_file(source_file_path, temp_processing_dir_base):
     if mime_type in settings.SUPPORTED_MIME_TYPES:
         file_category = settings.SUPPORTED_MIME_TYPES[mime_type]
         logger.info(f"檔案 [{base_filename}] 分類為: {file_category} (MIME: {mime_type})")
-        if file_category in ["zip", "rar", "7z", "gz", "tar", "bz2"]:
+        if file_category in settings.ARCHIVE_CATEGORIES:
             specific_extraction_dir = os.path.join(temp_processing_dir_base, filename_no_ext)
             logger.info(f"壓縮檔案 [{base_filename}] 將解壓到: [{specific_extraction_dir}]")
-            processed_file_paths = extract_archive(source_file_path, specific_extraction_dir)
+            processed_file_paths = extract_archive(source_file_path, specific_extraction_dir, file_category)
             if not processed_file_paths:
                 logger.warning(f"檔案 [{base_filename}] (MIME: {mime_type}) 解壓後無檔案")
                 return mime_type, []
-        elif file_category in ["text", "csv"]:
+        elif file_category in settings.TEXT_CATEGORIES and not copy_text_files:
+            processed_file_paths.append(os.path.abspath(source_file_path))
+            logger.info(f"檔案 [{base_filename}] (MIME: {mime_type}) 直接就地讀取 無需複製")
+        elif file_category in settings.TEXT_CATEGORIES:
             try:
                 destination_path = os.path.join(temp_processing_dir_base, base_filename)
                 if os.path.abspath(source_file_path) == os.path.abspath(destination_path):
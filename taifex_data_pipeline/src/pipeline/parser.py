@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 # 資料剖析器
 
+import codecs
 import csv
+import io
 import os
+from functools import lru_cache
+from itertools import chain
 
 try:
     from ..utils.logger import get_logger
@@ -19,38 +23,189 @@ except ImportError:
 
 logger = get_logger()
 
-def parse_csv_file(file_path, encoding=None, delimiter=","):
-    # 剖析CSV檔案，提取表頭和資料列。
-    logger.info(f"剖析CSV: {file_path}")
+# 逐批讀取 CSV 的區塊大小 (字元數 每批會再補齊到行尾 見 _iter_cleaned_rows)
+CSV_READ_CHUNK_CHARS = 1 << 20
+
+# 純 ASCII 內容中 除換行字元外會被 str.strip 去除的空白字元 (見 _iter_cleaned_rows)
+ASCII_CELL_PADDING = " \t\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# parse_csv_file 共用儲存格字串時快取的最大項目數
+CELL_CACHE_MAX_ENTRIES = 1 << 16
+# 以前幾列判斷檔案的重複內容是否多到值得共用字串
+CELL_CACHE_SAMPLE_ROWS = 1000
+
+# 判斷檔案編碼時讀取的開頭位元組數 (見 _detect_encoding)
+ENCODING_SNIFF_BYTES = 4096
+# 開頭全為 ASCII 時 UTF-8 與 cp950 無從區分 之後以此大小逐塊往後找第一個非 ASCII 的區塊
+ENCODING_SCAN_CHUNK_BYTES = 1 << 20
+
+# 依 BOM 判定的編碼 utf-8-sig 會在解碼時去除 BOM 不會殘留在第一個表頭欄位
+ENCODING_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+def _clean_rows(rows):
+    # 儲存格一定是 str，可直接以 map(str.strip, ...) 在 C 層逐格清理，不需型別檢查
+    # 全部為空白的資料列直接略過
+    for row in rows:
+        cleaned_row = list(map(str.strip, row))
+        if any(cleaned_row):
+            yield cleaned_row
+
+def _read_chunk(csvfile):
+    # 讀取約 CSV_READ_CHUNK_CHARS 個字元 再以 readline 補齊被切斷的最後一行 檔尾時返回空字串
+    # 一次 read 不必像 readlines 先為每行建立字串再串接
+    chunk = csvfile.read(CSV_READ_CHUNK_CHARS)
+    if chunk and not chunk.endswith("\n"):
+        chunk += csvfile.readline()
+    return chunk
+
+def _iter_cleaned_rows(csvfile, delimiter, chunk=None):
+    # 逐批讀取以 newline="" 開啟的檔案 產生清理後的資料列 chunk 為呼叫端已先讀出的第一批內容
+    # 每批都在行尾結束 只要讀到的內容還沒有引號 就不可能有跨行的引號欄位
+    # 此時直接以 str.split 切分 (行尾換行字元由 strip 一併去除) 結果與 csv.reader 相同
+    # 一旦某批含有引號 該批及其後的內容改交給 csv.reader 正確處理引號與欄位內換行
+    # 若某批為純 ASCII 且除換行與分隔符外不含任何空白字元 儲存格不可能有前後空白 連逐格 strip 也省略
+    padding = ASCII_CELL_PADDING.replace(delimiter, "")
+    if chunk is None:
+        chunk = _read_chunk(csvfile)
+    while chunk:
+        if '"' in chunk:
+            # StringIO 以 newline="" 切行 與檔案物件相同只在 \r \n \r\n 斷行
+            yield from _clean_rows(csv.reader(chain(io.StringIO(chunk, newline=""), csvfile), delimiter=delimiter))
+            return
+        if chunk.isascii() and not any(c in chunk for c in padding):
+            for line in chunk.splitlines():
+                if line.strip(delimiter): # 只由分隔符組成的行即為全部空白的資料列
+                    yield line.split(delimiter)
+        else:
+            yield from _clean_rows(line.split(delimiter) for line in io.StringIO(chunk, newline=""))
+        chunk = _read_chunk(csvfile)
+
+@lru_cache(maxsize=256)
+def _detect_encoding_of(file_path, mtime_ns, size):
+    # _detect_encoding 的實作 以 (路徑, 修改時間, 大小) 快取 同一檔案的表頭與資料列只需判斷一次
+    # 通常只需檢查開頭區塊 不會像先以 UTF-8 整份讀取、失敗再重讀那樣多掃一遍檔案
+    # 開頭全為 ASCII 時 (例如英文表頭與數字) 繼續往後找到第一個含非 ASCII 位元組的區塊再判斷
+    # 否則前 4 KB 為 ASCII 的 cp950 檔案會被誤判為 UTF-8 在讀到一半時才解碼失敗
+    with open(file_path, "rb") as f:
+        sample = f.read(ENCODING_SNIFF_BYTES)
+        for bom, encoding in ENCODING_BOMS:
+            if sample.startswith(bom):
+                return encoding
+        while sample.isascii(): # C 層的快速檢查 全為 ASCII 的檔案也只需循序讀過一次
+            sample = f.read(ENCODING_SCAN_CHUNK_BYTES)
+            if not sample:
+                return settings.DEFAULT_ENCODING
+    try:
+        # 以增量解碼器解碼 區塊結尾被截斷的多位元組字元不算錯誤
+        # 前一個區塊全為 ASCII 因此此區塊的開頭不可能落在多位元組字元中間
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return settings.FALLBACK_ENCODING
+    return settings.DEFAULT_ENCODING
+
+def _detect_encoding(file_path):
+    # 由檔案開頭的 BOM 與內容判斷編碼 無法讀取時返回 None (由呼叫端改用預設編碼)
+    try:
+        stat = os.stat(file_path)
+        return _detect_encoding_of(file_path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def _iter_header_and_rows(file_path, encoding, delimiter):
+    # 依序產生表頭 (第一個非空白列) 與其後清理後的資料列 表頭與資料列共用同一次開檔與讀取
+    # 欄位數與表頭不符的列也照常產生 由插入端記錄並跳過 (仍佔用列號)
+    with open(file_path, "r", encoding=encoding, newline="") as csvfile:
+        yield from _iter_cleaned_rows(csvfile, delimiter)
+
+def _take_header(rows, file_path, encoding):
+    # 取出 _iter_header_and_rows 的第一列作為表頭 (讀取失敗或無表頭時返回空列表)
+    try:
+        header = next(rows, [])
+    except UnicodeDecodeError as e:
+        logger.error("CSV編碼錯誤 (%s) %s: %s", encoding, file_path, e)
+        return []
+    except csv.Error as e:
+        logger.error("CSV格式錯誤 %s: %s", file_path, e)
+        return []
+    except Exception as e:
+        logger.error("剖析CSV時未預期錯誤 %s: %s", file_path, e, exc_info=True)
+        return []
+    if not header:
+        logger.warning("CSV無表頭: %s", file_path)
+    return header
+
+def _count_rows(rows, file_path):
+    # 逐列轉交資料列 全部產生完畢後記錄列數
+    row_count = 0
+    for row_count, cleaned_row in enumerate(rows, 1):
+        yield cleaned_row
+    logger.info("CSV剖析完成: %s, 資料列數: %d", file_path, row_count)
+
+def read_header(file_path, encoding=None, delimiter=","):
+    # 只讀取到第一個非空白列為止，返回表頭 (找不到或讀取失敗時返回空列表)
     if not os.path.exists(file_path):
-        logger.error(f"CSV檔案不存在: {file_path}")
-        return {"header": [], "rows": []}
+        logger.error("CSV檔案不存在: %s", file_path)
+        return []
 
-    resolved_encoding = encoding if encoding else settings.DEFAULT_ENCODING
-    header = []
-    data_rows = []
+    resolved_encoding = encoding or _detect_encoding(file_path) or settings.DEFAULT_ENCODING
+    rows = _iter_header_and_rows(file_path, resolved_encoding, delimiter)
+    try:
+        return _take_header(rows, file_path, resolved_encoding)
+    finally:
+        rows.close()
+
+def iter_rows(file_path, encoding=None, delimiter=",", skip_header=True):
+    # 逐列產生清理後的資料列，不在記憶體中累積整份檔案
+    # 讀取途中的編碼或格式錯誤會直接拋給消耗端 (例如資料庫插入會因此回滾)
+    resolved_encoding = encoding or _detect_encoding(file_path) or settings.DEFAULT_ENCODING
+    rows = _iter_header_and_rows(file_path, resolved_encoding, delimiter)
+    if skip_header:
+        next(rows, None)
+    yield from _count_rows(rows, file_path)
+
+def parse_csv_stream(file_path, encoding=None, delimiter=","):
+    # 串流剖析CSV檔案，返回 (表頭, 資料列迭代器)；無表頭時返回 ([], 空迭代器)
+    # 表頭與資料列來自同一個 _iter_header_and_rows 檔案只開啟與讀取一次
+    logger.info("剖析CSV: %s", file_path)
+    if not os.path.exists(file_path):
+        logger.error("CSV檔案不存在: %s", file_path)
+        return [], iter(())
+
+    resolved_encoding = encoding or _detect_encoding(file_path) or settings.DEFAULT_ENCODING
+    rows = _iter_header_and_rows(file_path, resolved_encoding, delimiter)
+    header = _take_header(rows, file_path, resolved_encoding)
+    if not header:
+        rows.close()
+        return [], iter(())
+    return header, _count_rows(rows, file_path)
+
+def parse_csv_file(file_path, encoding=None, delimiter=","):
+    # 剖析CSV檔案，提取表頭和資料列 (資料列會全部載入記憶體 大檔案請改用 parse_csv_stream)
+    # 相同內容的儲存格 (日期 契約代碼 買賣權等) 共用同一個字串物件 降低常駐記憶體
+    # 交由行程池傳回時 pickle 也只會序列化一次 (見 orchestrator._parse_worker)
+    # 快取超過 CELL_CACHE_MAX_ENTRIES 時清空 避免高基數欄位 (價格 成交量) 讓快取無限成長
+    # 前 CELL_CACHE_SAMPLE_ROWS 列中超過一半的儲存格互不相同時 其餘資料列不再查詢快取
+    header, row_iter = parse_csv_stream(file_path, encoding, delimiter)
+    cell_cache = {}
+    intern_cell = cell_cache.setdefault
+    rows = []
     try:
-        with open(file_path, "r", encoding=resolved_encoding, newline="") as csvfile:
-            csv_reader = csv.reader(csvfile, delimiter=delimiter)
-            for row in csv_reader: # 尋找表頭
-                if any(cell.strip() for cell in row):
-                    header = [cell.strip() for cell in row]
-                    break
-            if not header:
-                logger.warning(f"CSV無表頭: {file_path}")
-                return {"header": [], "rows": []}
-            for row in csv_reader: # 讀取資料
-                cleaned_row = [cell.strip() for cell in row]
-                if any(cleaned_row):
-                    data_rows.append(cleaned_row)
-        logger.info(f"CSV剖析完成: {file_path}, 表頭數: {len(header)}, 資料列數: {len(data_rows)}")
-        return {"header": header, "rows": data_rows}
+        for row in row_iter:
+            rows.append(list(map(intern_cell, row, row)))
+            if len(cell_cache) > CELL_CACHE_MAX_ENTRIES:
+                cell_cache.clear()
+            if len(rows) == CELL_CACHE_SAMPLE_ROWS and len(cell_cache) * 2 > CELL_CACHE_SAMPLE_ROWS * len(header):
+                break
+        rows.extend(row_iter)
+        return {"header": header, "rows": rows}
     except UnicodeDecodeError as e:
-        logger.error(f"CSV編碼錯誤 ({resolved_encoding}) {file_path}: {e}")
-        return {"header": [], "rows": []}
+        logger.error("CSV編碼錯誤 %s: %s", file_path, e)
     except csv.Error as e:
-        logger.error(f"CSV格式錯誤 {file_path}: {e}")
-        return {"header": [], "rows": []}
+        logger.error("CSV格式錯誤 %s: %s", file_path, e)
     except Exception as e:
-        logger.error(f"剖析CSV時未預期錯誤 {file_path}: {e}", exc_info=True)
-        return {"header": [], "rows": []}
+        logger.error("剖析CSV時未預期錯誤 %s: %s", file_path, e, exc_info=True)
+    return {"header": [], "rows": []}
@@ -2,42 +2,57 @@
 # -*- coding: utf-8 -*-
 # 日誌記錄器工具
 
+import atexit
 import logging
+import logging.handlers
+import math
+import os
+import queue
 import sys
-import pytz # 用於時區處理
+import time
 from datetime import datetime
+from zoneinfo import ZoneInfo # 標準函式庫的時區資料（取代 pytz）
 
 try:
     from ..config import settings # 從上一層的config模組導入settings
 except ImportError:
     # Fallback for direct execution or testing if PYTHONPATH is not set
-    import os
     current_script_path = os.path.abspath(__file__)
     project_root_for_direct_run = os.path.dirname(os.path.dirname(os.path.dirname(current_script_path)))
     if project_root_for_direct_run not in sys.path:
         sys.path.insert(0, project_root_for_direct_run)
     from src.config import settings # type: ignore
 
-TAIPEI_TZ = pytz.timezone('Asia/Taipei') # 定義台北時區
+TAIPEI_TZ = ZoneInfo('Asia/Taipei') # 定義台北時區
+# 台北自 1979 年起不再實施夏令時間 固定為 UTC+8 (見 TaipeiFormatter.formatTime)
+TAIPEI_UTC_OFFSET_SECONDS = 8 * 60 * 60
 
 class TaipeiFormatter(logging.Formatter):
     # 自訂日誌格式化器 使用台北時區
     def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, tz=pytz.utc) # 從時間戳轉換並設為UTC
-        return dt.astimezone(TAIPEI_TZ) # 轉換為台北時區
+        return datetime.fromtimestamp(timestamp, tz=TAIPEI_TZ) # 直接從時間戳轉換為台北時間
 
     def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created) # 使用轉換後的台北時間
+        if datefmt and "%%" in datefmt: # 含跳脫的 % 無法安全地代入 %f %z %Z
+            return self.converter(record.created).strftime(datefmt)
         if datefmt:
-            s = dt.strftime(datefmt)
-        else:
-            try:
-                s = dt.isoformat(timespec="milliseconds") # ISO格式 含毫秒
-            except TypeError: # 老版本Python可能不支持timespec
-                s = dt.isoformat()
+            # 以固定位移和 time.strftime 格式化 每筆記錄不必建立帶時區的 datetime
+            # time.strftime 不支援 %f 而 %z %Z 會得到 UTC 先自行代入 (微秒的捨入與 datetime.fromtimestamp 相同)
+            fraction, seconds = math.modf(record.created)
+            microseconds = round(fraction * 1e6)
+            if microseconds >= 1000000:
+                seconds, microseconds = seconds + 1, microseconds - 1000000
+            datefmt = datefmt.replace("%f", f"{microseconds:06d}").replace("%z", "+0800").replace("%Z", "CST")
+            return time.strftime(datefmt, time.gmtime(int(seconds) + TAIPEI_UTC_OFFSET_SECONDS))
+        dt = self.converter(record.created) # 使用轉換後的台北時間
+        try:
+            s = dt.isoformat(timespec="milliseconds") # ISO格式 含毫秒
+        except TypeError: # 老版本Python可能不支持timespec
+            s = dt.isoformat()
         return s
 
 _logger = None # 模組級別的日誌記錄器實例 避免重複設定
+_log_listener = None # 在背景執行緒寫出佇列中記錄的 QueueListener (見 setup_logger)
 
 def setup_logger(log_file_path=None, log_level=None):
     # 設定並返回一個日誌記錄器
@@ -70,13 +85,42 @@ def setup_logger(log_file_path=None, log_level=None):
         file_handler = logging.FileHandler(current_log_file_path, mode="a", encoding="utf-8")
         file_handler.setFormatter(formatter)
         logger_instance.addHandler(file_handler)
+    except OSError as e: # 路徑不存在或無寫入權限
+        logger_instance.error(f"無法設定日誌檔案處理器於 {current_log_file_path}: {e}")
     except Exception as e:
         logger_instance.error(f"無法設定日誌檔案處理器於 {current_log_file_path}: {e}", exc_info=True)
 
+    # 實際的控制台/檔案寫入交給背景執行緒 (QueueListener) 記錄日誌的呼叫端只需把記錄放入佇列
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *logger_instance.handlers, respect_handler_level=True)
+    logger_instance.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _log_listener.start()
+    atexit.register(_log_listener.stop) # 程式結束時寫出佇列中剩餘的記錄
+
     logger_instance.info(f"日誌記錄器 [{logger_instance.name}] 設定完成. 日誌級別: {current_log_level_str}. 日誌檔案: {current_log_file_path}")
     _logger = logger_instance # 賦值給模組級變數
     return _logger
 
+def start_worker_log_listener(mp_context):
+    # 為以 spawn/forkserver 啟動的子行程 (例如 orchestrator 的剖析行程池) 建立可跨行程傳遞的日誌佇列
+    # 並在背景執行緒將子行程送來的記錄寫入本行程的處理器 返回 (佇列, QueueListener)
+    # 子行程結束後由呼叫端呼叫 listener.stop()
+    get_logger()
+    log_queue = mp_context.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *_log_listener.handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+def setup_worker_logger(log_queue, log_level):
+    # 子行程的 initializer: 日誌記錄只放入 log_queue 由父行程寫出 (見 start_worker_log_listener)
+    # 必須在子行程匯入其他 src 模組 (匯入時會呼叫 get_logger) 之前執行 否則子行程會自行開啟日誌檔案與 QueueListener
+    global _logger
+    logger_instance = logging.getLogger("TaifexPipeline")
+    logger_instance.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger_instance.setLevel(log_level)
+    _logger = logger_instance
+
 def get_logger():
     # 獲取已設定的日誌記錄器 如果尚未設定則先進行設定
     if _logger is None:
@@ -3,7 +3,9 @@
 # 報告工具：負責產生格式化的中文處理報告
 
 import os
+import time
 from datetime import datetime # 用於獲取當前時間，配合logger的時區
+from functools import lru_cache
 
 try:
     from .logger import get_logger, TAIPEI_TZ # 從同層級的logger模組導入
@@ -20,9 +22,14 @@ except ImportError:
 
 logger = get_logger()
 
+@lru_cache(maxsize=1)
+def _format_taipei_time(epoch_seconds):
+    # 格式化到秒 同一秒內的報告共用同一個字串
+    return datetime.fromtimestamp(epoch_seconds, TAIPEI_TZ).strftime("%Y-%m-%d %H:%M:%S %Z")
+
 def get_current_taipei_time_str():
     # 獲取當前台北時間的格式化字串
-    return datetime.now(TAIPEI_TZ).strftime("%Y-%m-%d %H:%M:%S %Z")
+    return _format_taipei_time(int(time.time()))
 
 def generate_initial_report_banner(original_filename, file_size_bytes=None):
     # 產生處理開始的橫幅報告
@@ -33,9 +40,10 @@ def generate_initial_report_banner(original_filename, file_size_bytes=None):
     report_lines.append(f"[{timestamp}] \U0001F4C4 開始處理上傳項目: {original_filename}")
     report_lines.append(f"      - 原始檔案大小: {size_str}")
     report_lines.append("-"*60)
-    # Log and print
-    for line in report_lines: logger.info(line)
-    return "\n".join(report_lines)
+    # Log and print (整份報告合成單一日誌記錄 只需一次格式化與寫入)
+    report_str = "\n".join(report_lines)
+    logger.info(report_str)
+    return report_str
 
 def generate_step_report(step_number, total_steps, step_name, success, message, details=None):
     # 為單一步驟產生報告條目
@@ -62,9 +70,10 @@ def generate_step_report(step_number, total_steps, step_name, success, message,
     report_lines.append(f"      {status_icon} {message}")
     report_lines.append("") # Add a blank line for readability
 
-    # Log and print
-    for line in report_lines: logger.info(line)
-    return "\n".join(report_lines)
+    # Log and print (整份報告合成單一日誌記錄 只需一次格式化與寫入)
+    report_str = "\n".join(report_lines)
+    logger.info(report_str)
+    return report_str
 
 def generate_final_report_banner(original_filename, success):
     # 產生處理結束的橫幅報告
@@ -75,9 +84,10 @@ def generate_final_report_banner(original_filename, success):
     report_lines.append("-"*60)
     report_lines.append(f"[{timestamp}] {status_icon} 上傳項目 {original_filename} {status_message}！")
     report_lines.append("="*60)
-    # Log and print
-    for line in report_lines: logger.info(line)
-    return "\n".join(report_lines)
+    # Log and print (整份報告合成單一日誌記錄 只需一次格式化與寫入)
+    report_str = "\n".join(report_lines)
+    logger.info(report_str)
+    return report_str
 
 def generate_summary_report(overall_status_message, file_summaries):
     # 產生一個包含所有已處理檔案摘要的總報告 (類似Taifexdtool.py中的generate_summary_report)
@@ -13,7 +13,9 @@ test.py - CSV 解析策略測試器
 
 import os
 import argparse
+import codecs
 import csv
+from itertools import islice
 # import json
 # import logging # 未來可能匯入的模組
 
@@ -62,7 +64,98 @@ DATA_RECOGNITION_TEMPLATES = [
     }
 ]
 
-def apply_template_to_csv(csv_filepath, template):
+# 計算資料列數時每次從檔案讀取的位元組數
+SNIFF_READ_CHUNK_BYTES = 1 << 20
+# 範例資料最多擷取的行數
+SAMPLE_ROW_COUNT = 5
+# 掃描檔案時至少保留的開頭行數 (供各範本略過行數與擷取範例使用)
+SNIFF_HEAD_LINES = 64
+
+def _count_file_rows(csv_filepath, encoding):
+    """
+    以 C 層級的字串計數計算整個檔案的資料列數，不逐列建立 csv.reader 的結果。
+
+    csv.reader 在沒有引號的內容中，每個行結尾 (\n、\r 或 \r\n) 即為一列，
+    因此可直接計算行結尾的數量；最後一行若無行結尾也算一列。
+    一旦讀到引號字元 (欄位可能跨行)，即無法以行數代表列數。
+    檔案以二進位大區塊讀取並交給增量解碼器，避免文字檔包裝層每 8 KB 解碼一次的額外負擔。
+
+    參數:
+        csv_filepath (str): CSV 檔案路徑。
+        encoding (str): 檔案編碼。
+
+    返回:
+        int or None: 檔案的資料列數；若內容含有引號字元則為 None。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    row_count = 0
+    last_char = ''
+    with open(csv_filepath, 'rb') as f:
+        while True:
+            raw_chunk = f.read(SNIFF_READ_CHUNK_BYTES)
+            chunk = decoder.decode(raw_chunk, final=not raw_chunk)
+            if chunk:
+                if '"' in chunk:
+                    return None
+                row_count += chunk.count('\n') + chunk.count('\r') - chunk.count('\r\n')
+                if last_char == '\r' and chunk[0] == '\n': # \r\n 被切在兩個區塊之間
+                    row_count -= 1
+                last_char = chunk[-1]
+            if not raw_chunk:
+                break
+    if last_char and last_char not in '\r\n': # 最後一行沒有行結尾
+        row_count += 1
+    return row_count
+
+def _scan_csv_lines(csv_filepath, encoding, head_line_count):
+    """
+    以指定編碼掃描檔案，保留開頭數行並計算總行數。
+
+    分隔符號與略過行數不同的範本可共用同一編碼的掃描結果，不必各自重新讀取與解碼檔案。
+
+    參數:
+        csv_filepath (str): CSV 檔案路徑。
+        encoding (str): 檔案編碼。
+        head_line_count (int): 要保留的開頭行數。
+
+    返回:
+        dict: 掃描結果：
+              - 'head_lines' (list of str): 檔案開頭最多 head_line_count 行 (含行結尾)。
+              - 'line_count' (int or None): 檔案總行數；若內容含有引號字元則為 None
+                                            (欄位可能跨行，行數不等於資料列數)。
+    """
+    with open(csv_filepath, 'r', encoding=encoding, newline='') as f:
+        head_lines = list(islice(f, head_line_count))
+    line_count = None
+    if not any('"' in line for line in head_lines):
+        line_count = _count_file_rows(csv_filepath, encoding)
+    return {'head_lines': head_lines, 'line_count': line_count}
+
+def _get_line_scan(csv_filepath, encoding, skiprows, scan_cache):
+    """
+    取得檔案在指定編碼下的掃描結果，若快取中已有足夠的開頭行則直接沿用。
+
+    參數:
+        csv_filepath (str): CSV 檔案路徑。
+        encoding (str): 檔案編碼。
+        skiprows (int): 範本要略過的行數。
+        scan_cache (dict or None): 以編碼為鍵的掃描結果快取；None 表示不快取。
+
+    返回:
+        dict: `_scan_csv_lines` 的掃描結果。
+    """
+    head_line_count = max(SNIFF_HEAD_LINES, skiprows + SAMPLE_ROW_COUNT)
+    line_scan = scan_cache.get(encoding) if scan_cache is not None else None
+    if line_scan is not None:
+        kept_lines = len(line_scan['head_lines'])
+        if kept_lines >= head_line_count or line_scan['line_count'] in (None, kept_lines):
+            return line_scan
+    line_scan = _scan_csv_lines(csv_filepath, encoding, head_line_count)
+    if scan_cache is not None:
+        scan_cache[encoding] = line_scan
+    return line_scan
+
+def apply_template_to_csv(csv_filepath, template, scan_cache=None):
     """
     將單一解析範本應用於 CSV 檔案並回報結果。
 
@@ -74,6 +167,8 @@ def apply_template_to_csv(csv_filepath, template):
         template (dict): 代表解析範本的字典。預期鍵值：
                          'template_name' (str), 
                          'parser_params' (dict，包含 'delimiter', 'encoding', 'skiprows')。
+        scan_cache (dict, optional): 同一檔案的各範本共用的掃描結果快取 (以編碼為鍵)。
+                                     預設為 None，表示不與其他範本共用。
 
     返回:
         dict: 一個總結套用範本結果的字典：
@@ -102,22 +197,34 @@ def apply_template_to_csv(csv_filepath, template):
     }
 
     try:
-        with open(csv_filepath, 'r', encoding=encoding, newline='') as f:
-            # 如果指定，則略過起始行
-            for _ in range(skiprows):
-                next(f) # 讀取並捨棄標頭/略過的行
-            
-            reader = csv.reader(f, delimiter=delimiter)
-            
-            read_count = 0
-            for i, row in enumerate(reader):
-                if i < 5: # 為範例讀取最多 5 行資料
-                    result['sample_data'].append(row)
-                read_count += 1
-            
-            result['rows_read'] = read_count
-            result['success'] = True
-            # print(f"  使用 '{template_name}' 成功解析。讀取行數: {read_count}。")
+        line_scan = _get_line_scan(csv_filepath, encoding, skiprows, scan_cache)
+
+        if line_scan['line_count'] is None:
+            # 內容含有引號，欄位可能跨行，改以 csv.reader 逐列讀取
+            with open(csv_filepath, 'r', encoding=encoding, newline='') as f:
+                # 如果指定，則略過起始行
+                for _ in range(skiprows):
+                    next(f) # 讀取並捨棄標頭/略過的行
+
+                reader = csv.reader(f, delimiter=delimiter)
+
+                # 為範例讀取最多 5 行資料
+                result['sample_data'] = list(islice(reader, SAMPLE_ROW_COUNT))
+                read_count = len(result['sample_data'])
+                for row in reader:
+                    read_count += 1
+        else:
+            head_lines = line_scan['head_lines']
+            if len(head_lines) < skiprows:
+                raise StopIteration # 與逐行略過時檔案提前結束的情況相同
+            # 沒有引號時每行即為一列，範例直接取自掃描保留的開頭行
+            sample_lines = head_lines[skiprows:skiprows + SAMPLE_ROW_COUNT]
+            result['sample_data'] = list(csv.reader(sample_lines, delimiter=delimiter))
+            read_count = line_scan['line_count'] - skiprows
+
+        result['rows_read'] = read_count
+        result['success'] = True
+        # print(f"  使用 '{template_name}' 成功解析。讀取行數: {read_count}。")
 
     except FileNotFoundError:
         result['error_message'] = f"找不到檔案: {csv_filepath}"
@@ -156,8 +263,9 @@ def run_tests_on_csv(csv_filepath, templates):
     """
     print(f"\n正在對檔案進行所有解析測試: {csv_filepath}")
     results = []
+    scan_cache = {} # 相同編碼的範本共用同一次檔案掃描
     for template in templates:
-        test_result = apply_template_to_csv(csv_filepath, template)
+        test_result = apply_template_to_csv(csv_filepath, template, scan_cache)
         results.append(test_result)
     return results
 
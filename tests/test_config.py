@@ -43,6 +43,9 @@ class TestConfigLoading(unittest.TestCase):
         # Check default values (optional, but good)
         self.assertEqual(config["database_path"], "taifex_data.sqlite")
         self.assertEqual(config["log_level"], "INFO")
+        self.assertEqual(config["commit_interval_rows"], 50000)
+        self.assertEqual(config["row_format"], "object")
+        self.assertEqual(config["data_type_schemas"], {})
 
         # tearDown will remove this created config.json
 
@@ -0,0 +1,299 @@
+import unittest
+import os
+import json
+import logging
+import sqlite3
+import sys
+import tempfile
+from unittest import mock
+
+# Add the parent directory (root of the repository) to the Python path
+# so that the Taifexdtool module can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import Taifexdtool
+from Taifexdtool import connect_db, init_db, insert_data, should_drop_indexes, drop_indexes, create_indexes, checkpoint_wal
+from Taifexdtool import register_data_type_schemas, recognize_data_type, serialize_source, insert_serialized_data
+from Taifexdtool import new_row_stats, serialize_rows
+
+FUTURES_SCHEMA = {"futures_daily": [["交易日期", "trade_date", "TEXT"], ["契約", "contract", "TEXT"], ["收盤價", "close", "INTEGER"]]}
+
+class TestInsertData(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Opens an in-memory database with the generic_data table."""
+        self.conn = connect_db(":memory:")
+        self.assertTrue(init_db(self.conn))
+
+    def tearDown(self):
+        """Ran after each test. Closes the database connection."""
+        self.conn.close()
+
+    def fetch_rows(self, file_source):
+        return self.conn.execute(
+            "SELECT row_number, data_json FROM generic_data WHERE file_source = ? ORDER BY row_number",
+            (file_source,),
+        ).fetchall()
+
+    def test_batched_insert_spans_multiple_statements(self):
+        """Test that more rows than fit in one multi-row INSERT are all inserted, in order."""
+        rows = [[str(i), f"值{i}"] for i in range(2500)]
+        success, inserted = insert_data(self.conn, "big.csv", {"header": ["A", "B"], "rows": rows})
+        self.conn.commit()
+
+        self.assertTrue(success)
+        self.assertEqual(inserted, 2500)
+        stored = self.fetch_rows("big.csv")
+        self.assertEqual(len(stored), 2500)
+        self.assertEqual(stored[0][0], 0)
+        self.assertEqual(json.loads(stored[0][1]), {"A": "0", "B": "值0"})
+        self.assertEqual(stored[-1][0], 2499)
+        self.assertEqual(json.loads(stored[-1][1]), {"A": "2499", "B": "值2499"})
+
+    def test_rows_can_be_a_generator(self):
+        """Test that rows are consumed lazily from an iterator."""
+        rows = ([str(i)] for i in range(10))
+        success, inserted = insert_data(self.conn, "gen.csv", {"header": ["A"], "rows": rows})
+        self.assertTrue(success)
+        self.assertEqual(inserted, 10)
+
+    def test_mismatched_rows_are_skipped(self):
+        """Test that rows whose length differs from the header are skipped, keeping their row numbers."""
+        rows = [["1", "2"], ["only one"], ["3", "4"]]
+        success, inserted = insert_data(self.conn, "mixed.csv", {"header": ["A", "B"], "rows": rows})
+        self.assertTrue(success)
+        self.assertEqual(inserted, 2)
+        self.assertEqual([r[0] for r in self.fetch_rows("mixed.csv")], [0, 2])
+
+    def test_empty_rows_is_success_with_zero_inserted(self):
+        """Test that a header with an empty row list inserts nothing but succeeds."""
+        self.assertEqual(insert_data(self.conn, "empty.csv", {"header": ["A"], "rows": []}), (True, 0))
+
+    def test_failed_file_is_rolled_back_alone(self):
+        """Test that an error mid-file undoes only that file's rows within the shared transaction."""
+        insert_data(self.conn, "good.csv", {"header": ["A"], "rows": [["1"], ["2"]]})
+
+        def broken_rows():
+            for i in range(1500):
+                yield [str(i)]
+            raise ValueError("broken source")
+
+        success, inserted = insert_data(self.conn, "bad.csv", {"header": ["A"], "rows": broken_rows()})
+        self.conn.commit()
+
+        self.assertEqual((success, inserted), (False, 0))
+        self.assertEqual(len(self.fetch_rows("good.csv")), 2)
+        self.assertEqual(self.fetch_rows("bad.csv"), [])
+
+    def test_sqlite_error_mid_file_rolls_back_and_counts_rows_seen(self):
+        """Test that a failing batch undoes the file and still reports how many rows were read."""
+        insert_data(self.conn, "good.csv", {"header": ["A"], "rows": [["1"]]})
+        self.conn.execute("""CREATE TRIGGER fail_at_1500 BEFORE INSERT ON generic_data
+                             WHEN NEW.row_number = 1500 BEGIN SELECT RAISE(ABORT, 'boom'); END""")
+        stats = new_row_stats(["A"], "object")
+        serialized_rows = serialize_rows("bad.csv", ["A"], ([str(i)] for i in range(3000)), stats)
+        with self.assertLogs(Taifexdtool.logger, level="ERROR") as logs:
+            self.assertEqual(insert_serialized_data(self.conn, "bad.csv", serialized_rows, stats), (False, 0))
+        self.conn.commit()
+
+        self.assertIn("boom", logs.output[-1])
+        self.assertEqual(stats["rows_seen"], 2000) # two batches were read before the second one failed
+        self.assertEqual(len(self.fetch_rows("good.csv")), 1)
+        self.assertEqual(self.fetch_rows("bad.csv"), [])
+
+    def test_failed_rollback_does_not_mask_the_original_error(self):
+        """Test that an error from ROLLBACK TO is logged while the original error is the one reported."""
+        class FailingRollbackConnection(sqlite3.Connection):
+            def execute(self, sql, *args):
+                if sql.startswith("ROLLBACK TO"):
+                    raise sqlite3.OperationalError("no such savepoint: insert_data")
+                return super().execute(sql, *args)
+
+        conn = sqlite3.connect(":memory:", isolation_level=None, factory=FailingRollbackConnection)
+        self.addCleanup(conn.close)
+        init_db(conn)
+
+        def broken_rows():
+            yield ["1"]
+            raise ValueError("broken source")
+
+        with self.assertLogs(Taifexdtool.logger, level="ERROR") as logs:
+            self.assertEqual(insert_data(conn, "bad.csv", {"header": ["A"], "rows": broken_rows()}), (False, 0))
+        self.assertIn("no such savepoint", logs.output[0])
+        self.assertIn("broken source", logs.output[-1])
+
+    def test_array_row_format_stores_header_once(self):
+        """Test that the array format stores positional rows plus one header row per source."""
+        rows = [["1", "甲"], ["2", "乙"]]
+        success, inserted = insert_data(self.conn, "arr.csv", {"header": ["A", "名稱"], "rows": rows}, row_format="array")
+        self.conn.commit()
+
+        self.assertEqual((success, inserted), (True, 2))
+        self.assertEqual([json.loads(r[1]) for r in self.fetch_rows("arr.csv")], rows)
+        header_json, = self.conn.execute(
+            "SELECT header_json FROM generic_headers WHERE file_source = ?", ("arr.csv",)).fetchone()
+        self.assertEqual(json.loads(header_json), ["A", "名稱"])
+
+class TestTypedTables(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Registers a typed schema and opens an in-memory database."""
+        register_data_type_schemas(FUTURES_SCHEMA)
+        self.addCleanup(register_data_type_schemas, {})
+        self.conn = connect_db(":memory:")
+        self.addCleanup(self.conn.close)
+        self.assertTrue(init_db(self.conn))
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+
+    def load_csv(self, content):
+        path = os.path.join(self.test_dir.name, "futures.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        _, serialized_rows, stats = serialize_source(path)
+        result = insert_serialized_data(self.conn, path, serialized_rows, stats)
+        self.conn.commit()
+        return result, stats
+
+    def test_registered_header_is_recognized(self):
+        """Test that a header containing every schema column is recognized, in any order and with extra columns."""
+        self.assertEqual(recognize_data_type("f.csv", ["契約", "備註", "收盤價", "交易日期"], []), "futures_daily")
+        self.assertEqual(recognize_data_type("f.csv", ["交易日期", "收盤價"], []), "generic_csv")
+
+    def test_rows_are_stored_in_typed_columns(self):
+        """Test that rows go into the per-type table with converted values and no JSON row."""
+        (success, inserted), stats = self.load_csv("契約,交易日期,收盤價,備註\nTX,2023-10-01,16050,甲\nMTX,2023-10-01,,乙\nTX,2023-10-02\n")
+        self.assertEqual((success, inserted), (True, 2))
+        self.assertEqual(stats["rows_seen"], 3)
+        rows = self.conn.execute(
+            "SELECT row_number, trade_date, contract, close, typeof(close) FROM futures_daily ORDER BY row_number").fetchall()
+        self.assertEqual(rows, [(0, "2023-10-01", "TX", 16050, "integer"), (1, "2023-10-01", "MTX", None, "null")])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM generic_data").fetchone()[0], 0)
+
+    def test_unregistered_header_stays_generic(self):
+        """Test that a source not matching any schema is still stored as JSON in generic_data."""
+        (success, inserted), _ = self.load_csv("交易日期,收盤價\n2023-10-01,16050\n")
+        self.assertEqual((success, inserted), (True, 1))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM generic_data").fetchone()[0], 1)
+
+    def test_invalid_schemas_are_skipped(self):
+        """Test that reserved table or column names and unknown types are rejected when registering."""
+        with self.assertLogs(Taifexdtool.logger, level="ERROR") as logs:
+            register_data_type_schemas({
+                "generic_data": [["A", "a", "TEXT"]],
+                "bad_column": [["A", "row_number", "TEXT"]],
+                "bad_type": [["A", "a", "TEXT); DROP TABLE generic_data; --"]],
+                "bad_shape": [["A", "a"]],
+                "ok": [["A", "a", "text"]],
+            })
+        self.assertEqual(len(logs.records), 4)
+        self.assertEqual(Taifexdtool.DATA_TYPE_SCHEMAS, {"ok": (("A", "a", "TEXT"),)})
+
+class TestDatabaseSetup(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Opens a file-backed database in a temporary directory."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.conn = connect_db(os.path.join(self.test_dir.name, "test.sqlite"))
+
+    def tearDown(self):
+        """Ran after each test. Closes the connection and removes the temporary directory."""
+        self.conn.close()
+        self.test_dir.cleanup()
+
+    def test_connect_db_applies_write_pragmas(self):
+        """Test that connections are opened with the write-oriented PRAGMA settings."""
+        self.assertEqual(self.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(self.conn.execute("PRAGMA synchronous").fetchone()[0], 1) # NORMAL
+        self.assertEqual(self.conn.execute("PRAGMA temp_store").fetchone()[0], 2) # MEMORY
+        self.assertEqual(self.conn.execute("PRAGMA cache_size").fetchone()[0], -65536)
+        self.assertEqual(self.conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0], 0)
+
+    def test_checkpoint_wal_truncates_the_log(self):
+        """Test that committed rows stay in the WAL until checkpoint_wal writes them back and truncates it."""
+        wal_path = os.path.join(self.test_dir.name, "test.sqlite-wal")
+        self.assertTrue(init_db(self.conn))
+        insert_data(self.conn, "a.csv", {"header": ["A"], "rows": [[str(i)] for i in range(5000)]})
+        self.conn.commit()
+        self.assertGreater(os.path.getsize(wal_path), 0)
+
+        self.assertTrue(checkpoint_wal(self.conn))
+        self.assertEqual(os.path.getsize(wal_path), 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM generic_data").fetchone()[0], 5000)
+
+    def test_index_is_built_after_load(self):
+        """Test that the source index is absent during the load and present afterwards."""
+        def index_names():
+            return [row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'generic_data'")]
+
+        self.assertTrue(init_db(self.conn))
+        self.assertTrue(create_indexes(self.conn))
+        drop_indexes(self.conn)
+        self.assertEqual(index_names(), [])
+
+        insert_data(self.conn, "a.csv", {"header": ["A"], "rows": [["1"]]})
+        self.conn.commit()
+        self.assertTrue(create_indexes(self.conn))
+        self.assertEqual(index_names(), ["idx_generic_data_source_row"])
+
+    def test_indexes_are_dropped_only_for_large_loads(self):
+        """Test that a small load into a populated table keeps its index instead of rebuilding it."""
+        self.assertTrue(init_db(self.conn))
+        self.assertTrue(should_drop_indexes(self.conn, 0)) # empty table
+
+        insert_data(self.conn, "a.csv", {"header": ["A", "B"], "rows": [[str(i), f"值{i}"] for i in range(5000)]})
+        self.conn.commit()
+        self.assertTrue(create_indexes(self.conn))
+        database_bytes = self.conn.execute("PRAGMA page_count").fetchone()[0] * self.conn.execute("PRAGMA page_size").fetchone()[0]
+        self.assertFalse(should_drop_indexes(self.conn, 1024))
+        self.assertTrue(should_drop_indexes(self.conn, database_bytes))
+
+        # With the index kept, create_indexes leaves it in place and still succeeds.
+        insert_data(self.conn, "b.csv", {"header": ["A"], "rows": [["1"]]})
+        self.conn.commit()
+        self.assertTrue(create_indexes(self.conn))
+        self.assertEqual(self.conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_generic_data_source_row'").fetchone()[0], 1)
+
+class TestMainTeardown(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Points main at a CSV and a database in a temporary directory."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        csv_path = os.path.join(self.test_dir.name, "data.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("A,B\n1,2\n")
+        self.config = {
+            "database_path": os.path.join(self.test_dir.name, "test.sqlite"),
+            "log_file": os.path.join(self.test_dir.name, "test.log"),
+            "log_level": "CRITICAL",
+            "download_urls": [csv_path, csv_path],
+        }
+        app_logger = logging.getLogger(Taifexdtool.__name__)
+        self.addCleanup(setattr, app_logger, "propagate", True)
+        self.addCleanup(lambda: [app_logger.removeHandler(handler) for handler in app_logger.handlers[:]])
+        self.addCleanup(Taifexdtool.stop_log_listener)
+
+    def test_connection_is_closed_when_loading_fails(self):
+        """Test that an error in the processing loop still rolls back and closes the database connection."""
+        connections = []
+        def tracking_connect_db(db_path):
+            connections.append(connect_db(db_path))
+            return connections[-1]
+
+        def failing_insert(conn, file_source, serialized_rows, stats):
+            insert_serialized_data(conn, file_source, serialized_rows, stats)
+            raise RuntimeError("loader crashed")
+
+        for parse_workers in (1, 2):
+            with self.subTest(parse_workers=parse_workers):
+                config = dict(self.config, parse_workers=parse_workers)
+                with mock.patch.object(Taifexdtool, "load_config", return_value=config), \
+                     mock.patch.object(Taifexdtool, "connect_db", tracking_connect_db), \
+                     mock.patch.object(Taifexdtool, "insert_serialized_data", failing_insert):
+                    with self.assertRaisesRegex(RuntimeError, "loader crashed"):
+                        Taifexdtool.main()
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    connections[-1].execute("SELECT 1")
+                with sqlite3.connect(config["database_path"]) as check_conn:
+                    self.assertEqual(check_conn.execute("SELECT COUNT(*) FROM generic_data").fetchone()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
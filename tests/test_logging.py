@@ -3,27 +3,34 @@ import os
 import json
 import logging
 import sys
+import threading
 import tempfile # For creating temporary log files
+from unittest import mock
 
 # Add the parent directory (root of the repository) to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from Taifexdtool import load_config, main as taifex_main # main might be too broad, let's see
+from Taifexdtool import TaipeiFormatter, TAIPEI_TZ
+import Taifexdtool
+from datetime import datetime
 
 class TestLoggingSetup(unittest.TestCase):
     
     def setUp(self):
         """Set up for logging tests."""
-        self.test_dir = tempfile.mkdtemp() # Create a temporary directory for test artifacts
-        self.original_cwd = os.getcwd()
-        os.chdir(self.test_dir) # Change CWD to temp dir to isolate file creation
+        # Temporary directory for test artifacts; removed with everything in it after tearDown
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.test_dir = self._tmp_dir.name
 
-        self.config_path = "test_config.json"
+        # Absolute paths inside the temp dir, so the test never changes the process-wide CWD
+        self.config_path = os.path.join(self.test_dir, "test_config.json")
         self.log_file_name = "test_app.log"
         
         # Create a specific config for this test
         self.test_config_values = {
             "database_path": "test_data.sqlite",
-            "log_file": self.log_file_name, # Log to a file within the temp dir
+            "log_file": os.path.join(self.test_dir, self.log_file_name), # Log to a file within the temp dir
             "log_level": "DEBUG", # Use DEBUG for more verbose test logging if needed
             "download_urls": []
         }
@@ -38,22 +45,12 @@ class TestLoggingSetup(unittest.TestCase):
 
     def tearDown(self):
         """Clean up after logging tests."""
-        if os.path.exists(self.config_path):
-            os.remove(self.config_path)
-        
-        log_file_path = os.path.join(self.test_dir, self.log_file_name) # Path within temp dir
-        if os.path.exists(log_file_path): # Check if it exists before removing
-             os.remove(log_file_path)
-
-        os.chdir(self.original_cwd) # Restore original CWD
-        if os.path.exists(self.test_dir): # Clean up the temporary directory itself
-             try:
-                 os.rmdir(self.test_dir) # Fails if not empty
-             except OSError:
-                 # If rmdir fails, try to remove files first then rmdir
-                 for f in os.listdir(self.test_dir):
-                     os.remove(os.path.join(self.test_dir, f))
-                 os.rmdir(self.test_dir)
+        # Detach the handlers this test installed on the root logger so later tests
+        # don't log into a closed file handler inside the removed temp dir.
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+            handler.close()
 
 
     def test_log_file_creation_and_message(self):
@@ -76,25 +73,26 @@ class TestLoggingSetup(unittest.TestCase):
                 root_logger.removeHandler(handler)
                 handler.close() # Important to close file handlers
 
+        # Log file path from our config is already inside self.test_dir
+        handlers = [logging.FileHandler(log_file_from_config)]
+        if os.environ.get("TEST_VERBOSE"):
+            handlers.append(logging.StreamHandler(sys.stdout)) # So we can see logs during test run
+
         # Setup logging using basicConfig (as in Taifexdtool.py)
-        # Log file path will be relative to CWD, which is now self.test_dir
         logging.basicConfig(
             level=numeric_log_level,
             format="%(asctime)s - %(levelname)s - %(message)s",
-            handlers=[
-                logging.FileHandler(log_file_from_config), 
-                logging.StreamHandler(sys.stdout) # So we can see logs during test run
-            ]
+            handlers=handlers
         )
         
         logger = logging.getLogger("TestLogger") # Get a logger instance
         test_message = "This is a test log message for test_log_file_creation_and_message."
         logger.info(test_message)
 
-        # Flush handlers to ensure message is written to file
+        # Close the file handler to ensure the message is written (close() flushes first;
+        # the stdout StreamHandler already flushed on emit)
         for handler in logging.getLogger().handlers:
-            handler.flush()
-            if isinstance(handler, logging.FileHandler): # Close file handler to ensure write
+            if isinstance(handler, logging.FileHandler):
                 handler.close()
 
 
@@ -106,5 +104,67 @@ class TestLoggingSetup(unittest.TestCase):
             
         self.assertIn(test_message, log_content, "Test message should be in the log file content.")
 
+    def test_main_stops_previous_log_listener(self):
+        """Test that running main twice stops the first QueueListener and closes its log file."""
+        config = dict(self.test_config_values,
+                      database_path=os.path.join(self.test_dir, "test_data.sqlite"),
+                      download_urls=[os.path.join(self.test_dir, "missing.csv")])
+        app_logger = logging.getLogger(Taifexdtool.__name__)
+        self.addCleanup(setattr, app_logger, "propagate", True)
+        self.addCleanup(lambda: [app_logger.removeHandler(handler) for handler in app_logger.handlers[:]])
+        self.addCleanup(Taifexdtool.stop_log_listener)
+
+        with mock.patch.object(Taifexdtool, "load_config", return_value=config):
+            taifex_main()
+            first_listener = Taifexdtool._log_listener
+            taifex_main()
+        second_listener = Taifexdtool._log_listener
+
+        self.assertIsNot(first_listener, second_listener)
+        self.assertIsNone(first_listener._thread) # stopped
+        first_file_handler = next(h for h in first_listener.handlers if isinstance(h, logging.FileHandler))
+        self.assertIsNone(first_file_handler.stream) # closed
+        self.assertEqual(len(app_logger.handlers), 1) # only the current QueueHandler
+
+        Taifexdtool.stop_log_listener()
+        self.assertIsNone(Taifexdtool._log_listener)
+        with open(config["log_file"], encoding="utf-8") as lf:
+            self.assertEqual(lf.read().count("設定已載入"), 2)
+
+class TestTaipeiFormatter(unittest.TestCase):
+
+    def test_cached_format_time_matches_strftime(self):
+        """Test that the per-second cache yields exactly what a fresh strftime/isoformat would."""
+        formatter = TaipeiFormatter()
+        record = logging.LogRecord("TestLogger", logging.INFO, __file__, 1, "message", None, None)
+        # Same second twice, a rounding carry into the next second, and a second change.
+        for created in (1760520000.25, 1760520000.75, 1760520000.9999996, 1760520001.0000004, 1760520061.5):
+            record.created = created
+            expected_dt = datetime.fromtimestamp(created, tz=TAIPEI_TZ)
+            for datefmt in ("%Y-%m-%d %H:%M:%S.%f%z", "%H:%M:%S"):
+                self.assertEqual(formatter.formatTime(record, datefmt), expected_dt.strftime(datefmt))
+            self.assertEqual(formatter.formatTime(record), expected_dt.isoformat(timespec="milliseconds"))
+
+    def test_shared_formatter_across_threads(self):
+        """Test that threads formatting different seconds through one formatter never mix cached parts."""
+        formatter = TaipeiFormatter()
+        datefmt = "%Y-%m-%d %H:%M:%S.%f"
+        mismatches = []
+
+        def format_records(base):
+            record = logging.LogRecord("TestLogger", logging.INFO, __file__, 1, "message", None, None)
+            for i in range(2000):
+                record.created = base + i * 1.5 # every record lands in a different second
+                expected = datetime.fromtimestamp(record.created, tz=TAIPEI_TZ).strftime(datefmt)
+                if formatter.formatTime(record, datefmt) != expected:
+                    mismatches.append(record.created)
+
+        threads = [threading.Thread(target=format_records, args=(base,)) for base in (1760520000.25, 1860520000.5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mismatches, [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import os
+import sys
+import tempfile
+
+# Add the parent directory (root of the repository) to the Python path
+# so that the Taifexdtool module can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import Taifexdtool
+from Taifexdtool import parse_csv_data, parse_csv_file, iter_csv_text, serialize_source, parse_and_serialize
+
+SAMPLE_CSV = '\n  \n 日期 , 收盤價 \n2023-10-01, 16050 \n\n , \n2023-10-02,"16,100"\n"多行\n備註",1\n'
+EXPECTED_ROWS = [
+    ["日期", "收盤價"],
+    ["2023-10-01", "16050"],
+    ["2023-10-02", "16,100"],
+    ["多行\n備註", "1"],
+]
+
+class TestParseCsv(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Writes the sample CSV to a temporary file."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.test_dir.name, "sample.csv")
+        with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write(SAMPLE_CSV)
+
+    def tearDown(self):
+        """Ran after each test. Removes the temporary file."""
+        self.test_dir.cleanup()
+
+    def test_parse_csv_data(self):
+        """Test that the string parser skips blank lines, trims cells and keeps quoted newlines."""
+        parsed = parse_csv_data(SAMPLE_CSV)
+        self.assertEqual(parsed["header"], EXPECTED_ROWS[0])
+        self.assertEqual(parsed["rows"], EXPECTED_ROWS[1:])
+
+    def test_quote_free_text_matches_csv_module(self):
+        """Test that quote-free content (split fast path) parses like the csv module, CRLF included."""
+        content = "\r\n 日期 ; 收盤價 \r\n2023-10-01; 16050 \r\n\r\n ; \r\n2023-10-02;16100"
+        expected = [["日期", "收盤價"], ["2023-10-01", "16050"], ["2023-10-02", "16100"]]
+        self.assertEqual(list(iter_csv_text(content, delimiter=";")), expected)
+        # Pure ASCII without padding skips the per-cell strip as well.
+        self.assertEqual(list(iter_csv_text("A,B\r\n1,2\r\n,,\r\n\r\n3,\n")), [["A", "B"], ["1", "2"], ["3", ""]])
+
+    def test_cr_only_line_endings(self):
+        """Test that lone carriage returns end lines, both in plain and quoted content."""
+        self.assertEqual(parse_csv_data("A,B\r1,2\r3,4\r"), {"header": ["A", "B"], "rows": [["1", "2"], ["3", "4"]]})
+        self.assertEqual(list(iter_csv_text('A,B\r"1,5",2\r\r3,4')), [["A", "B"], ["1,5", "2"], ["3", "4"]])
+
+    def test_quote_free_text_is_split_in_small_chunks(self):
+        """Test that chunked splitting of in-memory text gives the same rows at any chunk size."""
+        content = "A,B\r\n" + "".join(f"{i}, 值{i}\r\n" for i in range(50)) + "\r\n,\r\nlast,row"
+        expected = list(iter_csv_text(content))
+        original_chunk = Taifexdtool.CSV_READ_CHUNK_CHARS
+        Taifexdtool.CSV_READ_CHUNK_CHARS = 5
+        try:
+            self.assertEqual(list(iter_csv_text(content)), expected)
+            self.assertEqual(list(iter_csv_text(content.replace("值", "v"))), [
+                [cell.replace("值", "v") for cell in row] for row in expected])
+        finally:
+            Taifexdtool.CSV_READ_CHUNK_CHARS = original_chunk
+        self.assertEqual(len(expected), 52)
+        self.assertEqual(expected[-1], ["last", "row"])
+
+    def test_parse_csv_file(self):
+        """Test the streaming file parser on the sample file."""
+        self.assertEqual(list(parse_csv_file(self.csv_path)), EXPECTED_ROWS)
+
+    def test_parse_csv_file_switches_to_csv_module_at_first_quote(self):
+        """Test that quote-free chunks are split directly and a later quoted field still parses."""
+        original_chunk = Taifexdtool.CSV_READ_CHUNK_CHARS
+        Taifexdtool.CSV_READ_CHUNK_CHARS = 8 # a few lines per chunk
+        try:
+            with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+                f.write("A,B\r\n1, 2\r\n,\r\n3,4\r\n5,6\r\n\"多行\r\n備註\",7\r\n8,9\r\n")
+            self.assertEqual(list(parse_csv_file(self.csv_path)),
+                             [["A", "B"], ["1", "2"], ["3", "4"], ["5", "6"], ["多行\r\n備註", "7"], ["8", "9"]])
+        finally:
+            Taifexdtool.CSV_READ_CHUNK_CHARS = original_chunk
+
+    def test_parse_csv_file_header_only_without_newline(self):
+        """Test that a header-only file without a trailing newline yields just the header."""
+        with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("A,B")
+        self.assertEqual(list(parse_csv_file(self.csv_path)), [["A", "B"]])
+        summary, serialized_rows, _ = serialize_source(self.csv_path)
+        self.assertIsNone(serialized_rows)
+        self.assertEqual(summary["status"], "成功")
+
+    def test_invalid_utf8_after_first_chunk_fails_only_that_file(self):
+        """Test that a bad byte past the first chunk is reported as a per-file parse failure."""
+        with open(self.csv_path, "wb") as f:
+            f.write(b"A,B\n" + b"1,2\n" * 20 + b"3,\xff\n")
+        original_chunk = Taifexdtool.CSV_READ_CHUNK_CHARS
+        Taifexdtool.CSV_READ_CHUNK_CHARS = 16
+        try:
+            with self.assertLogs(Taifexdtool.logger, level="ERROR"):
+                summary, serialized_rows, _ = parse_and_serialize(self.csv_path)
+        finally:
+            Taifexdtool.CSV_READ_CHUNK_CHARS = original_chunk
+        self.assertIsNone(serialized_rows)
+        self.assertTrue(summary["error_message"].startswith("解析失敗"))
+
+    def test_mismatched_rows_keep_their_row_number(self):
+        """Test that a row with the wrong column count is skipped but still consumes a row number."""
+        with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("A,B\n1,2\n3\n\n4,5\n6,7,8\n9,10\n")
+        _, serialized_rows, stats = serialize_source(self.csv_path)
+        with self.assertLogs(Taifexdtool.logger, level="WARNING"):
+            row_numbers = [row_number for _, row_number, _ in serialized_rows]
+        self.assertEqual(row_numbers, [0, 2, 4])
+        self.assertEqual(stats["rows_seen"], 5)
+
+    def test_parse_csv_file_without_content(self):
+        """Test that a file with only blank lines yields nothing."""
+        with open(self.csv_path, "w", encoding="utf-8") as f:
+            f.write("\n \n")
+        self.assertEqual(list(parse_csv_file(self.csv_path)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+
+# Add the pipeline project directory to the Python path so that its src package can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'taifex_data_pipeline')))
+from src.utils.logger import setup_logger
+setup_logger(log_file_path=os.devnull, log_level="WARNING") # keep the test run from writing taifex_pipeline.log
+from src.config import templates
+from src.pipeline import database
+
+HEADER = ["交易日期", "契約", "收盤價"]
+ROWS = [["2023-10-01", "TX", "16050"], ["2023-10-01"], ["2023-10-02", "TX", "16100"]]
+
+class TestPipelineDatabase(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Initialises a database in a temporary directory."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.addCleanup(database.close_all)
+        self.db_path = os.path.join(self.test_dir.name, "test.sqlite")
+        self.assertTrue(database.init_db(self.db_path))
+
+    def query(self, sql):
+        return database._get_conn(self.db_path).execute(sql).fetchall()
+
+    def test_generic_rows_are_stored_as_json(self):
+        """Test that an unrecognised data type is stored as one JSON object per row in generic_data."""
+        with self.assertLogs(database.logger, level="WARNING"):
+            result = database.insert_structured_data(self.db_path, "a.csv", templates.GENERIC_DATA_TYPE, HEADER, iter(ROWS))
+        self.assertEqual(result, (True, 2))
+        stored = self.query("SELECT row_number, row_content_json FROM generic_data ORDER BY row_number")
+        self.assertEqual([(n, json.loads(j)) for n, j in stored],
+                         [(1, dict(zip(HEADER, ROWS[0]))), (3, dict(zip(HEADER, ROWS[2])))])
+
+    def test_empty_iterator_inserts_nothing_without_warning(self):
+        """Test that an empty row iterator succeeds with zero rows and is logged at INFO, not WARNING."""
+        with self.assertLogs(database.logger, level="INFO") as logs:
+            self.assertEqual(database.insert_structured_data(self.db_path, "empty.csv", templates.GENERIC_DATA_TYPE, HEADER, iter([])), (True, 0))
+        self.assertEqual([record.levelname for record in logs.records], ["INFO", "INFO"])
+        self.assertFalse(database._get_conn(self.db_path).in_transaction)
+
+    def test_template_type_is_stored_in_typed_table(self):
+        """Test that a recognised data type is written column by column into its own table."""
+        original_templates = dict(templates.DATA_TYPE_TEMPLATES)
+        templates.DATA_TYPE_TEMPLATES["futures_daily"] = ("交易日期", "收盤價")
+        self.addCleanup(setattr, templates, "DATA_TYPE_TEMPLATES", original_templates)
+        data_type = templates.match_data_type(HEADER)
+        self.assertEqual(data_type, "futures_daily")
+        self.assertEqual(templates.match_data_type(["交易日期"]), templates.GENERIC_DATA_TYPE)
+
+        for file_source in ("a.csv", "b.csv"):
+            with self.assertLogs(database.logger, level="WARNING"):
+                result = database.insert_structured_data(self.db_path, file_source, data_type, HEADER, iter(ROWS))
+            self.assertEqual(result, (True, 2))
+        self.assertEqual(self.query('SELECT file_source, row_number, "契約", "收盤價" FROM futures_daily ORDER BY id'),
+                         [("a.csv", 1, "TX", "16050"), ("a.csv", 3, "TX", "16100"),
+                          ("b.csv", 1, "TX", "16050"), ("b.csv", 3, "TX", "16100")])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM generic_data"), [(0,)])
+
+    def test_mismatched_header_falls_back_to_generic_data(self):
+        """Test that a header unusable as columns, or differing from the existing table, goes to generic_data."""
+        self.assertTrue(database.insert_structured_data(self.db_path, "a.csv", "futures_daily", HEADER, [ROWS[0]])[0])
+        with self.assertLogs(database.logger, level="WARNING"):
+            database.insert_structured_data(self.db_path, "b.csv", "futures_daily", HEADER[:2], [ROWS[0][:2]])
+        with self.assertLogs(database.logger, level="WARNING"):
+            database.insert_structured_data(self.db_path, "c.csv", "options_daily", ["id", "契約"], [["1", "TXO"]])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM futures_daily"), [(1,)])
+        self.assertEqual(self.query("SELECT file_source FROM generic_data ORDER BY id"), [("b.csv",), ("c.csv",)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import bz2
+import gzip
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import zipfile
+
+# Add the pipeline project directory to the Python path so that its src package can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'taifex_data_pipeline')))
+from src.utils.logger import setup_logger
+setup_logger(log_file_path=os.devnull, log_level="WARNING") # keep the test run from writing taifex_pipeline.log
+from src.config import settings
+from src.pipeline import file_handler
+from src.pipeline.file_handler import _sniff_mime_type, get_file_mime_type, extract_archive
+
+CSV_CONTENT = "日期,收盤價\n2023-10-01,16050\n2023-10-02,16100\n".encode("utf-8")
+
+class TestSniffMimeType(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Creates a temporary directory for archive fixtures."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+
+    def head_of(self, file_name):
+        with open(os.path.join(self.test_dir.name, file_name), "rb") as f:
+            return f.read(file_handler.MIME_SNIFF_BYTES)
+
+    def write_file(self, file_name, data):
+        path = os.path.join(self.test_dir.name, file_name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_text_heads_are_left_to_libmagic(self):
+        """Test that text heads are not short-circuited and libmagic tells CSV from HTML, JSON and PDF."""
+        self.assertEqual(_sniff_mime_type(b""), "inode/x-empty")
+        self.assertIsNone(_sniff_mime_type(CSV_CONTENT))
+        self.assertIn(get_file_mime_type(self.write_file("data.csv", CSV_CONTENT)), ("text/csv", "text/plain"))
+        skipped_heads = {
+            "page.csv": b"<!DOCTYPE html>\n<html><body><p>a, b, c</p></body></html>\n",
+            "data.json": b'{"date": "2023-10-01", "close": [16050, 16100]}\n',
+            "doc.csv": b"%PDF-1.4\n1 0 obj, 2 0 obj\n",
+        }
+        for file_name, head in skipped_heads.items():
+            with self.subTest(file=file_name):
+                self.assertIsNone(_sniff_mime_type(head))
+                self.assertNotIn(get_file_mime_type(self.write_file(file_name, head)), settings.SUPPORTED_MIME_TYPES)
+
+    def test_stored_zip_is_not_text(self):
+        """Test that a stored (uncompressed) zip of a CSV is not mistaken for text."""
+        zip_path = os.path.join(self.test_dir.name, "data.zip")
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            archive.writestr("data.csv", CSV_CONTENT * 20)
+        self.assertIsNone(_sniff_mime_type(self.head_of("data.zip")))
+        self.assertEqual(get_file_mime_type(zip_path), "application/zip")
+
+    def test_gzip_and_bz2_heads(self):
+        """Test that gzip and bzip2 heads are recognised by their magic numbers."""
+        with open(os.path.join(self.test_dir.name, "data.csv.gz"), "wb") as f:
+            f.write(gzip.compress(CSV_CONTENT))
+        with open(os.path.join(self.test_dir.name, "data.csv.bz2"), "wb") as f:
+            f.write(bz2.compress(CSV_CONTENT))
+        self.assertEqual(_sniff_mime_type(self.head_of("data.csv.gz")), "application/gzip")
+        self.assertEqual(_sniff_mime_type(self.head_of("data.csv.bz2")), "application/x-bzip2")
+
+    def test_tar_head(self):
+        """Test that an uncompressed tar is recognised by its ustar marker."""
+        with tarfile.open(os.path.join(self.test_dir.name, "data.tar"), "w", format=tarfile.USTAR_FORMAT) as archive:
+            member = tarfile.TarInfo("data.csv")
+            member.size = len(CSV_CONTENT)
+            archive.addfile(member, io.BytesIO(CSV_CONTENT))
+        self.assertEqual(_sniff_mime_type(self.head_of("data.tar")), "application/x-tar")
+
+class TestExtractArchive(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Creates a temporary directory holding the archives and their output."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.output_dir = os.path.join(self.test_dir.name, "out")
+
+    def archive_path(self, file_name):
+        return os.path.join(self.test_dir.name, file_name)
+
+    def add_tar_member(self, archive, name, data):
+        member = tarfile.TarInfo(name)
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+
+    def assert_extracted(self, archive_name, file_category, expected_names):
+        extracted = extract_archive(self.archive_path(archive_name), self.output_dir, file_category)
+        self.assertEqual(sorted(os.path.relpath(path, self.output_dir) for path in extracted), sorted(expected_names))
+        for path in extracted:
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), CSV_CONTENT)
+
+    def test_zip_round_trip(self):
+        """Test that every member of a zip, including subdirectories, is extracted unchanged."""
+        with zipfile.ZipFile(self.archive_path("data.zip"), "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("a.csv", CSV_CONTENT)
+            archive.writestr("sub/b.csv", CSV_CONTENT)
+        self.assert_extracted("data.zip", "zip", ["a.csv", os.path.join("sub", "b.csv")])
+
+    def test_tar_round_trip(self):
+        """Test that plain, gzip- and bzip2-compressed tars are extracted unchanged."""
+        for archive_name, mode, file_category in (("data.tar", "w", "tar"), ("data.tar.gz", "w:gz", "gz"), ("data.tar.bz2", "w:bz2", "bz2")):
+            with self.subTest(archive=archive_name):
+                with tarfile.open(self.archive_path(archive_name), mode) as archive:
+                    self.add_tar_member(archive, "a.csv", CSV_CONTENT)
+                    self.add_tar_member(archive, "sub/b.csv", CSV_CONTENT)
+                self.assert_extracted(archive_name, file_category, ["a.csv", os.path.join("sub", "b.csv")])
+
+    def test_single_file_round_trip(self):
+        """Test that a .gz or .bz2 of a single file is decompressed to the name without the suffix."""
+        with open(self.archive_path("data.csv.gz"), "wb") as f:
+            f.write(gzip.compress(CSV_CONTENT))
+        with open(self.archive_path("data.csv.bz2"), "wb") as f:
+            f.write(bz2.compress(CSV_CONTENT))
+        self.assert_extracted("data.csv.gz", "gz", ["data.csv"])
+        self.assert_extracted("data.csv.bz2", "bz2", ["data.csv"])
+
+    @unittest.skipUnless(shutil.which("pugz") or shutil.which("pigz"), "neither pugz nor pigz is installed")
+    def test_parallel_gunzip_round_trip(self):
+        """Test that a .gz over the size threshold is decompressed by pugz/pigz unchanged."""
+        with open(self.archive_path("data.csv.gz"), "wb") as f:
+            f.write(gzip.compress(CSV_CONTENT))
+        original_min_bytes = settings.PARALLEL_GZIP_MIN_BYTES
+        settings.PARALLEL_GZIP_MIN_BYTES = 0
+        self.addCleanup(setattr, settings, "PARALLEL_GZIP_MIN_BYTES", original_min_bytes)
+        self.assert_extracted("data.csv.gz", "gz", ["data.csv"])
+
+    @unittest.skipUnless(hasattr(tarfile, "data_filter"), "tarfile extraction filters are not available")
+    def test_tar_path_traversal_is_rejected(self):
+        """Test that a tar member escaping the output directory is refused and nothing is written outside it."""
+        with tarfile.open(self.archive_path("evil.tar"), "w") as archive:
+            self.add_tar_member(archive, "../evil.csv", CSV_CONTENT)
+        with self.assertLogs(file_handler.logger, level="ERROR"):
+            self.assertEqual(extract_archive(self.archive_path("evil.tar"), self.output_dir, "tar"), [])
+        self.assertFalse(os.path.exists(self.archive_path("evil.csv")))
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_zip_path_traversal_stays_inside(self):
+        """Test that a zip member with .. components is extracted inside the output directory."""
+        with zipfile.ZipFile(self.archive_path("evil.zip"), "w") as archive:
+            archive.writestr("../evil.csv", CSV_CONTENT)
+        self.assert_extracted("evil.zip", "zip", ["evil.csv"])
+        self.assertFalse(os.path.exists(self.archive_path("evil.csv")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import logging
+import os
+import sys
+import tempfile
+from unittest import mock
+
+# Add the pipeline project directory to the Python path so that its src package can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'taifex_data_pipeline')))
+from src.utils.logger import setup_logger
+setup_logger(log_file_path=os.devnull, log_level="WARNING") # keep the test run from writing taifex_pipeline.log
+from src.config import settings
+from src.utils import logger as pipeline_logger
+from src import orchestrator
+
+class TestParsedFiles(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Writes a few CSV files to a temporary directory."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.paths = []
+        for i, content in enumerate(["A,B\n1,2\n", "\n\n", "日期,收盤價\n2023-10-01,16050\n2023-10-02,16100\n"]):
+            path = os.path.join(self.test_dir.name, f"{i}.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            self.paths.append(path)
+
+    def test_worker_pool_matches_streaming(self):
+        """Test that the process pool returns the same headers and rows, in order, as streaming in-process."""
+        with mock.patch.object(settings, "PARSE_WORKERS", 1):
+            expected = [(header, list(rows)) for header, rows in orchestrator._iter_parsed_files(self.paths)]
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        with mock.patch.object(settings, "PARSE_WORKERS", 2), \
+             mock.patch.object(pipeline_logger._log_listener, "handlers", (handler,)):
+            self.assertEqual([(header, list(rows)) for header, rows in orchestrator._iter_parsed_files(self.paths)], expected)
+        # The empty file's warning is logged in a worker and written out by the parent process.
+        self.assertTrue(any(record.levelno == logging.WARNING and record.process != os.getpid() for record in records))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import csv
+import io
+import os
+import sys
+import tempfile
+
+# Add the pipeline project directory to the Python path so that its src package can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'taifex_data_pipeline')))
+from src.utils.logger import setup_logger
+setup_logger(log_file_path=os.devnull, log_level="WARNING") # keep the test run from writing taifex_pipeline.log
+from src.pipeline import parser
+
+# Each case is parsed with chunks small enough that several lines, and the quoted fields, span chunk boundaries.
+CSV_CASES = {
+    "quoted_multiline": 'A,B\n1,"x\ny"\n"a, b", 2 \n3,"say ""hi"""\n',
+    "crlf": "A,B\r\n 1 ,2\r\n\r\n3,4\r\n",
+    "crlf_quoted": 'A,B\r\n1,"x\r\ny"\r\n3,4\r\n',
+    "cr_only": "A,B\r1,2\r\r3,4\r",
+    "cr_only_quoted": 'A,B\r1,"x\ry"\r3,4\r',
+    "blank_lines": "\n \n,,\nA,B,C\n\n1,2,3\n , , \n4,5,6",
+    "header_only": "A,B",
+    "header_only_with_newline": "\n A , B \n\n",
+    "quote_after_first_chunk": "A,B\n" + "".join(f"{i},值{i}\n" for i in range(40)) + '"多行\n備註",1\n9,9\n',
+    "non_ascii_padding": "日期,收盤價\n2023-10-01,　16050　\n",
+    "mismatched_columns": 'A,B\n1,"x"\n2\n3,4,5\n6,7\n',
+}
+
+def reference_rows(content):
+    """Rows as plain csv.reader yields them, stripped and without blank rows."""
+    rows = ([cell.strip() for cell in row] for row in csv.reader(io.StringIO(content, newline="")))
+    return [row for row in rows if any(row)]
+
+class TestPipelineCsvParser(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Creates a temporary directory and shrinks the read chunk size."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        original_chunk = parser.CSV_READ_CHUNK_CHARS
+        parser.CSV_READ_CHUNK_CHARS = 7
+        self.addCleanup(setattr, parser, "CSV_READ_CHUNK_CHARS", original_chunk)
+
+    def write_csv(self, name, content):
+        path = os.path.join(self.test_dir.name, name + ".csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        return path
+
+    def test_matches_csv_reader(self):
+        """Test that the split fast path and csv.reader fallback agree with plain csv.reader, mismatched rows included."""
+        for name, content in CSV_CASES.items():
+            with self.subTest(case=name):
+                path = self.write_csv(name, content)
+                expected = reference_rows(content)
+                self.assertEqual(list(parser._iter_header_and_rows(path, "utf-8", ",")), expected)
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    self.assertEqual(list(parser._iter_cleaned_rows(f, ",")), expected)
+                header, rows = parser.parse_csv_stream(path)
+                self.assertEqual([header] + list(rows) if header else [], expected)
+
+    def test_read_header_and_iter_rows(self):
+        """Test that read_header and iter_rows split the same file into header and data rows."""
+        path = self.write_csv("quoted", CSV_CASES["quoted_multiline"])
+        expected = reference_rows(CSV_CASES["quoted_multiline"])
+        self.assertEqual(parser.read_header(path), expected[0])
+        self.assertEqual(list(parser.iter_rows(path)), expected[1:])
+
+class TestPipelineEncodingDetection(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Creates a temporary directory for the encoded files."""
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+
+    def write_bytes(self, name, data):
+        path = os.path.join(self.test_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_bom(self):
+        """Test that a UTF-8 BOM is detected and stripped from the first header cell."""
+        path = self.write_bytes("bom.csv", "\ufeff日期,收盤價\n2023-10-01,16050\n".encode("utf-8"))
+        self.assertEqual(parser._detect_encoding(path), "utf-8-sig")
+        self.assertEqual(parser.read_header(path), ["日期", "收盤價"])
+
+    def test_utf8(self):
+        """Test that UTF-8 content, and pure ASCII content, is read as UTF-8."""
+        path = self.write_bytes("utf8.csv", "日期,收盤價\n2023-10-01,16050\n".encode("utf-8"))
+        self.assertEqual(parser._detect_encoding(path), "utf-8")
+        ascii_path = self.write_bytes("ascii.csv", b"A,B\n" * 2000)
+        self.assertEqual(parser._detect_encoding(ascii_path), "utf-8")
+
+    def test_cp950(self):
+        """Test that cp950 content is detected from the header."""
+        path = self.write_bytes("cp950.csv", "日期,收盤價\n2023-10-01,16050\n".encode("cp950"))
+        self.assertEqual(parser._detect_encoding(path), "cp950")
+        self.assertEqual(parser.read_header(path), ["日期", "收盤價"])
+
+    def test_cp950_after_ascii_head(self):
+        """Test that cp950 text first appearing beyond the sniffed head is still detected."""
+        ascii_rows = "".join(f"2023-10-01,TX,{16000 + i}\n" for i in range(1000))
+        self.assertGreater(len(ascii_rows), parser.ENCODING_SNIFF_BYTES)
+        content = "date,contract,close\n" + ascii_rows + "2023-10-02,臺指,16100\n"
+        path = self.write_bytes("late_cp950.csv", content.encode("cp950"))
+        original_scan_chunk = parser.ENCODING_SCAN_CHUNK_BYTES
+        parser.ENCODING_SCAN_CHUNK_BYTES = 1000 # several ASCII-only chunks before the cp950 one
+        self.addCleanup(setattr, parser, "ENCODING_SCAN_CHUNK_BYTES", original_scan_chunk)
+        self.assertEqual(parser._detect_encoding(path), "cp950")
+        header, rows = parser.parse_csv_stream(path)
+        rows = list(rows)
+        self.assertEqual(header, ["date", "contract", "close"])
+        self.assertEqual(len(rows), 1001)
+        self.assertEqual(rows[-1], ["2023-10-02", "臺指", "16100"])
+
+if __name__ == '__main__':
+    unittest.main()
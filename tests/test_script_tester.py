@@ -9,40 +9,41 @@ from test import apply_template_to_csv, DATA_RECOGNITION_TEMPLATES # Import nece
 
 class TestApplyTemplate(unittest.TestCase):
 
-    def setUp(self):
-        """Create a temporary CSV file for testing."""
-        self.test_csv_filename = "test_input.csv"
+    @classmethod
+    def setUpClass(cls):
+        """Create the temporary CSV file and pick the standard template once; no test modifies either."""
+        cls.test_csv_filename = "test_input.csv"
         # Ensure tests run in the same directory as the test file itself,
         # so test_input.csv is created where expected.
-        self.test_dir = os.path.dirname(os.path.abspath(__file__))
-        self.test_csv_path = os.path.join(self.test_dir, self.test_csv_filename)
+        cls.test_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.test_csv_path = os.path.join(cls.test_dir, cls.test_csv_filename)
 
-        self.csv_content = [
+        cls.csv_content = [
             ["Col1", "Col2", "Col3"],
             ["Data1", "Data2", "Data3"],
             ["Data4", "Data5", "Data6"]
         ]
-        with open(self.test_csv_path, 'w', newline='', encoding='utf-8') as f:
+        with open(cls.test_csv_path, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
-            writer.writerows(self.csv_content)
+            writer.writerows(cls.csv_content)
 
         # Find a standard template (assuming one exists with default comma/utf-8)
-        self.standard_template = next(
+        cls.standard_template = next(
             (t for t in DATA_RECOGNITION_TEMPLATES if t['parser_params']['delimiter'] == ',' and t['parser_params']['encoding'] == 'utf-8' and t['parser_params']['skiprows'] == 0),
             None # Default to None if not found, though test might fail earlier
         )
-        if self.standard_template is None:
+        if cls.standard_template is None:
             # Fallback to a manually defined one if not found in global list, just in case
-            self.standard_template = {
+            cls.standard_template = {
                 "template_name": "Test Standard", 
                 "parser_params": {"delimiter": ",", "skiprows": 0, "encoding": "utf-8"}
             }
 
-
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         """Remove the temporary CSV file."""
-        if os.path.exists(self.test_csv_path):
-            os.remove(self.test_csv_path)
+        if os.path.exists(cls.test_csv_path):
+            os.remove(cls.test_csv_path)
 
     def test_successful_parse_standard_csv(self):
         """Test successful parsing with a standard CSV template."""
@@ -0,0 +1,72 @@
+import unittest
+import os
+import json
+import sys
+
+# Add the parent directory (root of the repository) to the Python path
+# so that the Taifexdtool module can be imported.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import Taifexdtool
+from Taifexdtool import make_row_serializer
+
+HEADER = ["日期", "契約", "收盤價", 'quote"d\\key']
+ROW = ["2023/10/01", "TX", "16,050", "多行\n備註\t\"引號\""]
+
+class TestRowSerializer(unittest.TestCase):
+    def setUp(self):
+        """Ran before each test. Remembers the optional JSON encoder so it can be toggled."""
+        self.original_orjson = Taifexdtool.orjson
+
+    def tearDown(self):
+        """Ran after each test. Restores the optional JSON encoder."""
+        Taifexdtool.orjson = self.original_orjson
+
+    def test_template_matches_json_dumps(self):
+        """Test that the precompiled stdlib template is byte-for-byte compact json.dumps output."""
+        Taifexdtool.orjson = None
+        serialize = make_row_serializer(HEADER)
+        self.assertEqual(serialize(ROW), json.dumps(dict(zip(HEADER, ROW)), ensure_ascii=False, separators=(",", ":")))
+
+    @unittest.skipIf(Taifexdtool.orjson is None, "orjson is not installed")
+    def test_orjson_and_template_produce_identical_text(self):
+        """Test that installing orjson does not change the stored data_json text."""
+        with_orjson = make_row_serializer(HEADER)(ROW)
+        Taifexdtool.orjson = None
+        self.assertEqual(with_orjson, make_row_serializer(HEADER)(ROW))
+
+    @unittest.skipIf(Taifexdtool.orjson is None, "orjson is not installed")
+    def test_orjson_round_trips_to_the_same_object(self):
+        """Test that the orjson path returns text that decodes to the same row mapping."""
+        serialize = make_row_serializer(HEADER)
+        data_json = serialize(ROW)
+        self.assertIsInstance(data_json, str)
+        self.assertEqual(json.loads(data_json), dict(zip(HEADER, ROW)))
+
+    def test_array_format_matches_json_dumps_of_the_row(self):
+        """Test that the array format encodes just the values, in column order, on every path."""
+        for encoder in {self.original_orjson, None}:
+            Taifexdtool.orjson = encoder
+            serialize = make_row_serializer(HEADER, row_format="array")
+            self.assertEqual(json.loads(serialize(ROW)), ROW)
+        Taifexdtool.orjson = None
+        self.assertEqual(make_row_serializer(HEADER, row_format="array")(ROW), json.dumps(ROW, ensure_ascii=False, separators=(",", ":")))
+
+    def test_unserializable_value_raises_type_error_on_every_path(self):
+        """Test that a cell value JSON cannot represent raises TypeError whichever serializer is used."""
+        for encoder in {self.original_orjson, None}:
+            Taifexdtool.orjson = encoder
+            for header, row_format in ((HEADER[:1], "object"), (["A", "A"], "object"), (HEADER[:1], "array")):
+                with self.subTest(orjson=encoder is not None, header=header, row_format=row_format):
+                    serialize = make_row_serializer(header, row_format)
+                    with self.assertRaises(TypeError):
+                        serialize([object()] * len(header))
+
+    def test_duplicate_header_keeps_last_value(self):
+        """Test that a repeated column name keeps the value of its last occurrence on every path."""
+        for encoder in {self.original_orjson, None}:
+            Taifexdtool.orjson = encoder
+            serialize = make_row_serializer(["A", "B", "A"])
+            self.assertEqual(json.loads(serialize(["1", "2", "3"])), {"A": "3", "B": "2"})
+
+if __name__ == '__main__':
+    unittest.main()